@@ -88,14 +88,28 @@ void Ensaio::setFrequencia(float frequencia){
 
 	// Calcula o número de ciclos completos necessários para obter as amostras
 	ciclosCapturar = ceil(AMOSTRAS_CAPTURADAS/(TX_AMOSTRAGEM/_frequencia));
+
+	// Reinicia a detecção do regime permanente (blocos de ciclos completos)
+	ciclosRegime = 0xFFFF;
+	_ciclosBloco = ceil(AMOSTRAS_BLOCO_REGIME/(TX_AMOSTRAGEM/_frequencia));
+	_ciclosNoBloco = 0;
+	for (int k = 0; k < 4; k++){
+		_somasBloco[k] = 0;
+	}
+	_blocoPronto = false;
+	_emRegime = false;
+	_zAnterior[0] = 0;
+	_zAnterior[1] = 0;
+	_convergencias = 0;
 }
 
 
 void Ensaio::iniciaEnsaio(){
 	// Inicia o ensaio
 
-	// Seta a frequencia inicial
-	setFrequencia(_freqIni);
+	// Seta a frequencia inicial (ou a primeira da lista)
+	_iLista = 0;
+	setFrequencia((_nLista > 0) ? _lista[0] : _freqIni);
 
 	// Zera todos os contadores
 	uAcumuladorFase = 0;
@@ -109,7 +123,9 @@ void Ensaio::iniciaEnsaio(){
 	impMagMSB.clear();
 	impFasLSB.clear();
 	impFasMSB.clear();
+	_temposRegime.clear();
 	
+	_fimContinuo = false;
 	continuar_ensaio = true;
 
 	// Ativa a interrupção
@@ -133,11 +149,25 @@ void Ensaio::InterrupcaoTC4(){
 		uAcumuladorFase -= AMOSTRAS_POR_CICLO_FP;
 		ciclosRealizados++;
 
+		// Regime adaptativo: fecha o bloco de ciclos para o loop principal
+		if ((_tolRegime > 0) and !_emRegime and (++_ciclosNoBloco >= _ciclosBloco)){
+			for (int k = 0; k < 4; k++){
+				_somasProntas[k] = _somasBloco[k];
+				_somasBloco[k] = 0;
+			}
+			_ciclosNoBloco = 0;
+			_blocoPronto = true;
+		}
+
 		// Caso não esteja no regime permanente
-		if (ciclosRealizados < _fatorRegime*_frequencia) {
+		if (!_emRegime and (ciclosRealizados < _fatorRegime*_frequencia)) {
 			// Reseta o contador de amostras
 			indiceAmostras = 0;
 		}
+		// Primeiro ciclo completo capturado: a captura começou no ciclo anterior
+		else if (ciclosRegime == 0xFFFF){
+			ciclosRegime = ciclosRealizados - 1;
+		}
 	}
 
 	// Caso exceda o número de amostras capturadas
@@ -168,6 +198,17 @@ void Ensaio::InterrupcaoTC4(){
 	// Grava o valor da entrada analógica
 	amostrasEntrada[indiceAmostras] = entradaAnalogica;
 
+	// Regime adaptativo: somas em fase e quadratura com a tabela do seno
+	if ((_tolRegime > 0) and !_emRegime){
+		uint32_t i = uAcumuladorFase >> 20;
+		int32_t seno = nTabelaSeno[i] - 2048;
+		int32_t cosseno = nTabelaSeno[(i + AMOSTRAS_POR_CICLO/4) % AMOSTRAS_POR_CICLO] - 2048;
+		_somasBloco[0] += (int32_t)entradaTensao*cosseno;
+		_somasBloco[1] += (int32_t)entradaTensao*seno;
+		_somasBloco[2] += (int32_t)entradaAnalogica*cosseno;
+		_somasBloco[3] += (int32_t)entradaAnalogica*seno;
+	}
+
 	// Incrementa o indice das amostras capturadas
 	indiceAmostras++;
 
@@ -181,48 +222,78 @@ void Ensaio::atualizaEnsaio(){
 
 	if (continuar_ensaio == true){
 
+		// Regime adaptativo: compara o bloco de ciclos fechado com o anterior
+		if (_blocoPronto){
+			verificaRegime();
+		}
+
 		// Se já capturou todas as amostras para a frequência atual
 		if (indiceAmostras >= AMOSTRAS_CAPTURADAS){
 			
+			// Ensaio com uma lista de frequências
+			bool lista = (_nLista > 0);
+
 			// Se foi um ensaio com uma única frequencia
-			if (abs(_passo) == 0 or _freqIni == _freqFim){
+			if (!lista and (abs(_passo) == 0 or _freqIni == _freqFim)){
 				// Desativa a interrupção
 				NVIC_DisableIRQ(TC4_IRQn);
 				// Seta o DAC no valor zero
 				analogWrite(DAC0,2048);
 				
 				continuar_ensaio = false;
+				_modoContinuo = false;
+				_modoBruto = false;
+				guardaTempoRegime();
+				_tolRegime = 0;
 				
-				// Envia os valores das amostras da saída
-				enviaValores(amostrasSaida, AMOSTRAS_CAPTURADAS);
+				// Envia os valores das amostras da saída (cancelado pelo computador com esc)
+				if (!enviaValores(amostrasSaida, AMOSTRAS_CAPTURADAS)) return;
 				// Envia os valores das amostras da entrada
 				enviaValores(amostrasEntrada, AMOSTRAS_CAPTURADAS);					
 			}			
 			
-			// Se já terminou um ensaio de múltiplas frequências
-			else if (_frequencia > _freqFim){	
+			// Se já terminou um ensaio de múltiplas frequências (ou a lista)
+			else if (lista ? (_iLista >= _nLista) : (_frequencia > _freqFim)){	
 				// Desativa a interrupção
 				NVIC_DisableIRQ(TC4_IRQn);
 				// Seta o DAC no valor zero
 				analogWrite(DAC0,2048);
 				
 				continuar_ensaio = false;
+				// A lista e o regime adaptativo valem apenas para um ensaio
+				_nLista = 0;
+				_tolRegime = 0;
+				
+				// No modo de amostras uma transferência vazia encerra o ensaio
+				if (_modoBruto){
+					_modoBruto = false;
+					enviaValores(amostrasSaida, 0);
+					return;
+				}
 				
-				// Envia os valores das frequencias do ensaio
+				// No ensaio contínuo os pontos já foram enviados
+				if (_modoContinuo){
+					_modoContinuo = false;
+					_fimContinuo = true;
+					enviaFimPontos(impFreqLSB.size());
+					return;
+				}
+				
+				// Envia os valores das frequencias do ensaio (um envio cancelado com esc encerra os demais)
 				uint16_t *impFreqLSB_Ptr = &impFreqLSB[0];
-				enviaValores(impFreqLSB_Ptr, impFreqLSB.size());
+				if (!enviaValores(impFreqLSB_Ptr, impFreqLSB.size())) return;
 				uint16_t *impFreqMSB_Ptr = &impFreqMSB[0];
-				enviaValores(impFreqMSB_Ptr, impFreqMSB.size());
+				if (!enviaValores(impFreqMSB_Ptr, impFreqMSB.size())) return;
 				
 				// Envia os valores das magnitudes da impedancia
 				uint16_t *impMagLSB_Ptr = &impMagLSB[0];
-				enviaValores(impMagLSB_Ptr, impMagLSB.size());
+				if (!enviaValores(impMagLSB_Ptr, impMagLSB.size())) return;
 				uint16_t *impMagMSB_Ptr = &impMagMSB[0];
-				enviaValores(impMagMSB_Ptr, impMagMSB.size());
+				if (!enviaValores(impMagMSB_Ptr, impMagMSB.size())) return;
 				
 				// Envia os valores das fases da impedancia
 				uint16_t *impFasLSB_Ptr = &impFasLSB[0];
-				enviaValores(impFasLSB_Ptr, impFasLSB.size());
+				if (!enviaValores(impFasLSB_Ptr, impFasLSB.size())) return;
 				uint16_t *impFasMSB_Ptr = &impFasMSB[0];
 				enviaValores(impFasMSB_Ptr, impFasMSB.size());
 			}
@@ -233,17 +304,44 @@ void Ensaio::atualizaEnsaio(){
 				NVIC_DisableIRQ(TC4_IRQn);
 				// Seta o DAC no valor zero
 				analogWrite(DAC0,2048);
+				guardaTempoRegime();
 				
+				// Envia a frequência e as amostras sem calcular a impedância
+				// (o computador calcula; um envio cancelado com esc encerra o ensaio)
+				if (_modoBruto){
+					uint16_t* freqPtr = (uint16_t*)(&_frequencia);
+					if (!enviaValores(freqPtr, 2) or
+						!enviaValores(amostrasSaida, AMOSTRAS_CAPTURADAS) or
+						!enviaValores(amostrasEntrada, AMOSTRAS_CAPTURADAS)){
+						interrompeEnsaio();
+						return;
+					}
+				}
 				// Calcula a impedancia para essa frequencia
-				if (_metodoImp == 0){
+				else if (_metodoImp == 0){
 					calculaImpedanciaSWF();
 				}
 				else if (_metodoImp == 1){
 					calculaImpedanciaZC();
 				}
 
+				// Envia o ponto calculado
+				if (_modoContinuo){
+					reenviaPonto(impFreqLSB.size() - 1);
+				}
+
+				// Próxima frequência da lista
+				if (lista){
+					_iLista++;
+					// Fim da lista: encerra sem capturar outra frequência
+					if (_iLista >= _nLista){
+						indiceAmostras = AMOSTRAS_CAPTURADAS;
+						return;
+					}
+					setFrequencia(_lista[_iLista]);
+				}
 				// Caso esteja nas frequencias relevantes
-				if ((_frequencia > _freqRelIni) and (_frequencia < _freqRelFim)){
+				else if ((_frequencia > _freqRelIni) and (_frequencia < _freqRelFim)){
 					setFrequencia(_frequencia*_passoRel);
 				}
 				// Caso não esteja nas frequencias relevantes
@@ -457,6 +555,101 @@ void Ensaio::calculaImpedanciaSWF(){
 	impFasMSB.push_back(impFasPtr[1]);
 }
 
+void Ensaio::setModoContinuo(bool continuo){
+	_modoContinuo = continuo;
+}
+
+void Ensaio::setModoBruto(bool bruto){
+	_modoBruto = bruto;
+}
+
+void Ensaio::setListaFrequencias(const float* frequencias, uint8_t n){
+	// Frequências medidas no próximo ensaio, na ordem recebida
+	for (int i = 0; i < n; i++){
+		_lista[i] = frequencias[i];
+	}
+	_nLista = n;
+}
+
+void Ensaio::setModoRegime(float tolerancia){
+	_tolRegime = tolerancia;
+}
+
+void Ensaio::verificaRegime(){
+	// Somas do último bloco (copiadas sem a interrupção)
+	NVIC_DisableIRQ(TC4_IRQn);
+	float tensaoC = _somasProntas[0];
+	float tensaoS = _somasProntas[1];
+	float correnteC = _somasProntas[2];
+	float correnteS = _somasProntas[3];
+	_blocoPronto = false;
+	NVIC_EnableIRQ(TC4_IRQn);
+
+	// Impedância do bloco (sem calibração): tensão/corrente em fase e quadratura
+	float den = correnteC*correnteC + correnteS*correnteS;
+	if (den == 0) return;
+	float zR = (tensaoC*correnteC + tensaoS*correnteS)/den;
+	float zI = (tensaoS*correnteC - tensaoC*correnteS)/den;
+
+	// Variação em relação ao bloco anterior
+	float variacao = hypot(zR - _zAnterior[0], zI - _zAnterior[1]);
+	if (variacao <= _tolRegime*hypot(zR, zI)){
+		_convergencias++;
+	}
+	else{
+		_convergencias = 0;
+	}
+	_zAnterior[0] = zR;
+	_zAnterior[1] = zI;
+
+	// A captura segue a partir do início do ciclo atual (sem novo reset)
+	if (_convergencias >= BLOCOS_REGIME){
+		_emRegime = true;
+	}
+}
+
+void Ensaio::guardaTempoRegime(){
+	// Tempo até o início da captura da frequência atual [ms]
+	uint16_t ciclos = (ciclosRegime == 0xFFFF) ? ciclosRealizados : ciclosRegime;
+	_temposRegime.push_back(min(1000.0*ciclos/_frequencia, 65535.0));
+}
+
+void Ensaio::enviaTemposRegime(){
+	// Um valor por ponto do último ensaio, na ordem medida
+	enviaValores(_temposRegime.data(), _temposRegime.size());
+}
+
+void Ensaio::interrompeEnsaio(){
+	// Cancela a varredura em andamento (esc recebido fora de uma mensagem)
+	if (continuar_ensaio == false) return;
+
+	// Desativa a interrupção
+	NVIC_DisableIRQ(TC4_IRQn);
+	// Seta o DAC no valor zero
+	analogWrite(DAC0,2048);
+
+	continuar_ensaio = false;
+	_modoContinuo = false;
+	_modoBruto = false;
+	_nLista = 0;
+	_tolRegime = 0;
+}
+
+void Ensaio::reenviaPonto(uint16_t indice){
+	// Pedido do fim do ensaio contínuo
+	if (indice == 0xFFFF){
+		if (_fimContinuo) enviaFimPontos(impFreqLSB.size());
+		return;
+	}
+
+	if (indice >= impFreqLSB.size()) return;
+
+	uint16_t palavras[6] = {impFreqLSB[indice], impFreqMSB[indice],
+							impMagLSB[indice], impMagMSB[indice],
+							impFasLSB[indice], impFasMSB[indice]};
+	enviaPonto(indice, palavras);
+}
+
 void Ensaio::setFreqIni(float frequenciaInicial){
 		_freqIni = frequenciaInicial;
 		// Caso a frequencia relevante não seja definida
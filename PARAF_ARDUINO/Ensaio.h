@@ -64,6 +64,8 @@ public:
 	uint16_t ciclosCapturar;
 	// Ciclos de onda completos já realizados para a frequência atual
 	uint16_t ciclosRealizados;
+	// Ciclos até o início da captura (0xFFFF enquanto não começou)
+	volatile uint16_t ciclosRegime;
 
 	// Buffer que armazena os valores das amostras enviadas e recebidas
 	uint16_t amostrasSaida[AMOSTRAS_CAPTURADAS+1];
@@ -81,6 +83,37 @@ public:
 
 	bool continuar_ensaio = false;
 
+	// Envia cada ponto assim que é calculado (apenas no próximo ensaio)
+	bool _modoContinuo = false;
+	// Ensaio contínuo concluído (permite reenviar o fim)
+	bool _fimContinuo = false;
+	// Envia as amostras de cada frequência em vez da impedância (apenas no próximo ensaio)
+	bool _modoBruto = false;
+
+	// Lista de frequências do próximo ensaio (substitui a varredura pelos passos)
+	float _lista[LISTA_MAX];
+	uint8_t _nLista = 0;
+	uint8_t _iLista = 0;
+
+	// Regime permanente adaptativo (apenas no próximo ensaio): a captura começa
+	// quando a impedância de blocos seguidos de ciclos varia menos que a tolerância
+	// (0 = espera fixa); _fatorRegime passa a ser a espera máxima
+	const static int AMOSTRAS_BLOCO_REGIME = 2048;	// Amostras mínimas de um bloco
+	const static uint8_t BLOCOS_REGIME = 2;			// Comparações seguidas dentro da tolerância
+	float _tolRegime = 0;
+	volatile bool _emRegime = false;
+	uint16_t _ciclosBloco = 1;
+	uint16_t _ciclosNoBloco = 0;
+	// Somas em fase e quadratura da tensão e da corrente (bloco atual e último bloco)
+	int64_t _somasBloco[4];
+	volatile int64_t _somasProntas[4];
+	volatile bool _blocoPronto = false;
+	float _zAnterior[2];
+	uint8_t _convergencias = 0;
+
+	// Tempo até o regime permanente de cada ponto do último ensaio [ms]
+	std::vector<uint16_t> _temposRegime;
+
 	Ensaio();
 	void setFrequencia(float);
 
@@ -92,6 +125,16 @@ public:
 	void calculaImpedanciaZC();
 	void calculaImpedanciaSWF();
 
+	void setModoContinuo(bool);
+	void setModoBruto(bool);
+	void setListaFrequencias(const float*, uint8_t);
+	void setModoRegime(float);
+	void verificaRegime();
+	void guardaTempoRegime();
+	void enviaTemposRegime();
+	void reenviaPonto(uint16_t);
+	void interrompeEnsaio();
+
 	void setFreqIni(float);
 	void setFreqFim(float);
 	void setFreqRelIni(float);
@@ -30,15 +30,44 @@ void Protocolo::atualizaSerial(){
 	if (USBSERIAL.available()){
 		volatile uint8_t byte_rec = USBSERIAL.read(); // Recebe um byte
 
+		// Pacote de configuração do ensaio ou da lista de frequências
+		if (_npacote >= 0){
+			_pacote[_npacote++] = byte_rec;
+			// O tamanho da lista vem no primeiro byte
+			if ((_codigoPacote == codigos::lista_frequencias) and (_npacote == 1)){
+				if (byte_rec > LISTA_MAX){
+					USBSERIAL.write(codigos::rec_falha);
+					_npacote = -1;
+					return;
+				}
+				_tamanhoPacote = 1 + 4*byte_rec;
+			}
+			if (_npacote == _tamanhoPacote + 3){
+				if (_codigoPacote == codigos::configura_ensaio) _processa_configuracao();
+				else _processa_lista();
+				_npacote = -1;
+			}
+			return;
+		}
+
 		// Verifica o byte recebido
 		switch (_nbyte){
 			case 0:
 				// Verifica se é o byte de início da mensagem
 				if (byte_rec == codigos::mens_inicio) _nbyte++;
+				// O código de escape cancela o ensaio em andamento
+				else if (byte_rec == codigos::esc) interrompeEnsaio();
 				break;
 			case 1: // Primeiro byte da mensagem
 				mensagem[0] = byte_rec;
 				_nbyte++;
+				// Início do pacote de configuração ou da lista de frequências
+				if ((byte_rec == codigos::configura_ensaio) or (byte_rec == codigos::lista_frequencias)){
+					_codigoPacote = byte_rec;
+					_tamanhoPacote = (byte_rec == codigos::configura_ensaio) ? TAMANHO_CONFIG : 1;
+					_npacote = 0;
+					_nbyte = 0;
+				}
 				break;
 			case 2:	// Segundo byte da mensagem
 				mensagem[1] = byte_rec;
@@ -171,9 +200,90 @@ void Protocolo::_processa_mensagem(){
 				case codigos::setMetodoZC:
 					setMetodoImp(1);
 					break;
+
+				case codigos::modo_bloco:
+					// Tamanho do bloco e janela (zero retorna ao envio valor a valor)
+					_tamanhoBloco = min(mensagem[1], VALORES_BLOCO_MAX);
+					_janela = min(mensagem[2], JANELA_MAX);
+					_modoBloco = (_tamanhoBloco > 0) and (_janela > 0);
+					// Confirma que o modo é suportado
+					USBSERIAL.write(codigos::rec_sucesso);
+					break;
+
+				case codigos::modo_continuo:
+					setModoContinuo(mensagem[1] != 0);
+					// Confirma que o modo é suportado
+					USBSERIAL.write(codigos::rec_sucesso);
+					break;
+
+				case codigos::modo_bruto:
+					setModoBruto(mensagem[1] != 0);
+					// Confirma que o modo é suportado
+					USBSERIAL.write(codigos::rec_sucesso);
+					break;
+
+				case codigos::modo_regime:
+					setModoRegime((mensagem[1] + (mensagem[2] << 8))/10000.0);
+					// Confirma que o modo é suportado
+					USBSERIAL.write(codigos::rec_sucesso);
+					break;
+
+				case codigos::tempos_regime:
+					enviaTemposRegime();
+					break;
+
+				case codigos::reenvia_ponto:
+					reenviaPonto(mensagem[1] + (mensagem[2] << 8));
+					break;
+
+				case codigos::identifica:
+					enviaIdentificacao();
+					break;
 			}
 }
 
+void Protocolo::_processa_configuracao(){
+	// Pacote: ! X freqIni freqFim passo freqRelIni freqRelFim passoRel fatorRegime metodo crc(2) #
+	uint16_t crc = _pacote[TAMANHO_CONFIG] + (_pacote[TAMANHO_CONFIG + 1] << 8);
+	if ((_pacote[TAMANHO_CONFIG + 2] != codigos::mens_final) or (crc != _crc16(0xFFFF, _pacote, TAMANHO_CONFIG))){
+		// O computador reenvia o pacote
+		USBSERIAL.write(codigos::rec_falha);
+		return;
+	}
+
+	float valores[7];
+	memcpy(valores, _pacote, sizeof(valores));
+	// Mesma ordem dos comandos individuais
+	setFreqIni(valores[0]);
+	setFreqFim(valores[1]);
+	setPasso(valores[2]);
+	setFreqRelIni(valores[3]);
+	setFreqRelFim(valores[4]);
+	setPassoRel(valores[5]);
+	setFatorRegime(valores[6]);
+	setMetodoImp(_pacote[28]);
+
+	// Confirma a configuração
+	USBSERIAL.write(codigos::rec_sucesso);
+}
+
+void Protocolo::_processa_lista(){
+	// Pacote: ! Y n freq(4n) crc(2) #
+	uint16_t crc = _pacote[_tamanhoPacote] + (_pacote[_tamanhoPacote + 1] << 8);
+	if ((_pacote[_tamanhoPacote + 2] != codigos::mens_final) or (crc != _crc16(0xFFFF, _pacote, _tamanhoPacote))){
+		// O computador reenvia o pacote
+		USBSERIAL.write(codigos::rec_falha);
+		return;
+	}
+
+	float frequencias[LISTA_MAX];
+	memcpy(frequencias, &_pacote[1], 4*_pacote[0]);
+	setListaFrequencias(frequencias, _pacote[0]);
+
+	// Confirma a lista
+	USBSERIAL.write(codigos::rec_sucesso);
+}
+
 uint8_t Protocolo::enviaValor(uint16_t valor){
 	// Envia um valor de 16 bits
 
@@ -202,6 +312,11 @@ uint8_t Protocolo::enviaValor(uint16_t valor){
 }
 
 bool Protocolo::enviaValores(uint16_t* valores, uint16_t tamanho){
+	// Utiliza a transferência em blocos caso tenha sido negociada
+	if (_modoBloco){
+		return enviaValoresBloco(valores, tamanho);
+	}
+
 	// Envia o número de valores
 	uint8_t resposta = enviaValor(tamanho);
 
@@ -227,3 +342,167 @@ bool Protocolo::enviaValores(uint16_t* valores, uint16_t tamanho){
 	}
 	return true;
 }
+
+bool Protocolo::enviaValoresBloco(uint16_t* valores, uint16_t tamanho){
+	// Envia os valores em blocos com janela deslizante
+	// Cada bloco é confirmado (k) ou tem o reenvio pedido (r) pelo computador
+
+	// Número de blocos (ao menos um bloco, mesmo sem valores)
+	uint16_t nBlocos = (tamanho + _tamanhoBloco - 1)/_tamanhoBloco;
+	if (nBlocos == 0) nBlocos = 1;
+	_transferencia++;
+
+	uint16_t base = 0;		// Primeiro bloco ainda não confirmado
+	uint16_t proximo = 0;	// Próximo bloco a ser enviado
+	bool confirmado[JANELA_MAX];
+	uint32_t tempoEnvio[JANELA_MAX];
+
+	// Mensagem de resposta recebida
+	uint8_t resposta[3];
+	int nbyte = 0;
+
+	while (base < nBlocos){
+		// Envia os blocos que cabem na janela
+		while ((proximo < nBlocos) and (proximo < base + _janela)){
+			_enviaBloco(valores, tamanho, proximo);
+			confirmado[proximo % JANELA_MAX] = false;
+			tempoEnvio[proximo % JANELA_MAX] = millis();
+			proximo++;
+		}
+
+		// Recebe as respostas
+		if (USBSERIAL.available()){
+			uint8_t byte_rec = USBSERIAL.read();
+
+			switch (nbyte){
+				case 0:
+					// Se receber o código de escape interrompe o envio
+					if (byte_rec == codigos::esc) return false;
+					if (byte_rec == codigos::mens_inicio) nbyte++;
+					break;
+				case 1:
+				case 2:
+				case 3:
+					resposta[nbyte - 1] = byte_rec;
+					nbyte++;
+					break;
+				case 4:{
+					nbyte = 0;
+					// Descarta a mensagem caso não seja o byte final
+					if (byte_rec != codigos::mens_final) break;
+
+					// Considera apenas os blocos enviados e não confirmados
+					uint16_t seq = resposta[1] + (resposta[2] << 8);
+					if ((seq < base) or (seq >= proximo) or confirmado[seq % JANELA_MAX]) break;
+
+					if (resposta[0] == codigos::bloco_conf){
+						confirmado[seq % JANELA_MAX] = true;
+					}
+					else if (resposta[0] == codigos::bloco_reenv){
+						// Reenvia apenas o bloco com falha
+						_enviaBloco(valores, tamanho, seq);
+						tempoEnvio[seq % JANELA_MAX] = millis();
+					}
+
+					// Avança a janela
+					while ((base < proximo) and confirmado[base % JANELA_MAX]) base++;
+					break;
+				}
+			}
+		}
+		// Reenvia o bloco mais antigo caso a confirmação não chegue
+		else if ((base < proximo) and (millis() - tempoEnvio[base % JANELA_MAX] > TIMEOUT_BLOCO)){
+			_enviaBloco(valores, tamanho, base);
+			tempoEnvio[base % JANELA_MAX] = millis();
+		}
+	}
+	return true;
+}
+
+void Protocolo::_enviaBloco(uint16_t* valores, uint16_t tamanho, uint16_t seq){
+	// Envia um bloco: ! b id seq(2) tamanho(2) n valores(2n) crc(2) #
+	// Os valores são enviados em little-endian, como armazenados no Cortex-M3
+
+	// Número de valores no bloco
+	uint16_t inicio = seq*_tamanhoBloco;
+	uint8_t n = 0;
+	if (inicio < tamanho){
+		n = (tamanho - inicio < _tamanhoBloco) ? (tamanho - inicio) : _tamanhoBloco;
+	}
+
+	uint8_t cabecalho[6] = {_transferencia,
+							(uint8_t)(seq & 0x00FF), (uint8_t)((seq & 0xFF00) >> 8),
+							(uint8_t)(tamanho & 0x00FF), (uint8_t)((tamanho & 0xFF00) >> 8),
+							n};
+	uint8_t* dados = (uint8_t*)(&valores[inicio]);
+
+	// CRC do cabeçalho e dos valores
+	uint16_t crc = _crc16(0xFFFF, cabecalho, 6);
+	crc = _crc16(crc, dados, 2*n);
+
+	USBSERIAL.write(codigos::mens_inicio);
+	USBSERIAL.write(codigos::bloco_dados);
+	USBSERIAL.write(cabecalho, 6);
+	USBSERIAL.write(dados, 2*n);
+	USBSERIAL.write((uint8_t)(crc & 0x00FF));
+	USBSERIAL.write((uint8_t)((crc & 0xFF00) >> 8));
+	USBSERIAL.write(codigos::mens_final);
+}
+
+void Protocolo::_enviaPacote(uint8_t codigo, const uint8_t* dados, uint16_t tamanho){
+	// Envia um pacote de tamanho fixo: ! código dados crc(2) #
+	uint16_t crc = _crc16(0xFFFF, dados, tamanho);
+
+	USBSERIAL.write(codigos::mens_inicio);
+	USBSERIAL.write(codigo);
+	USBSERIAL.write(dados, tamanho);
+	USBSERIAL.write((uint8_t)(crc & 0x00FF));
+	USBSERIAL.write((uint8_t)((crc & 0xFF00) >> 8));
+	USBSERIAL.write(codigos::mens_final);
+}
+
+void Protocolo::enviaPonto(uint16_t indice, const uint16_t* palavras){
+	// Envia um ponto: índice e as palavras LSB/MSB da frequência, magnitude e fase
+	uint8_t dados[14];
+	dados[0] = (indice & 0x00FF);
+	dados[1] = (indice & 0xFF00) >> 8;
+	for (int i = 0; i < 6; i++){
+		dados[2 + 2*i] = (palavras[i] & 0x00FF);
+		dados[3 + 2*i] = (palavras[i] & 0xFF00) >> 8;
+	}
+	_enviaPacote(codigos::ponto_dados, dados, 14);
+}
+
+void Protocolo::enviaFimPontos(uint16_t total){
+	// Envia o número de pontos do ensaio contínuo
+	uint8_t dados[2] = {(uint8_t)(total & 0x00FF), (uint8_t)((total & 0xFF00) >> 8)};
+	_enviaPacote(codigos::fim_pontos, dados, 2);
+}
+
+void Protocolo::enviaIdentificacao(){
+	// Envia a versão do protocolo, as capacidades e o número de série do SAM3X
+	uint8_t dados[19];
+	dados[0] = VERSAO_PROTOCOLO;
+	dados[1] = (CAPACIDADES & 0x00FF);
+	dados[2] = (CAPACIDADES & 0xFF00) >> 8;
+
+	// O identificador único é lido da flash com as interrupções desabilitadas
+	uint32_t serie[4];
+	__disable_irq();
+	efc_perform_read_sequence(EFC1, EFC_FCMD_STUI, EFC_FCMD_SPUI, serie, 4);
+	__enable_irq();
+	memcpy(&dados[3], serie, 16);
+
+	_enviaPacote(codigos::identifica, dados, 19);
+}
+
+uint16_t Protocolo::_crc16(uint16_t crc, const uint8_t* dados, uint16_t tamanho){
+	// CRC-16/CCITT (polinômio 0x1021)
+	for (uint16_t i = 0; i < tamanho; i++){
+		crc ^= (uint16_t)dados[i] << 8;
+		for (int b = 0; b < 8; b++){
+			crc = (crc & 0x8000) ? ((crc << 1) ^ 0x1021) : (crc << 1);
+		}
+	}
+	return crc;
+}
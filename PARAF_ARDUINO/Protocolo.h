@@ -31,7 +31,13 @@ public:
 
 	uint8_t enviaValor(uint16_t valor);
 	bool enviaValores(uint16_t* valores, uint16_t tamanho);
+	bool enviaValoresBloco(uint16_t* valores, uint16_t tamanho);
+	void enviaPonto(uint16_t indice, const uint16_t* palavras);
+	void enviaFimPontos(uint16_t total);
+	void enviaIdentificacao();
 	void _processa_mensagem();
+	void _processa_configuracao();
+	void _processa_lista();
 
 	// Executado quando recebe o comando
 	// Implementado no Ensaio
@@ -53,6 +59,13 @@ public:
 	virtual float getFatorRegime() {return 0;};
 
 	virtual void iniciaEnsaio() {};
+	virtual void setModoContinuo(bool) {};
+	virtual void setModoBruto(bool) {};
+	virtual void setListaFrequencias(const float*, uint8_t) {};
+	virtual void setModoRegime(float) {};
+	virtual void enviaTemposRegime() {};
+	virtual void reenviaPonto(uint16_t) {};
+	virtual void interrompeEnsaio() {};
 
 	virtual ~Protocolo();
 
@@ -60,6 +73,33 @@ protected:
 	uint8_t mensagem[3];	// Mensagem de 4 bytes recebida via porta serial
 	int _nbyte = 0;			// Contador de bytes recebidos
 
+	// Pacote de configuração do ensaio: 7 floats e o método, crc(2) e byte final
+	const static uint8_t TAMANHO_CONFIG = 29;
+	// Pacote da lista de frequências: número de frequências e as frequências (float)
+	const static uint8_t LISTA_MAX = 32;
+	const static uint8_t TAMANHO_LISTA_MAX = 1 + 4*LISTA_MAX;
+	uint8_t _pacote[TAMANHO_LISTA_MAX + 3];
+	int _npacote = -1;		// Bytes recebidos do pacote (-1 = fora do pacote)
+	uint8_t _codigoPacote = 0;	// Código do pacote em recepção
+	int _tamanhoPacote = 0;		// Bytes de dados do pacote em recepção
+
+	// Transferência em blocos (negociada pelo computador)
+	const static uint8_t VALORES_BLOCO_MAX = 128;	// Valores por bloco
+	const static uint8_t JANELA_MAX = 16;			// Blocos enviados sem confirmação
+	const static uint32_t TIMEOUT_BLOCO = 50;		// Tempo para reenviar um bloco [ms]
+	bool _modoBloco = false;
+	uint8_t _tamanhoBloco = 0;
+	uint8_t _janela = 0;
+	uint8_t _transferencia = 0;		// Identificador da transferência atual
+
+	// Identificação: versão do protocolo e comandos suportados
+	const static uint8_t VERSAO_PROTOCOLO = 1;
+	const static uint16_t CAPACIDADES = 0x003F;	// Bit 0: blocos, bit 1: ensaio contínuo, bit 2: configuração, bit 3: amostras, bit 4: lista, bit 5: regime adaptativo
+
+	void _enviaBloco(uint16_t* valores, uint16_t tamanho, uint16_t seq);
+	uint16_t _crc16(uint16_t crc, const uint8_t* dados, uint16_t tamanho);
+	void _enviaPacote(uint8_t codigo, const uint8_t* dados, uint16_t tamanho);
+
 	enum codigos {
 		// Códigos dos bytes enviados via serial
 		mens_inicio 		= 	0x21, // !   - Inicio da Mensagem
@@ -87,6 +127,23 @@ protected:
 
 		inicia_ensaio 		=	0x41, // A   - Inicia o ensaio
 
+		modo_bloco			=	0x42, // B   - Negocia a transferência em blocos (tamanho do bloco, janela)
+		bloco_dados			=	0x62, // b   - Bloco de valores
+		bloco_conf			=	0x6B, // k   - Bloco recebido com sucesso
+		bloco_reenv			=	0x72, // r   - Pede o reenvio de um bloco
+
+		modo_continuo		=	0x43, // C   - Envia cada ponto do próximo ensaio assim que é calculado
+		reenvia_ponto		=	0x44, // D   - Pede o reenvio de um ponto (0xFFFF = fim do ensaio)
+		ponto_dados			=	0x70, // p   - Ponto do ensaio (índice, frequência, magnitude, fase)
+		fim_pontos			=	0x66, // f   - Fim do ensaio contínuo (número de pontos)
+
+		identifica			=	0x56, // V   - Identifica a placa (versão, capacidades e número de série)
+		configura_ensaio	=	0x58, // X   - Configura o ensaio em um pacote (frequências, passos, fator de regime e método)
+		modo_bruto			=	0x57, // W   - Envia as amostras de cada frequência do próximo ensaio (sem calcular a impedância)
+		lista_frequencias	=	0x59, // Y   - Frequências do próximo ensaio em um pacote (número e frequências)
+		modo_regime			=	0x45, // E   - Regime permanente adaptativo no próximo ensaio (tolerância em 0.01 %)
+		tempos_regime		=	0x65, // e   - Pede os tempos até o regime permanente do último ensaio
+
 		size 				=	0x73, // s 	 - Tamanho do pacote
 		byte_LS 			=	0x61, // a   - Byte menos significativo
 		byte_MS 			=	0x7A, // z   - Byte mais significativo
@@ -16,12 +16,15 @@ Implementado no Computador em Python 3.6
 from __future__ import unicode_literals
 import sys
 import os
+from time import perf_counter
 import matplotlib
 
 # Garante o uso do Qt5
 matplotlib.use('Qt5Agg')
 
-from PARAF_ENSAIO import Ensaio
+from PARAF_ENSAIO import Ensaio, GraficoImpedancia
+from ProtocolPy import EnsaioCancelado
+import PARAF_ARQUIVO
 
 from PyQt5 import QtCore, QtWidgets
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
@@ -29,6 +32,8 @@ from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as Navigatio
 from matplotlib.backend_bases import key_press_handler
 from matplotlib.figure import Figure
 
+# Curvas avulsas (.npy) ou arquivos de medidas com vários ensaios (.paraf)
+FILTRO_ARQUIVOS = "Ensaios (*.npy);;Arquivos de Medidas (*%s)" % PARAF_ARQUIVO.EXTENSAO
 
 class DialogoNovoEnsaio(QtWidgets.QDialog):
     def __init__(self, curva):
@@ -86,25 +91,52 @@ class DialogoNovoEnsaio(QtWidgets.QDialog):
         self.fatorRegime.setSingleStep(0.1)
         self.fatorRegime.setValue(curva.fatorRegime)
         u_fatorRegime = QtWidgets.QLabel("")        
+        # Tolerância do Regime Permanente Adaptativo (0 = espera fixa)
+        l_toleranciaRegime = QtWidgets.QLabel("Tolerância do Regime Adaptativo")
+        self.toleranciaRegime = QtWidgets.QDoubleSpinBox(self)
+        self.toleranciaRegime.setRange(0, 10)
+        self.toleranciaRegime.setDecimals(2)
+        self.toleranciaRegime.setSingleStep(0.1)
+        self.toleranciaRegime.setSpecialValueText("Fixo")
+        self.toleranciaRegime.setValue((curva.toleranciaRegime or 0)*100)
+        u_toleranciaRegime = QtWidgets.QLabel("%")
         # Método de Cálculo
         l_metodo = QtWidgets.QLabel("Método de Cálculo da Impedância")
         self.metodo = QtWidgets.QComboBox(self)
         self.metodo.addItem('SWF', None)
         self.metodo.addItem('ZC', None)
         u_metodo = QtWidgets.QLabel("")
+        # Cálculo no Computador a partir das Amostras
+        l_amostrasBrutas = QtWidgets.QLabel("Calcular no Computador (Amostras)")
+        self.amostrasBrutas = QtWidgets.QCheckBox(self)
+        self.amostrasBrutas.setChecked(curva.amostrasBrutas)
+        u_amostrasBrutas = QtWidgets.QLabel("")
+        # Varredura adaptativa (refina até o passo das frequências relevantes)
+        l_varreduraAdaptativa = QtWidgets.QLabel("Varredura Adaptativa")
+        self.varreduraAdaptativa = QtWidgets.QCheckBox(self)
+        self.varreduraAdaptativa.setChecked(curva.varreduraAdaptativa)
+        u_varreduraAdaptativa = QtWidgets.QLabel("")
+        # Identificação do alto-falante (gravada nos arquivos .paraf)
+        l_altoFalante = QtWidgets.QLabel("Alto-falante")
+        self.altoFalante = QtWidgets.QLineEdit(curva.altoFalante, self)
+        self.altoFalante.setMaxLength(32)
+        u_altoFalante = QtWidgets.QLabel("")
     
         # Leiaute dos campos       
         labelList = (l_freqInicial, l_freqFinal, l_passo, 
                      l_freqRelInicial, l_freqRelFinal, l_passoRel,
-                     l_fatorRegime, l_metodo)
+                     l_fatorRegime, l_toleranciaRegime, l_metodo, l_amostrasBrutas, l_varreduraAdaptativa,
+                     l_altoFalante)
         
         widgetList = (self.freqInicial, self.freqFinal, self.passo, 
                      self.freqRelInicial, self.freqRelFinal, self.passoRel,
-                     self.fatorRegime, self.metodo)
+                     self.fatorRegime, self.toleranciaRegime, self.metodo, self.amostrasBrutas,
+                     self.varreduraAdaptativa, self.altoFalante)
         
         unitList = (u_freqInicial, u_freqFinal, u_passo, 
                      u_freqRelInicial, u_freqRelFinal, u_passoRel,
-                     u_fatorRegime, u_metodo)       
+                     u_fatorRegime, u_toleranciaRegime, u_metodo, u_amostrasBrutas, u_varreduraAdaptativa,
+                     u_altoFalante)       
         
         leiaute_campos = QtWidgets.QGridLayout()        
         for i in range(0, len(labelList)):
@@ -148,12 +180,17 @@ class DialogoCalibrar(QtWidgets.QDialog):
         self.R.setValue(5)
         self.R.setAlignment(QtCore.Qt.AlignRight)
         u_R = QtWidgets.QLabel("Ohm")        
+        # Varredura no resistor acrescentada à tabela de calibração da placa
+        l_tabela = QtWidgets.QLabel("Acrescentar à Tabela da Placa (Varredura)")
+        self.tabela = QtWidgets.QCheckBox(self)
        
         # Leiaute dos campos
         leiaute_campos = QtWidgets.QGridLayout()
         leiaute_campos.addWidget(l_R ,0, 0)
         leiaute_campos.addWidget(self.R ,0, 1)
         leiaute_campos.addWidget(u_R ,0, 2)
+        leiaute_campos.addWidget(l_tabela ,1, 0)
+        leiaute_campos.addWidget(self.tabela ,1, 1)
         
         # Leiaute dos botoões
         leiaute_botoes = QtWidgets.QHBoxLayout()
@@ -231,6 +268,73 @@ class Grafico(FigureCanvas):
         FigureCanvas.updateGeometry(self)
         
         
+class Aquisicao(QtCore.QThread):
+    '''
+    Executa uma Captura fora da Thread da Interface
+    
+    acao(aquisicao) roda na thread e pode contar os pontos recebidos em
+    aquisicao.pontos e enviá-los à interface com aquisicao.ponto.emit(freq,
+    mag, fas). O progresso (pontos, total, bytes/s, segundos
+    restantes ou -1) é emitido periodicamente enquanto a captura dura.
+    '''
+    progresso = QtCore.pyqtSignal(int, int, float, float)
+    ponto = QtCore.pyqtSignal(float, float, float)
+    concluida = QtCore.pyqtSignal()
+    cancelada = QtCore.pyqtSignal()
+    falhou = QtCore.pyqtSignal(str)
+    
+    def __init__(self, ensaio, acao, total=None, parent=None):
+        super().__init__(parent)
+        self.ensaio = ensaio
+        self.acao = acao
+        self.total = total or 0
+        self.pontos = 0
+        self._inicio = None
+        self._ardInicio = None
+        self._bytesInicio = 0
+        
+        self._temporizador = QtCore.QTimer(self)
+        self._temporizador.setInterval(250)
+        self._temporizador.timeout.connect(self._relata)
+        self.started.connect(self._temporizador.start)
+        self.finished.connect(self._temporizador.stop)
+        
+    def run(self):
+        # Bytes já recebidos pela sessão no início (a taxa conta a partir daqui)
+        self._ardInicio = self.ensaio.ard
+        self._bytesInicio = self._ardInicio.bytesRecebidos if self._ardInicio is not None else 0
+        self._inicio = perf_counter()
+        try:
+            self.acao(self)
+        except EnsaioCancelado:
+            self.cancelada.emit()
+        except Exception as exc:
+            self.falhou.emit(str(exc))
+        else:
+            self.concluida.emit()
+        finally:
+            # Um cancelamento pedido após o fim não afeta a próxima captura
+            self.ensaio.Cancela(False)
+            
+    def cancela(self):
+        self.ensaio.Cancela()
+        
+    def _relata(self):
+        if self._inicio is None:
+            return
+        decorrido = perf_counter() - self._inicio
+        # Bytes recebidos desde o início; uma sessão aberta pela captura
+        # conta desde zero
+        ard = self.ensaio.ard
+        recebidos = ard.bytesRecebidos if ard is not None else 0
+        inicio = self._bytesInicio if ard is self._ardInicio else 0
+        taxa = (recebidos - inicio)/decorrido if decorrido > 0 else 0.0
+        restante = -1.0
+        if self.total and self.pontos:
+            restante = decorrido*(self.total - self.pontos)/self.pontos
+        self.progresso.emit(self.pontos, self.total, taxa, max(restante, -1.0))
+        
+        
 class BarraLateral(QtWidgets.QGridLayout):
     def __init__(self, parent):
         QtWidgets.QGridLayout.__init__(self, parent)
@@ -384,7 +488,7 @@ class BarraLateral(QtWidgets.QGridLayout):
         self.QMS.setValue(QMS)
         self.QES.setValue(QES)
         self.QTS.setValue(QTS)
-        self.LE.setValue(LE)
+        self.LE.setValue(LE*1000)
         self.RED.setValue(RED)
         
     def Disable(self):
@@ -410,6 +514,13 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.main_widget = QtWidgets.QWidget(self)        
         # Gráfico
         self.grafico = Grafico(self.main_widget, width=25, height=20, dpi=100)               
+        # Curvas de impedância atualizadas de forma incremental
+        self.graficoImpedancia = GraficoImpedancia(self.grafico)
+        # Agrupa as alterações seguidas dos parâmetros em uma atualização
+        self.temporizadorGrafico = QtCore.QTimer(self)
+        self.temporizadorGrafico.setSingleShot(True)
+        self.temporizadorGrafico.setInterval(30)
+        self.temporizadorGrafico.timeout.connect(self.atualizaGrafico)
 
         ## Menus
         # Arquivo
@@ -466,15 +577,15 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.barraLateral = BarraLateral(self)
         self.barraLateral.Disable()      
         self.barraLateral.plotaAnalitica.stateChanged.connect(self.atualizaGrafico)
-        self.barraLateral.sobreporCurvas.stateChanged.connect(self.atualizaGrafico)
-        self.barraLateral.eixoLog.stateChanged.connect(self.atualizaGrafico)
-        self.barraLateral.RE.valueChanged.connect(self.atualizaGrafico)
-        self.barraLateral.FS.valueChanged.connect(self.atualizaGrafico)
-        self.barraLateral.RS.valueChanged.connect(self.atualizaGrafico)
-        self.barraLateral.QMS.valueChanged.connect(self.atualizaGrafico)
-        self.barraLateral.QTS.valueChanged.connect(self.atualizaGrafico)
-        self.barraLateral.LE.valueChanged.connect(self.atualizaGrafico)
-        self.barraLateral.RED.valueChanged.connect(self.atualizaGrafico)        
+        self.barraLateral.sobreporCurvas.stateChanged.connect(self.montaGrafico)
+        self.barraLateral.eixoLog.stateChanged.connect(self.alteraEixo)
+        self.barraLateral.RE.valueChanged.connect(self.agendaGrafico)
+        self.barraLateral.FS.valueChanged.connect(self.agendaGrafico)
+        self.barraLateral.RS.valueChanged.connect(self.agendaGrafico)
+        self.barraLateral.QMS.valueChanged.connect(self.agendaGrafico)
+        self.barraLateral.QTS.valueChanged.connect(self.agendaGrafico)
+        self.barraLateral.LE.valueChanged.connect(self.agendaGrafico)
+        self.barraLateral.RED.valueChanged.connect(self.agendaGrafico)        
        
         # Leiaute horizontal principal do programa
         leiauteHorizontal = QtWidgets.QHBoxLayout()
@@ -488,27 +599,78 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
         # Barra de Status
         self.statusBar().showMessage(".", 2000)
+        # Cancelamento da captura em andamento
+        self.b_cancela = QtWidgets.QPushButton('Cancelar', self)
+        self.b_cancela.hide()
+        self.statusBar().addPermanentWidget(self.b_cancela)
+        self.aquisicao = None
+        
+    def _iniciaAquisicao(self, acao, aoConcluir, total=None, aoReceberPonto=None):
+        # Executa a captura em uma thread; a interface continua respondendo
+        self.menuBar().setEnabled(False)
+        self.aquisicao = Aquisicao(self.ensaio, acao, total, self)
+        self.aquisicao.progresso.connect(self.mostraProgresso)
+        if aoReceberPonto is not None:
+            self.aquisicao.ponto.connect(aoReceberPonto)
+        self.aquisicao.concluida.connect(aoConcluir)
+        self.aquisicao.cancelada.connect(lambda: self.statusBar().showMessage("Captura cancelada", 5000))
+        self.aquisicao.falhou.connect(self.mostraFalha)
+        self.aquisicao.finished.connect(self._fimAquisicao)
+        self.b_cancela.clicked.connect(self.aquisicao.cancela)
+        self.b_cancela.show()
+        self.statusBar().showMessage("Capturando...")
+        self.aquisicao.start()
+        
+    def _fimAquisicao(self):
+        self.b_cancela.clicked.disconnect()
+        self.b_cancela.hide()
+        self.menuBar().setEnabled(True)
+        self.aquisicao.deleteLater()
+        self.aquisicao = None
+        
+    def mostraProgresso(self, pontos, total, taxa, restante):
+        mensagem = "Capturando: %d" % pontos
+        if total:
+            mensagem += "/%d" % total
+        mensagem += " pontos, %.1f kB/s" % (taxa/1000)
+        if restante >= 0:
+            mensagem += ", restam %.0f s" % restante
+        self.statusBar().showMessage(mensagem)
+        
+    def mostraFalha(self, erro):
+        self.statusBar().clearMessage()
+        QtWidgets.QMessageBox.warning(self, "Falha na captura", erro)
         
     def iniciaCalibracao(self):
         R = self.dialogoCalibrar.R.value()
-        self.ensaio.Calibra(R)
-        
+        tabela = self.dialogoCalibrar.tabela.isChecked()
         self.dialogoCalibrar.close()
         
+        def concluida():
+            if tabela:
+                resistores = ', '.join('%g' % R for R in self.ensaio.tabelaCal.resistores)
+                self.statusBar().showMessage("Tabela de calibração: %s Ohm" % resistores, 5000)
+            else:
+                self.statusBar().showMessage("Fator de calibração: %g" % self.ensaio.fatorCal, 5000)
+        calibra = self.ensaio.CalibraTabela if tabela else self.ensaio.Calibra
+        self._iniciaAquisicao(lambda aquisicao: calibra(R), concluida)
+        
     def iniciaTeste(self):
         # Seta as configuraçòes do teste
         self.ensaio.testFreq = self.dialogoSinalTeste.freq.value()
         self.ensaio.testDuracao = self.dialogoSinalTeste.dur.value() 
+        self.dialogoSinalTeste.close()
         
         # Captura os sinais do teste
-        self.ensaio.CapturaSinalTeste()
+        self._iniciaAquisicao(lambda aquisicao: self.ensaio.CapturaSinalTeste(), self.mostraTeste)
         
+    def mostraTeste(self):
+        self.statusBar().clearMessage()
         # Atualiza o gráfico
-        self.grafico.fig.clear()
+        self.graficoImpedancia.limpa()
         self.ensaio.PlotaSinalTeste(self.grafico.fig)
         self.grafico.draw()
         
-        self.dialogoSinalTeste.close()
         self.barraLateral.Disable()       
 
         
@@ -521,37 +683,80 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.ensaio.freqRelFinal = self.diaglogoNovoEnsaio.freqRelFinal.value() 
         self.ensaio.passoRel = 1+self.diaglogoNovoEnsaio.passoRel.value()/100 
         self.ensaio.fatorRegime = self.diaglogoNovoEnsaio.fatorRegime.value() 
+        self.ensaio.toleranciaRegime = self.diaglogoNovoEnsaio.toleranciaRegime.value()/100 or None
         self.ensaio.metodo = self.diaglogoNovoEnsaio.metodo.currentText()
+        self.ensaio.amostrasBrutas = self.diaglogoNovoEnsaio.amostrasBrutas.isChecked()
+        self.ensaio.varreduraAdaptativa = self.diaglogoNovoEnsaio.varreduraAdaptativa.isChecked()
+        self.ensaio.altoFalante = self.diaglogoNovoEnsaio.altoFalante.text().strip()
         
-        # Captura
-        self.ensaio.CapturaImpedancia()       
+        self.diaglogoNovoEnsaio.close()
         
+        # Captura ponto a ponto: cada ponto conta para o progresso e é
+        # desenhado assim que chega
+        def captura(aquisicao):
+            for freq, mag, fas in self.ensaio.iterCapturaImpedancia():
+                aquisicao.pontos += 1
+                aquisicao.ponto.emit(float(freq), float(mag), float(fas))
+        sobrepor = self.barraLateral.sobreporCurvas.isChecked()
+        eixolog = self.barraLateral.eixoLog.isChecked()
+        self.graficoImpedancia.iniciaCaptura(self.ensaio, sobrepor, eixolog)
+        self._iniciaAquisicao(captura, self.mostraEnsaio, self.ensaio.NumeroPontos(), self.mostraPonto)
+        
+    def mostraEnsaio(self):
+        self.statusBar().clearMessage()
+        # Onde foi o tempo do ensaio (placas que informam os tempos de regime)
+        resumo = self.ensaio.ResumoRegime()
+        if resumo is not None:
+            self.statusBar().showMessage("Regime permanente: %.1f s de espera e %.1f s de captura "
+                                         "(maior espera %.2f s em %.0f Hz)"
+                                         % (resumo['espera'], resumo['captura'],
+                                            resumo['maxima'], resumo['freqMaxima']))
         # Calcula os parâmetros e seta na barra lateral
-        try:
-            self.ensaio.CalculaParametros()
-        except:
-            pass
+        self.calculaParametros()
         self.barraLateral.setaParametros(self.ensaio)
         self.barraLateral.Enable()
-        self.diaglogoNovoEnsaio.close()
         
-        self.atualizaGrafico()
+        self.atualizaMedidas()
+        
+    def mostraPonto(self, freq, mag, fas):
+        self.graficoImpedancia.adicionaPonto(freq, mag, fas)
+        
+    def calculaParametros(self):
+        # Ajusta o modelo à curva medida e mostra a curva analítica ajustada;
+        # sem ajuste, ficam os parâmetros extraídos dos pontos da ressonância
+        try:
+            self.ensaio.AjustaParametros()
+        except ValueError:
+            try:
+                self.ensaio.CalculaParametros()
+            except ValueError:
+                pass
+        else:
+            self.barraLateral.plotaAnalitica.setChecked(True)
         
     def arquivoCarrega(self):
         options = QtWidgets.QFileDialog.Options()
         options |= QtWidgets.QFileDialog.DontUseNativeDialog
         fd = QtWidgets.QFileDialog(self)
         fd.setDefaultSuffix('npy')
-        fileName, _ = fd.getOpenFileName(self,"QFileDialog.getOpenFileName()", "","Ensaios (*.npy)", options=options)
+        fileName, _ = fd.getOpenFileName(self,"QFileDialog.getOpenFileName()", "",FILTRO_ARQUIVOS, options=options)
         if fileName:
-            self.ensaio.Carrega(fileName)
+            indice = -1
+            # Arquivo de medidas com vários ensaios: escolhe qual carregar
+            if fileName.endswith(PARAF_ARQUIVO.EXTENSAO):
+                with PARAF_ARQUIVO.Arquivo(fileName) as arquivo:
+                    ensaios = len(arquivo)
+                if ensaios > 1:
+                    indice, ok = QtWidgets.QInputDialog.getInt(self, 'Carrega', 'Ensaio (0 a %d)' % (ensaios - 1),
+                                                               ensaios - 1, 0, ensaios - 1)
+                    if not ok:
+                        return
+            self.ensaio.Carrega(fileName, indice)
             # Atualiza o gráfico
-            self.grafico.fig.clear()
-            self.ensaio.grafico(self.grafico.fig, sobrepor=False)
-            self.grafico.draw()
+            self.atualizaMedidas()
             
             # Calcula os parâmetros e seta na barra lateral
-            self.ensaio.CalculaParametros()
+            self.calculaParametros()
             self.barraLateral.setaParametros(self.ensaio)
             self.barraLateral.Enable()
         
@@ -560,7 +765,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         options |= QtWidgets.QFileDialog.DontUseNativeDialog
         fd = QtWidgets.QFileDialog(self)
         fd.setDefaultSuffix('.npy')
-        fileName, _ = fd.getSaveFileName(self,"QFileDialog.getSaveFileName()","","Ensaios (*.npy)", options=options)
+        fileName, _ = fd.getSaveFileName(self,"QFileDialog.getSaveFileName()","",FILTRO_ARQUIVOS, options=options)
         if fileName:
             self.ensaio.Salva(fileName)
 
@@ -570,39 +775,59 @@ class ApplicationWindow(QtWidgets.QMainWindow):
     def on_key_press(self, event):
         key_press_handler(event, self.grafico, self.barra_grafico)
         
+    def montaGrafico(self):
+        # Refaz a figura (leiaute alterado ou ocupada por outro gráfico)
+        if self.ensaio.impFreq is None:
+            return
+        sobrepor = self.barraLateral.sobreporCurvas.isChecked()
+        eixolog = self.barraLateral.eixoLog.isChecked()
+        self.graficoImpedancia.monta(self.ensaio, sobrepor, eixolog)
+        self.atualizaGrafico()
+        
+    def atualizaMedidas(self):
+        # Nova curva medida: mantém os eixos se o leiaute não mudou
+        sobrepor = self.barraLateral.sobreporCurvas.isChecked()
+        if self.graficoImpedancia.montado and self.graficoImpedancia.sobrepor == sobrepor:
+            self.graficoImpedancia.atualizaMedidas(self.ensaio)
+            self.atualizaGrafico()
+        else:
+            self.montaGrafico()
+            
+    def alteraEixo(self):
+        if not self.graficoImpedancia.montado:
+            self.montaGrafico()
+            return
+        self.graficoImpedancia.eixoLog(self.barraLateral.eixoLog.isChecked())
+        
+    def agendaGrafico(self, *args):
+        # Reinicia o temporizador: só a última alteração de uma sequência é desenhada
+        self.temporizadorGrafico.start()
+        
     def atualizaGrafico(self):
+        self.temporizadorGrafico.stop()
+        if not self.graficoImpedancia.montado:
+            self.montaGrafico()
+            return
+        
         # Atualiza com os valores da barra lateral
         self.ensaio.RE = self.barraLateral.RE.value()
         self.ensaio.FS = self.barraLateral.FS.value()
-        self.ensaio.RE = self.barraLateral.RE.value()
-        self.ensaio.FS = self.barraLateral.FS.value()
         self.ensaio.RS = self.barraLateral.RS.value()
         self.ensaio.QMS = self.barraLateral.QMS.value()
         self.ensaio.QTS = self.barraLateral.QTS.value()
         self.ensaio.LE = self.barraLateral.LE.value()/1000
         self.ensaio.RED = self.barraLateral.RED.value()       
             
-        # Obtem o estado das checkboxes
+        # Redesenha apenas a curva analítica
         analitica = self.barraLateral.plotaAnalitica.isChecked()
-        sobrepor = self.barraLateral.sobreporCurvas.isChecked()
-        eixolog = self.barraLateral.eixoLog.isChecked()
-
-        # Plota novamente o gráfico       
-        self.grafico.fig.clear()
-        self.ensaio.grafico(self.grafico.fig, sobrepor)
-        # Plota a curva analítica
-        if analitica is True:
-            self.ensaio.PlotaCurvasAnaliticas(self.grafico.fig)
-        # Altera o eixo
-        ax = self.grafico.fig.axes
-        if eixolog:
-            ax[0].set_xscale('log')
-        else:
-            ax[0].set_xscale('linear')
-            
-        self.grafico.draw()
+        self.graficoImpedancia.atualizaAnalitica(self.ensaio.CurvaAnalitica(), analitica)
 
     def closeEvent(self, ce):
+        # Cancela a captura em andamento e encerra a sessão com a placa
+        if self.aquisicao is not None:
+            self.aquisicao.cancela()
+            self.aquisicao.wait()
+        self.ensaio.desconecta()
         self.arquivoSair()
 
     def sobre(self):
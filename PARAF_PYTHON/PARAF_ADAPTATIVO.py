@@ -0,0 +1,87 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_ADAPTATIVO.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Refinamento da varredura de frequências a partir dos pontos já medidos
+Uma varredura grossa localiza a ressonância e as regiões em que a magnitude
+ou a fase variam rápido; só nessas regiões são pedidas novas frequências,
+até o passo fino (o passo das frequências relevantes)
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from PARAF_AMOSTRAS import corrigeAngulo
+
+# Variação máxima entre pontos vizinhos fora da ressonância:
+# magnitude (logaritmo natural da relação) e fase [graus]
+TOLERANCIA_MAG = 0.1
+TOLERANCIA_FAS = 5.0
+
+
+def _regiaoRessonancia(mag):
+    # Intervalos (índices i, entre os pontos i e i + 1) da região em que a
+    # magnitude passa de Z12 = sqrt(RE*RS), com um vizinho de cada lado
+    # (como PARAF_PARAMETROS: RE é o mínimo e RS o máximo da curva)
+    iS = int(np.argmax(mag))
+    z12 = np.sqrt(mag.min()*mag[iS])
+    abaixo = np.flatnonzero(mag < z12)
+    antes = abaixo[abaixo < iS]
+    depois = abaixo[abaixo > iS]
+    inicio = antes[-1] - 1 if len(antes) else 0
+    fim = depois[0] + 1 if len(depois) else len(mag) - 1
+    return max(inicio, 0), min(fim, len(mag) - 1)
+
+
+def refinaVarredura(freq, mag, fas, passoFino=1.03, tolMag=TOLERANCIA_MAG, tolFas=TOLERANCIA_FAS):
+    '''
+    Propõe as Próximas Frequências a Medir
+
+    A região da ressonância (acima de Z12, onde CalculaParametros procura FS,
+    F1 e F2) é dividida de uma vez no passo fino. Nos demais intervalos com
+    variação de magnitude maior que tolMag ou de fase maior que tolFas é
+    proposto o ponto médio (geométrico), e uma nova chamada com os pontos
+    medidos continua o refinamento. Retorna as frequências novas em ordem
+    crescente, arredondadas para float32 como na placa (vazio se a curva já
+    está refinada).
+    '''
+    freq = np.asarray(freq, dtype=float)
+    ordem = np.argsort(freq)
+    freq = freq[ordem]
+    mag = np.asarray(mag, dtype=float)[ordem]
+    fas = np.asarray(fas, dtype=float)[ordem]
+    if len(freq) < 2:
+        return np.empty(0)
+
+    # Intervalos maiores que o passo fino (com folga para o arredondamento)
+    razao = freq[1:]/freq[:-1]
+    largo = razao > passoFino*(1 + 1e-4)
+
+    inicio, fim = _regiaoRessonancia(mag)
+    ressonancia = np.zeros(len(razao), dtype=bool)
+    ressonancia[inicio:fim] = True
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variacaoMag = np.abs(np.diff(np.log(mag)))
+    variacaoFas = np.abs(corrigeAngulo(np.diff(fas)))
+    ingreme = (variacaoMag > tolMag) | (variacaoFas > tolFas)
+
+    novas = []
+    for i in np.flatnonzero(largo & (ressonancia | ingreme)):
+        # Divisões do intervalo: passo fino na ressonância, ponto médio fora
+        partes = int(np.ceil(np.log(razao[i])/np.log(passoFino) - 1e-6)) if ressonancia[i] else 2
+        novas.append(freq[i]*razao[i]**(np.arange(1, partes)/partes))
+    if not novas:
+        return np.empty(0)
+    novas = np.concatenate(novas).astype(np.float32).astype(float)
+    # Frequências iguais às medidas após o arredondamento não são repetidas
+    return np.setdiff1d(novas, freq.astype(np.float32).astype(float))
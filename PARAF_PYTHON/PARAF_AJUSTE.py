@@ -0,0 +1,140 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_AJUSTE.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Ajuste por mínimos quadrados não lineares do modelo de PARAF_MODELO à
+curva de impedância complexa medida (magnitude e fase), com o jacobiano
+analítico do modelo
+O ponto de partida vem dos parâmetros extraídos por PARAF_PARAMETROS e,
+em um lote, também do resultado da curva anterior
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy.optimize import least_squares
+
+import PARAF_MODELO
+import PARAF_PARAMETROS
+
+# Parâmetros ajustados (RED fica fixo: o modelo só depende de LE + RED)
+PARAMETROS_AJUSTE = ('RE', 'FS', 'RS', 'QMS', 'LE')
+# Fração final da curva usada na estimativa inicial de LE
+FRACAO_LE = 0.1
+# Máximo de avaliações do modelo por curva
+AVALIACOES_MAX = 100
+
+
+def impedanciaMedida(mag, fas):
+    '''
+    Impedância Complexa a Partir da Magnitude e da Fase (graus)
+    '''
+    return np.asarray(mag, dtype=float)*np.exp(1j*np.radians(np.asarray(fas, dtype=float)))
+
+
+def _estimaLE(freq, imp, RE):
+    # Parte imaginária restante nas frequências altas, onde domina o termo S*LE
+    inicio = int(len(freq)*(1 - FRACAO_LE))
+    LE = np.median((imp[inicio:] - RE).imag/(2*np.pi*freq[inicio:]))
+    return max(float(LE), 0.0) if np.isfinite(LE) else 0.0
+
+
+class _Residuos(object):
+    '''
+    Resíduos Relativos (Re, Im) e Jacobiano do Modelo para uma Curva
+    '''
+    def __init__(self, freq, imp, RED):
+        self.freq = freq
+        self.imp = imp
+        self.RED = RED
+        # Erro relativo: cada ponto pesa igual fora e dentro da ressonância
+        self.peso = 1/np.abs(imp)
+
+    def __call__(self, p):
+        erro = (PARAF_MODELO.impedancia(self.freq, *p, self.RED) - self.imp)*self.peso
+        return np.concatenate((erro.real, erro.imag))
+
+    def jacobiano(self, p):
+        J = PARAF_MODELO.jacobiano(self.freq, *p)*self.peso[:, None]
+        return np.concatenate((J.real, J.imag))
+
+    def custo(self, p):
+        with np.errstate(all='ignore'):
+            r = self(p)
+        return np.sqrt(np.mean(r**2)) if np.all(np.isfinite(r)) else np.inf
+
+
+def ajustaCurva(freq, mag, fas, inicial=None, RED=0.0):
+    '''
+    Ajusta o Modelo a uma Curva de Impedância
+
+    inicial é uma sequência (RE, FS, RS, QMS, LE) usada como ponto de
+    partida além dos parâmetros extraídos da própria curva; o melhor dos
+    dois é usado. Retorna um dicionário com os parâmetros (float), 'status'
+    (códigos de PARAF_PARAMETROS), 'erro' (erro relativo RMS do ajuste) e
+    'avaliacoes' (avaliações do modelo).
+    '''
+    freq = np.asarray(freq, dtype=float)
+    mag = np.asarray(mag, dtype=float)
+    fas = np.asarray(fas, dtype=float)
+    validos = np.isfinite(freq) & np.isfinite(mag) & np.isfinite(fas) & (freq > 0) & (mag > 0)
+    freq, mag, fas = freq[validos], mag[validos], fas[validos]
+    residuos = _Residuos(freq, impedanciaMedida(mag, fas), RED)
+
+    # Pontos de partida: extração da curva e curva anterior do lote
+    partidas = []
+    extraidos = PARAF_PARAMETROS.parametrosCurva(freq, mag)
+    status = extraidos['status']
+    if status == PARAF_PARAMETROS.OK:
+        partidas.append((extraidos['RE'], extraidos['FS'], extraidos['RS'], extraidos['QMS'],
+                         _estimaLE(freq, residuos.imp, extraidos['RE'])))
+    if inicial is not None:
+        partidas.append(tuple(float(valor) for valor in inicial))
+    resultado = {nome: np.nan for nome in PARAMETROS_AJUSTE + ('QES', 'QTS')}
+    resultado.update(RED=RED, erro=np.inf, avaliacoes=0, status=status)
+    if not partidas:
+        return resultado
+    p0 = min(partidas, key=residuos.custo)
+    if not np.isfinite(residuos.custo(p0)):
+        resultado['status'] = PARAF_PARAMETROS.INVALIDO
+        return resultado
+
+    # Limites: resistências, frequência e fator de qualidade positivos
+    minimo = np.array([0.0, freq.min()*1e-3, 0.0, 1e-6, 0.0])
+    p0 = np.maximum(p0, minimo + 1e-12)
+    with np.errstate(all='ignore'):
+        ajuste = least_squares(residuos, p0, jac=residuos.jacobiano, bounds=(minimo, np.inf),
+                               x_scale='jac', max_nfev=AVALIACOES_MAX)
+    RE, FS, RS, QMS, LE = (float(valor) for valor in ajuste.x)
+    resultado.update(RE=RE, FS=FS, RS=RS, QMS=QMS, LE=LE, avaliacoes=ajuste.nfev,
+                     erro=residuos.custo(ajuste.x), status=PARAF_PARAMETROS.OK)
+    if RS <= RE or not np.isfinite(resultado['erro']):
+        resultado['status'] = PARAF_PARAMETROS.INVALIDO
+        return resultado
+    resultado['QES'] = QMS/(RS/RE - 1)
+    resultado['QTS'] = QMS*(RE/RS)
+    return resultado
+
+
+def ajustaCurvas(curvas, RED=0.0):
+    '''
+    Ajusta o Modelo a um Lote de Curvas (freq, mag, fas)
+
+    Cada ajuste parte também do resultado da última curva ajustada, o que
+    reduz as iterações em lotes do mesmo modelo de alto-falante. Retorna
+    um gerador com o resultado de cada curva, como ajustaCurva().
+    '''
+    anterior = None
+    for freq, mag, fas in curvas:
+        resultado = ajustaCurva(freq, mag, fas, anterior, RED)
+        if resultado['status'] == PARAF_PARAMETROS.OK:
+            anterior = tuple(resultado[nome] for nome in PARAMETROS_AJUSTE)
+        yield resultado
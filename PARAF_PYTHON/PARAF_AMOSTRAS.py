@@ -0,0 +1,159 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_AMOSTRAS.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Cálculo da impedância a partir das amostras brutas de tensão e corrente
+enviadas pela placa no modo de amostras (Proto.modo_bruto)
+Os métodos SWF e ZC de Ensaio.cpp são avaliados em todas as frequências
+de uma vez (uma linha por frequência)
+As amostras são guardadas junto da curva para recalculá-la depois
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+
+# Taxa de amostragem da interrupção da placa (MCK/8/238)
+TX_AMOSTRAGEM = 10500000/238
+
+
+def _linhas(freq, saida, entrada):
+    # Frequências (m,) e amostras (m, N) em float
+    freq = np.atleast_1d(np.asarray(freq, dtype=float))
+    saida = np.atleast_2d(np.asarray(saida, dtype=float))
+    entrada = np.atleast_2d(np.asarray(entrada, dtype=float))
+    if saida.shape != entrada.shape or saida.shape[0] != freq.shape[0]:
+        raise ValueError("Amostras %s e %s incompatíveis com %d frequências"
+                         % (saida.shape, entrada.shape, freq.shape[0]))
+    return freq, saida, entrada
+
+
+def corrigeAngulo(fas):
+    '''
+    Ângulo (Graus) Levado ao Intervalo entre -180 e 180
+    '''
+    return (fas + 180.0) % 360.0 - 180.0
+
+
+def impedanciaSWF(freq, saida, entrada):
+    '''
+    Ajuste de Curvas Senoidais (Método SWF) em Todas as Frequências
+
+    Ajusta A*cos(wt) + B*sin(wt) + C às amostras de cada linha pelo método
+    dos mínimos quadrados, na frequência conhecida. Retorna a relação
+    entre as amplitudes da tensão e da corrente (sem o fator de calibração)
+    e a diferença de fase em graus.
+    '''
+    freq, saida, entrada = _linhas(freq, saida, entrada)
+    N = saida.shape[1]
+    wt = (2*np.pi/TX_AMOSTRAGEM)*freq[:, None]*np.arange(N)
+    base = np.stack((np.cos(wt), np.sin(wt), np.ones_like(wt)), axis=1)
+
+    # Equações normais (m, 3, 3), comuns aos dois canais
+    E = np.einsum('min,mjn->mij', base, base)
+    G = np.einsum('min,mcn->mic', base, np.stack((saida, entrada), axis=1))
+    X = np.linalg.solve(E, G)
+
+    # Amplitude e fase em relação ao seno
+    amplitude = np.hypot(X[:, 0], X[:, 1])
+    fase = np.degrees(np.arctan2(X[:, 0], X[:, 1]))
+    impMag = amplitude[:, 0]/amplitude[:, 1]
+    impFas = corrigeAngulo(fase[:, 0] - fase[:, 1])
+    return impMag, impFas
+
+
+def _primeiroCruzamento(amostras, nivel, inicio):
+    # Primeira passagem ascendente por nivel a partir da coluna inicio,
+    # com interpolação linear (NaN se não houver)
+    colunas = np.arange(amostras.shape[1] - 1)
+    cruza = (amostras[:, :-1] < nivel[:, None]) & (amostras[:, 1:] > nivel[:, None])
+    cruza &= colunas >= inicio[:, None]
+    achou = cruza.any(axis=1)
+    i = cruza.argmax(axis=1)
+    linhas = np.arange(amostras.shape[0])
+    S0 = amostras[linhas, i] - nivel
+    S1 = amostras[linhas, i + 1] - nivel
+    return np.where(achou, i - S0/(S1 - S0), np.nan)
+
+
+def impedanciaZC(freq, saida, entrada):
+    '''
+    Cruzamento por Zero (Método ZC) em Todas as Frequências
+
+    A magnitude é a relação entre os valores RMS e a fase vem das primeiras
+    passagens ascendentes pelo valor médio, como Ensaio::calculaImpedanciaZC.
+    Linhas sem cruzamentos suficientes têm fase NaN.
+    '''
+    freq, saida, entrada = _linhas(freq, saida, entrada)
+    saidaDC = saida.mean(axis=1)
+    entradaDC = entrada.mean(axis=1)
+    impMag = saida.std(axis=1)/entrada.std(axis=1)
+
+    zero = np.zeros(len(freq), dtype=int)
+    zeroSaidaA = _primeiroCruzamento(saida, saidaDC, zero)
+    # O segundo cruzamento começa no ponto seguinte ao primeiro
+    zeroSaidaB = _primeiroCruzamento(saida, saidaDC, np.nan_to_num(np.floor(zeroSaidaA)).astype(int) + 1)
+    zeroEntrada = _primeiroCruzamento(entrada, entradaDC, zero)
+
+    impFas = 360.0*((zeroEntrada - zeroSaidaA)/(zeroSaidaB - zeroSaidaA))
+    return impMag, corrigeAngulo(impFas)
+
+
+# Métodos de cálculo pelo nome ou pelo código (ver Proto._compoeConfiguracao)
+METODOS = {'SWF': impedanciaSWF, 'ZC': impedanciaZC, 0: impedanciaSWF, 1: impedanciaZC}
+
+
+def calculaImpedancias(freq, saida, entrada, metodo='SWF'):
+    '''
+    Retorna a Magnitude (sem Calibração) e a Fase pelo Método Escolhido
+    '''
+    try:
+        calcula = METODOS[metodo]
+    except KeyError:
+        raise ValueError("Método de cálculo da impedância inválido: %r" % (metodo,))
+    return calcula(freq, saida, entrada)
+
+
+def caminhoAmostras(filename):
+    '''
+    Arquivo das Amostras Guardado ao Lado da Curva (curva.npy -> curva.amostras.npz)
+    '''
+    return os.path.splitext(filename)[0] + '.amostras.npz'
+
+
+def salvaAmostras(filename, freq, saida, entrada):
+    np.savez_compressed(caminhoAmostras(filename), freq=freq, saida=saida, entrada=entrada)
+
+
+def removeAmostras(filename):
+    '''
+    Remove as Amostras de uma Curva Salva de Novo sem Amostras
+    '''
+    caminho = caminhoAmostras(filename)
+    if os.path.exists(caminho):
+        os.remove(caminho)
+
+
+def carregaAmostras(filename, freq=None):
+    '''
+    Carrega as Amostras da Curva (None se a curva não tiver amostras)
+    Com freq (frequências da curva), amostras de outra curva são ignoradas
+    '''
+    caminho = caminhoAmostras(filename)
+    if not os.path.exists(caminho):
+        return None
+    with np.load(caminho) as arquivo:
+        amostras = arquivo['freq'], arquivo['saida'], arquivo['entrada']
+    if freq is not None and (len(amostras[0]) != len(freq) or not np.allclose(amostras[0], freq)):
+        return None
+    return amostras
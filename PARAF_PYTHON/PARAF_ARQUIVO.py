@@ -0,0 +1,395 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_ARQUIVO.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Arquivo de medidas (.paraf) com vários ensaios acrescentados em sequência
+Um cabeçalho de tamanho fixo aponta para blocos de índice com um registro
+de tamanho fixo por ensaio (configuração, fator de calibração, método, data,
+alto-falante, placa e parâmetros), e cada curva fica em um bloco colunar de
+float32 (frequência, magnitude, fase), com as amostras brutas opcionais
+Os blocos são lidos por mapeamento em memória: uma curva, ou só os
+parâmetros, são lidos sem carregar o restante do arquivo
+Também converte as curvas salvas em .npy por Ensaio.Salva
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import struct
+from datetime import datetime
+from time import time
+
+import numpy as np
+
+import PARAF_AMOSTRAS
+import PARAF_PARAMETROS
+from PARAF_PARAMETROS import PARAMETROS
+
+EXTENSAO = '.paraf'
+ASSINATURA = b'PARAFARQ'
+VERSAO = 1
+
+# Cabeçalho: assinatura, versão, registros por bloco de índice, número de
+# registros gravados e posição do primeiro bloco de índice
+CABECALHO = struct.Struct('<8sIIIQ')
+TAMANHO_CABECALHO = 64
+POSICAO_REGISTROS = 16
+# Cada bloco de índice começa com a posição do próximo (0 = último)
+ENCADEAMENTO = struct.Struct('<Q')
+TAMANHO_ENCADEAMENTO = 16
+REGISTROS_BLOCO = 256
+# Alinhamento do início dos blocos de dados
+ALINHAMENTO = 64
+
+# Configuração da varredura, na ordem de Proto.configuraEnsaio
+CONFIGURACAO = ('freqInicial', 'freqFinal', 'passo', 'freqRelInicial', 'freqRelFinal',
+                'passoRel', 'fatorRegime')
+
+# Registro de cada ensaio no índice
+REGISTRO = np.dtype([
+    ('curva', '<u8'),           # Posição do bloco da curva (3, pontos) float32
+    ('pontos', '<u4'),
+    ('linhasAmostras', '<u4'),  # Amostras: frequências (m,) float32 e (2, m, N) uint16
+    ('amostras', '<u8'),        # Posição do bloco das amostras (0 = sem amostras)
+    ('colunasAmostras', '<u4'),
+    ('tamanhoMetadados', '<u4'),
+    ('metadados', '<u8'),       # Posição dos metadados extras (JSON)
+    ('data', '<f8'),            # Data do ensaio (segundos desde a época)
+    ('fatorCal', '<f8'),
+    ('configuracao', '<f8', (len(CONFIGURACAO),)),
+    ('parametros', '<f8', (len(PARAMETROS),)),
+    ('status', '<i4'),          # Situação da extração (PARAF_PARAMETROS)
+    ('metodo', 'S4'),
+    ('altoFalante', 'S32'),
+    ('placa', 'S32'),           # Número de série da placa (hexadecimal)
+])
+
+
+class ArquivoInvalido(ValueError):
+    '''
+    O Arquivo não é um Arquivo de Medidas ou Está Corrompido
+    '''
+
+
+def _texto(valor):
+    return valor.decode('utf-8', 'replace')
+
+
+class Arquivo(object):
+    '''
+    Arquivo de Medidas com Ensaios Acrescentados em Sequência
+
+    modo 'r' só lê; 'a' cria o arquivo se não existir e permite acrescentar
+    ensaios com adiciona(). Os vetores retornados por curva() e amostras()
+    são mapeados em memória (somente leitura) e valem enquanto o arquivo
+    estiver aberto.
+    '''
+    def __init__(self, caminho, modo='r'):
+        if modo not in ('r', 'a'):
+            raise ValueError("Modo inválido: %r" % (modo,))
+        self.caminho = caminho
+        self.modo = modo
+        if modo == 'a' and (not os.path.exists(caminho) or os.path.getsize(caminho) == 0):
+            self._cria()
+        self._arquivo = open(caminho, 'rb' if modo == 'r' else 'r+b')
+        self._mapa = None
+        self._leIndice()
+
+    def _cria(self):
+        # Cabeçalho e primeiro bloco de índice vazio
+        cabecalho = CABECALHO.pack(ASSINATURA, VERSAO, REGISTROS_BLOCO, 0, TAMANHO_CABECALHO)
+        with open(self.caminho, 'wb') as arquivo:
+            arquivo.write(cabecalho.ljust(TAMANHO_CABECALHO, b'\0'))
+            arquivo.write(bytes(TAMANHO_ENCADEAMENTO + REGISTROS_BLOCO*REGISTRO.itemsize))
+
+    def _leIndice(self):
+        self._arquivo.seek(0)
+        dados = self._arquivo.read(TAMANHO_CABECALHO)
+        if len(dados) < CABECALHO.size:
+            raise ArquivoInvalido("%s: arquivo de medidas incompleto" % self.caminho)
+        assinatura, versao, self.registrosBloco, self._registros, posicao = CABECALHO.unpack_from(dados)
+        if assinatura != ASSINATURA:
+            raise ArquivoInvalido("%s não é um arquivo de medidas" % self.caminho)
+        if versao > VERSAO:
+            raise ArquivoInvalido("%s: versão %d não suportada" % (self.caminho, versao))
+
+        # Posições dos blocos de índice (só o encadeamento é lido)
+        self._blocos = []
+        while posicao:
+            self._blocos.append(posicao)
+            self._arquivo.seek(posicao)
+            posicao, = ENCADEAMENTO.unpack(self._arquivo.read(ENCADEAMENTO.size))
+        self._mapeia()
+
+    def _mapeia(self):
+        # Mapeamento do arquivo inteiro (as páginas só são lidas quando usadas)
+        self._mapa = np.memmap(self.caminho, dtype=np.uint8, mode='r')
+        self._indices = [np.ndarray(self.registrosBloco, REGISTRO, self._mapa,
+                                    posicao + TAMANHO_ENCADEAMENTO) for posicao in self._blocos]
+
+    def __len__(self):
+        return self._registros
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fecha()
+
+    def fecha(self):
+        self._indices = []
+        self._mapa = None
+        if not self._arquivo.closed:
+            self._arquivo.close()
+
+    def _registro(self, indice):
+        if indice < 0:
+            indice += self._registros
+        if not 0 <= indice < self._registros:
+            raise IndexError("Ensaio %d fora do arquivo (%d ensaios)" % (indice, self._registros))
+        return self._indices[indice//self.registrosBloco][indice % self.registrosBloco]
+
+    def registros(self):
+        '''
+        Registros de Todos os Ensaios (Vetor Estruturado REGISTRO)
+        Filtros por parâmetros, data ou alto-falante usam só o índice
+        '''
+        if not self._registros:
+            return np.empty(0, REGISTRO)
+        return np.concatenate(self._indices)[:self._registros]
+
+    def info(self, indice):
+        '''
+        Configuração, Calibração, Parâmetros e Identificação de um Ensaio
+        '''
+        registro = self._registro(indice)
+        info = {nome: float(valor) for nome, valor in zip(CONFIGURACAO, registro['configuracao'])}
+        info.update({nome: float(valor) for nome, valor in zip(PARAMETROS, registro['parametros'])})
+        info.update(pontos=int(registro['pontos']), data=float(registro['data']),
+                    fatorCal=float(registro['fatorCal']), status=int(registro['status']),
+                    metodo=_texto(registro['metodo']), altoFalante=_texto(registro['altoFalante']),
+                    placa=_texto(registro['placa']), temAmostras=bool(registro['amostras']))
+        return info
+
+    def curva(self, indice):
+        '''
+        Frequência, Magnitude e Fase de um Ensaio (float32 Mapeados em Memória)
+        '''
+        registro = self._registro(indice)
+        colunas = np.ndarray((3, int(registro['pontos'])), '<f4', self._mapa, int(registro['curva']))
+        return colunas[0], colunas[1], colunas[2]
+
+    def amostras(self, indice):
+        '''
+        Amostras (Frequências, Tensão, Corrente) de um Ensaio ou None
+        '''
+        registro = self._registro(indice)
+        if not registro['amostras']:
+            return None
+        m, N = int(registro['linhasAmostras']), int(registro['colunasAmostras'])
+        posicao = int(registro['amostras'])
+        freq = np.ndarray(m, '<f4', self._mapa, posicao)
+        sinais = np.ndarray((2, m, N), '<u2', self._mapa, posicao + 4*m)
+        return freq, sinais[0], sinais[1]
+
+    def metadados(self, indice):
+        '''
+        Metadados Extras de um Ensaio (Dicionário Gravado em JSON)
+        '''
+        registro = self._registro(indice)
+        if not registro['tamanhoMetadados']:
+            return {}
+        inicio = int(registro['metadados'])
+        return json.loads(bytes(self._mapa[inicio:inicio + int(registro['tamanhoMetadados'])]).decode('utf-8'))
+
+    def _acrescenta(self, dados):
+        # Grava dados no fim do arquivo, alinhados, e retorna a posição
+        fim = self._arquivo.seek(0, os.SEEK_END)
+        posicao = -(-fim//ALINHAMENTO)*ALINHAMENTO
+        self._arquivo.write(bytes(posicao - fim))
+        self._arquivo.write(dados)
+        return posicao
+
+    def adiciona(self, freq, mag, fas, amostras=None, parametros=None, metadados=None, **info):
+        '''
+        Acrescenta um Ensaio e Retorna o seu Índice
+
+        info: data, fatorCal, metodo, altoFalante, placa e os campos de
+        CONFIGURACAO (os ausentes ficam zerados, a data é a atual).
+        parametros: dicionário de PARAF_PARAMETROS.parametrosCurva (extraídos
+        da curva se None). metadados: dicionário extra gravado em JSON.
+        O número de registros do cabeçalho só é atualizado depois dos dados,
+        então uma gravação interrompida não deixa um ensaio incompleto.
+        '''
+        if self.modo != 'a':
+            raise IOError("%s aberto somente para leitura" % self.caminho)
+        curva = np.vstack((freq, mag, fas)).astype('<f4')
+        if parametros is None:
+            parametros = PARAF_PARAMETROS.parametrosCurva(curva[0], curva[1])
+
+        registro = np.zeros((), REGISTRO)
+        registro['pontos'] = curva.shape[1]
+        registro['curva'] = self._acrescenta(curva.tobytes())
+        if amostras is not None:
+            freqAmostras, saida, entrada = amostras
+            sinais = np.stack((saida, entrada)).astype('<u2')
+            registro['linhasAmostras'], registro['colunasAmostras'] = sinais.shape[1:]
+            registro['amostras'] = self._acrescenta(np.asarray(freqAmostras, '<f4').tobytes() + sinais.tobytes())
+        if metadados:
+            texto = json.dumps(metadados, sort_keys=True).encode('utf-8')
+            registro['metadados'] = self._acrescenta(texto)
+            registro['tamanhoMetadados'] = len(texto)
+        registro['data'] = info.get('data') or time()
+        registro['fatorCal'] = info.get('fatorCal', 0.0)
+        registro['configuracao'] = [info.get(nome, 0.0) for nome in CONFIGURACAO]
+        registro['parametros'] = [parametros[nome] for nome in PARAMETROS]
+        registro['status'] = parametros['status']
+        for campo in ('metodo', 'altoFalante', 'placa'):
+            registro[campo] = (info.get(campo) or '').encode('utf-8')[:REGISTRO[campo].itemsize]
+
+        # Bloco de índice cheio: novo bloco encadeado ao último
+        indice = self._registros
+        if indice == len(self._blocos)*self.registrosBloco:
+            posicao = self._acrescenta(bytes(TAMANHO_ENCADEAMENTO + self.registrosBloco*REGISTRO.itemsize))
+            self._arquivo.seek(self._blocos[-1])
+            self._arquivo.write(ENCADEAMENTO.pack(posicao))
+            self._blocos.append(posicao)
+        self._arquivo.seek(self._blocos[indice//self.registrosBloco] + TAMANHO_ENCADEAMENTO +
+                           (indice % self.registrosBloco)*REGISTRO.itemsize)
+        self._arquivo.write(registro.tobytes())
+        self._arquivo.flush()
+
+        # Confirma o ensaio no cabeçalho
+        self._registros += 1
+        self._arquivo.seek(POSICAO_REGISTROS)
+        self._arquivo.write(struct.pack('<I', self._registros))
+        self._arquivo.flush()
+        self._mapeia()
+        return indice
+
+
+def configuracaoCurva(ensaio):
+    '''
+    Configuração, Fator de Calibração e Método com que a Curva do Ensaio foi Medida
+    (os do registro de origem para uma curva carregada de um arquivo .paraf)
+    '''
+    nomes = CONFIGURACAO + ('fatorCal', 'metodo')
+    if ensaio.infoCurva is not None:
+        return {nome: ensaio.infoCurva[nome] for nome in nomes}
+    return {nome: getattr(ensaio, nome) for nome in nomes}
+
+
+def salvaEnsaio(caminho, ensaio):
+    '''
+    Acrescenta a Curva de um Ensaio ao Arquivo e Retorna o seu Índice
+    Uma curva carregada de um arquivo .paraf é gravada com a configuração,
+    a calibração e os metadados do registro de origem
+    '''
+    info = configuracaoCurva(ensaio)
+    info.update(data=ensaio.dataEnsaio, altoFalante=ensaio.altoFalante, placa=ensaio.placa)
+    metadados = {}
+    if ensaio.infoCurva is not None:
+        metadados.update(ensaio.infoCurva['metadados'])
+    if ensaio.temposRegime is not None:
+        metadados['temposRegime'] = [float(tempo) for tempo in ensaio.temposRegime]
+    # Curva corrigida pela tabela de calibração da placa em vez de fatorCal
+    if ensaio.infoCurva is None and ensaio.tabelaCal is not None:
+        metadados['tabelaCal'] = {'data': ensaio.tabelaCal.data,
+                                  'resistores': [float(R) for R in ensaio.tabelaCal.resistores]}
+    with Arquivo(caminho, 'a') as arquivo:
+        return arquivo.adiciona(ensaio.impFreq, ensaio.impMag, ensaio.impFas, ensaio.amostras,
+                                metadados=metadados, **info)
+
+
+def carregaEnsaio(caminho, ensaio, indice=-1):
+    '''
+    Carrega um Ensaio do Arquivo (o Último, por Padrão) no Objeto Ensaio
+    A configuração e o fator de calibração do ensaio carregado não substituem
+    os da sessão atual: ficam em ensaio.infoCurva (Arquivo.info() e os
+    metadados), usado por salvaEnsaio
+    '''
+    with Arquivo(caminho) as arquivo:
+        info = arquivo.info(indice)
+        info['metadados'] = arquivo.metadados(indice)
+        ensaio.impFreq, ensaio.impMag, ensaio.impFas = (np.array(coluna, dtype=float)
+                                                        for coluna in arquivo.curva(indice))
+        amostras = arquivo.amostras(indice)
+        ensaio.amostras = None if amostras is None else tuple(np.array(valores) for valores in amostras)
+    tempos = info['metadados'].get('temposRegime')
+    ensaio.temposRegime = None if tempos is None else np.array(tempos)
+    ensaio.infoCurva = info
+    ensaio.dataEnsaio = info['data']
+    ensaio.altoFalante = info['altoFalante']
+    ensaio.placa = info['placa']
+
+
+def copiaEnsaio(origem, destino, indice=-1):
+    '''
+    Acrescenta um Ensaio de um Arquivo (o Último, por Padrão) a Outro, com
+    a Curva, as Amostras, os Metadados e o Registro (Configuração, Calibração,
+    Parâmetros e Identificação) Inalterados. Retorna o Índice no Destino.
+    '''
+    with Arquivo(origem) as arquivo:
+        info = arquivo.info(indice)
+        freq, mag, fas = (np.array(coluna) for coluna in arquivo.curva(indice))
+        amostras = arquivo.amostras(indice)
+        amostras = None if amostras is None else tuple(np.array(valores) for valores in amostras)
+        metadados = arquivo.metadados(indice)
+    with Arquivo(destino, 'a') as arquivo:
+        return arquivo.adiciona(freq, mag, fas, amostras, parametros=info, metadados=metadados, **info)
+
+
+def converte(arquivos, destino, altoFalante=''):
+    '''
+    Acrescenta Curvas Salvas em .npy (e as suas Amostras) ao Arquivo
+    A data do ensaio é a data de modificação do .npy; o nome do arquivo
+    fica nos metadados. Retorna o número de curvas convertidas.
+    '''
+    with Arquivo(destino, 'a') as arquivo:
+        for caminho in arquivos:
+            freq, mag, fas = np.load(caminho)
+            arquivo.adiciona(freq, mag, fas, PARAF_AMOSTRAS.carregaAmostras(caminho, freq),
+                             metadados={'origem': os.path.basename(caminho)},
+                             data=os.path.getmtime(caminho), altoFalante=altoFalante)
+    return len(arquivos)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='paraf-archive', description='Arquivos de medidas (.paraf)')
+    comandos = parser.add_subparsers(dest='comando')
+    converteArgs = comandos.add_parser('converte', help='acrescenta curvas .npy a um arquivo de medidas')
+    converteArgs.add_argument('arquivos', nargs='+', help='curvas salvas por Ensaio.Salva (.npy)')
+    converteArgs.add_argument('-o', '--destino', required=True, help='arquivo de medidas (.paraf)')
+    converteArgs.add_argument('--alto-falante', default='', help='identificação do alto-falante')
+    listaArgs = comandos.add_parser('lista', help='lista os ensaios e os parâmetros de um arquivo')
+    listaArgs.add_argument('arquivo', help='arquivo de medidas (.paraf)')
+    args = parser.parse_args()
+
+    if args.comando == 'converte':
+        convertidos = converte(args.arquivos, args.destino, args.alto_falante)
+        print("%d curvas -> %s" % (convertidos, args.destino))
+    elif args.comando == 'lista':
+        with Arquivo(args.arquivo) as arquivo:
+            for indice in range(len(arquivo)):
+                info = arquivo.info(indice)
+                situacao = PARAF_PARAMETROS.DESCRICAO.get(info['status'], '?')
+                data = datetime.fromtimestamp(info['data']).strftime('%Y-%m-%d %H:%M')
+                print("%4d %s %-12s %5d pontos  RE=%.3f FS=%.2f QTS=%.3f (%s)"
+                      % (indice, data, info['altoFalante'] or '-', info['pontos'],
+                         info['RE'], info['FS'], info['QTS'], situacao))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_BENCHMARK.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Mede o desempenho da recepção do ProtocolPy em um fluxo de bytes gravado
+A suíte (--suite) mede também a análise, os gráficos (Agg, sem tela) e os
+arquivos em conjuntos fixos (STEEL400-SWF.npy e curvas Thiele-Small
+sintéticas de 100 a 100 mil pontos) e grava os resultados em JSON, para
+comparar versões
+--importacao verifica o tempo de importação a frio dos módulos da linha de
+comando (PARAF_CLI) e que o matplotlib e o SciPy não são carregados
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, time
+
+import numpy as np
+
+from ProtocolPy import Proto
+from ProtocolPy.quadros import codificaBloco
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+# Curva gravada e alto-falante (RE, FS, RS, QMS, LE, RED) das curvas sintéticas
+CURVA_GRAVADA = os.path.join(DIRETORIO, 'STEEL400-SWF.npy')
+ALTO_FALANTE = (6.0, 50.0, 40.0, 4.0, 0.0005, 0.0)
+PONTOS_SINTETICOS = (100, 1000, 10000, 100000)
+# Maior transferência do protocolo (número de valores em 16 bits)
+VALORES_MAX = 0xFFFF
+# Módulos da linha de comando, orçamento da importação a frio [s] e módulos
+# que só devem ser carregados quando usados
+MODULOS_INICIO = ('PARAF_ENSAIO', 'PARAF_CLI')
+ORCAMENTO_IMPORTACAO = 0.3
+MODULOS_ADIADOS = ('matplotlib', 'scipy', 'PyQt5')
+
+
+class SerialGravado(object):
+    '''
+    Porta Serial que Reproduz um Fluxo de Bytes Gravado
+
+    O fluxo é dividido em trechos (prefixo, mensagens). O primeiro trecho está
+    disponível desde o início e cada confirmação do computador libera o trecho
+    seguinte, como a placa faz em Protocolo::enviaValores. Uma falha reenvia
+    as mensagens do trecho atual sem o prefixo. No modo de blocos cada
+    resposta (mensagem de 5 bytes) libera o próximo bloco ou reenvia o atual.
+    '''
+    def __init__(self, trechos):
+        self._trechos = list(trechos)
+        self._proximo = 0
+        self._disponivel = bytearray()
+        self.escritos = bytearray()
+        self.port = 'gravado'
+        self.is_open = True
+        self._libera()
+
+    def _libera(self):
+        if self._proximo < len(self._trechos):
+            prefixo, mensagens = self._trechos[self._proximo]
+            self._disponivel += prefixo + mensagens
+            self._proximo += 1
+
+    def _reenvia(self):
+        if self._proximo > 0:
+            self._disponivel += self._trechos[self._proximo - 1][1]
+
+    @property
+    def in_waiting(self):
+        return len(self._disponivel)
+
+    @property
+    def out_waiting(self):
+        return 0
+
+    def read(self, n=1):
+        dados = bytes(self._disponivel[:n])
+        del self._disponivel[:n]
+        return dados
+
+    def write(self, dados):
+        self.escritos += dados
+        if len(dados) == 5 and dados[0] == Proto.mens_inicio:
+            if dados[1] == Proto.bloco_reenv:
+                self._reenvia()
+            else:
+                self._libera()
+            return len(dados)
+        for resposta in bytes(dados):
+            if resposta == Proto.rec_falha:
+                self._reenvia()
+            else:
+                self._libera()
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        del self._disponivel[:]
+
+    def isOpen(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def gravaValores(valores, lixo=0, semente=0):
+    '''
+    Grava o Fluxo Enviado por Protocolo::enviaValores
+
+    Retorna os trechos liberados a cada confirmação. Com lixo > 0 são
+    inseridos bytes aleatórios antes de alguns valores para exercitar a
+    ressincronização.
+    '''
+    aleatorio = np.random.RandomState(semente)
+    trechos = []
+    for valor in [len(valores)] + list(valores):
+        prefixo = b''
+        if lixo and aleatorio.rand() < lixo:
+            prefixo = bytes(aleatorio.randint(0, 256, 3).astype(np.uint8))
+        mensagens = bytes([Proto.mens_inicio, Proto.byte_LS, valor & 0xFF, Proto.mens_final,
+                           Proto.mens_inicio, Proto.byte_MS, valor >> 8, Proto.mens_final])
+        trechos.append((prefixo, mensagens))
+    return trechos
+
+
+def gravaBlocos(valores, transferencia=0, tamanhoBloco=Proto.tamanhoBloco):
+    '''
+    Grava o Fluxo de uma Transferência em Blocos (um trecho por bloco)
+    '''
+    dados = np.asarray(valores, dtype='<u2').tobytes()
+    passo = 2*tamanhoBloco
+    return [(b'', codificaBloco(transferencia, seq, len(valores), dados[inicio:inicio + passo]))
+            for seq, inicio in enumerate(range(0, max(len(dados), 1), passo))]
+
+
+def gravaImpedancias(freq, mag, fas, blocos=False, lixo=0, semente=0):
+    '''
+    Grava o Fluxo das Seis Transferências de Protocolo::enviaImpedancias
+    (palavras LSB e MSB do float32 das frequências, magnitudes e fases)
+    '''
+    trechos = []
+    for transferencia, valores in enumerate((freq, mag, fas)):
+        palavras = np.asarray(valores, dtype='<f4').view('<u2')
+        for parte, palavrasParte in enumerate((palavras[0::2], palavras[1::2])):
+            if blocos:
+                trechos += gravaBlocos(palavrasParte, 2*transferencia + parte)
+            else:
+                trechos += gravaValores(palavrasParte, lixo, semente)
+    return trechos
+
+
+class ProtoGravado(Proto):
+    '''
+    Proto que Recebe de um Fluxo Gravado (sem Abrir a Porta)
+    '''
+    def __init__(self, trechos, modoBloco=False):
+        self._trechos = trechos
+        super().__init__('gravado')
+        self.modoBloco = self.analisador.modoBloco = modoBloco
+
+    def abre(self, serie=None):
+        # Sem sessão com a placa: a porta é o fluxo gravado
+        self.ser = SerialGravado(self._trechos)
+
+
+def protoGravado(trechos, modoBloco=False):
+    '''
+    Cria um Proto que Recebe de um Fluxo Gravado (sem abrir a porta)
+    '''
+    return ProtoGravado(trechos, modoBloco)
+
+
+def benchmarkRecebeValores(nValores=4096, repeticoes=5, lixo=0.0):
+    '''
+    Mede o Tempo de Proto.recebeValores em uma Captura do Sinal de Teste
+    '''
+    valores = np.random.RandomState(1).randint(0, 4096, nValores).tolist()
+    trechos = gravaValores(valores, lixo)
+    tempos = []
+    for _ in range(repeticoes):
+        proto = protoGravado(trechos)
+        inicio = perf_counter()
+        recebidos = proto.recebeValores()
+        tempos.append(perf_counter() - inicio)
+        assert list(recebidos) == valores
+    return tempos
+
+
+def curvaSintetica(pontos, semente=0):
+    '''
+    Curva Thiele-Small de ALTO_FALANTE (10 Hz a 2 kHz) com Ruído Fixo de 0.5 %
+    '''
+    import PARAF_MODELO
+
+    freq = np.geomspace(10.0, 2000.0, pontos)
+    aleatorio = np.random.RandomState(semente)
+    imp = PARAF_MODELO.impedancia(freq, *ALTO_FALANTE)*(1 + 0.005*aleatorio.randn(pontos))
+    return freq, np.abs(imp), np.angle(imp, deg=True)
+
+
+def conjuntos(pontos=PONTOS_SINTETICOS):
+    '''
+    Conjuntos da Suíte: a Curva Gravada e as Curvas Sintéticas (nome, curva)
+    '''
+    if os.path.exists(CURVA_GRAVADA):
+        yield 'STEEL400-SWF', tuple(np.load(CURVA_GRAVADA))
+    for n in pontos:
+        yield 'ts%d' % n, curvaSintetica(n)
+
+
+def _cronometra(executa, repeticoes, prepara=None):
+    # Tempos de cada repetição; prepara() (fora do tempo) entrega o argumento
+    tempos = []
+    for _ in range(repeticoes):
+        argumento = prepara() if prepara is not None else None
+        inicio = perf_counter()
+        executa(argumento)
+        tempos.append(perf_counter() - inicio)
+    return tempos
+
+
+def _revisao():
+    # Revisão do git do código medido (None fora de um repositório)
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL,
+                                       cwd=DIRETORIO).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def tempoImportacao(modulo, repeticoes=5):
+    '''
+    Tempos da Importação a Frio de um Módulo (um Interpretador Novo por Vez)
+    Retorna os tempos e os MODULOS_ADIADOS que a importação carregou
+    '''
+    codigo = ('import sys\n'
+              'from time import perf_counter\n'
+              'inicio = perf_counter()\n'
+              'import %s\n'
+              'print(perf_counter() - inicio)\n'
+              'print(" ".join(nome for nome in %r if nome in sys.modules))' % (modulo, MODULOS_ADIADOS))
+    tempos = []
+    for _ in range(repeticoes):
+        saida = subprocess.check_output([sys.executable, '-c', codigo], cwd=DIRETORIO).decode().split('\n')
+        tempos.append(float(saida[0]))
+        carregados = saida[1].split()
+    return tempos, carregados
+
+
+def verificaImportacao(orcamento=ORCAMENTO_IMPORTACAO, repeticoes=5, modulos=MODULOS_INICIO):
+    '''
+    Verifica o Início a Frio dos Módulos da Linha de Comando
+    Retorna [(módulo, mediana [s], módulos adiados carregados, dentro do orçamento)]
+    '''
+    verificacoes = []
+    for modulo in modulos:
+        tempos, carregados = tempoImportacao(modulo, repeticoes)
+        mediana = float(np.median(tempos))
+        verificacoes.append((modulo, mediana, carregados, mediana <= orcamento and not carregados))
+    return verificacoes
+
+
+def executaSuite(pontos=PONTOS_SINTETICOS, repeticoes=5, lixo=0.0):
+    '''
+    Executa a Suíte e Retorna os Resultados (Dicionário Gravável em JSON)
+
+    Para cada conjunto são medidos: a decodificação de Proto.recebeImpedancias
+    no fluxo gravado (valor a valor e em blocos, até VALORES_MAX pontos),
+    Ensaio.CalculaParametros, PlotaCurvasAnaliticas (cache limpo), grafico
+    desenhado em um canvas Agg e Salva/Carrega em .npy e .paraf. A
+    importação a frio de MODULOS_INICIO também é medida.
+    '''
+    # Gráficos sem tela
+    import matplotlib
+    matplotlib.use('Agg')
+    import scipy
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    import PARAF_MODELO
+    from PARAF_ENSAIO import Ensaio
+
+    def figura(ens=None):
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        if ens is not None:
+            ens.grafico(fig)
+        return fig
+
+    resultados = []
+    for modulo in MODULOS_INICIO:
+        tempos, carregados = tempoImportacao(modulo, repeticoes)
+        resultados.append({'etapa': 'importacao', 'conjunto': modulo, 'pontos': 0, 'tempos': tempos,
+                           'melhor': min(tempos), 'mediana': float(np.median(tempos))})
+    diretorio = tempfile.mkdtemp(prefix='paraf_benchmark_')
+    try:
+        for nome, curva in conjuntos(pontos):
+            freq, mag, fas = (np.asarray(valores, dtype=float) for valores in curva)
+            ens = Ensaio()
+            ens.impFreq, ens.impMag, ens.impFas = freq, mag, fas
+            ens.freqFinal = float(freq.max())
+            ens.CalculaParametros()
+
+            medidas = []
+            if len(freq) <= VALORES_MAX:
+                for etapa, blocos in (('decodificacao', False), ('decodificacao_blocos', True)):
+                    trechos = gravaImpedancias(freq, mag, fas, blocos, lixo)
+                    medidas.append((etapa, lambda proto: proto.recebeImpedancias(),
+                                    lambda trechos=trechos, blocos=blocos: protoGravado(trechos, blocos)))
+            medidas += [
+                ('parametros', lambda _: ens.CalculaParametros(), None),
+                ('analiticas', ens.PlotaCurvasAnaliticas, lambda: PARAF_MODELO.limpaCache() or figura(ens)),
+                ('grafico', lambda fig: (ens.grafico(fig), fig.canvas.draw()), figura),
+            ]
+            for extensao in ('.npy', '.paraf'):
+                caminho = os.path.join(diretorio, nome + extensao)
+
+                def remove(caminho=caminho):
+                    # Cada gravação começa de um arquivo novo (.paraf acrescenta)
+                    if os.path.exists(caminho):
+                        os.remove(caminho)
+                medidas += [('salva' + extensao, lambda _, caminho=caminho: ens.Salva(caminho), remove),
+                            ('carrega' + extensao, lambda _, caminho=caminho: Ensaio().Carrega(caminho), None)]
+
+            for etapa, executa, prepara in medidas:
+                tempos = _cronometra(executa, repeticoes, prepara)
+                resultados.append({'etapa': etapa, 'conjunto': nome, 'pontos': len(freq), 'tempos': tempos,
+                                   'melhor': min(tempos), 'mediana': float(np.median(tempos))})
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    return {
+        'data': time(),
+        'revisao': _revisao(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'bibliotecas': {'numpy': np.__version__, 'matplotlib': matplotlib.__version__, 'scipy': scipy.__version__},
+        'repeticoes': repeticoes,
+        'lixo': lixo,
+        'resultados': resultados,
+    }
+
+
+def compara(suite, base):
+    '''
+    Razão entre as Medianas da Suíte e as de uma Execução Anterior
+    Retorna {(etapa, conjunto): razão} das medidas presentes nas duas
+    '''
+    anteriores = {(medida['etapa'], medida['conjunto']): medida['mediana'] for medida in base['resultados']}
+    return {(medida['etapa'], medida['conjunto']): medida['mediana']/anteriores[medida['etapa'], medida['conjunto']]
+            for medida in suite['resultados']
+            if anteriores.get((medida['etapa'], medida['conjunto']))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do ProtocolPy')
+    parser.add_argument('-n', type=int, default=4096, help='número de valores')
+    parser.add_argument('-r', type=int, default=5, help='repetições')
+    parser.add_argument('--lixo', type=float, default=0.0,
+                        help='fração dos valores precedidos por bytes inválidos')
+    parser.add_argument('--suite', action='store_true',
+                        help='executa a suíte (decodificação, análise, gráficos e arquivos)')
+    parser.add_argument('--pontos', type=int, nargs='+', default=list(PONTOS_SINTETICOS),
+                        help='pontos das curvas sintéticas da suíte')
+    parser.add_argument('--json', help='grava os resultados da suíte neste arquivo')
+    parser.add_argument('--compara', help='resultados anteriores (JSON) para comparar as medianas')
+    parser.add_argument('--importacao', action='store_true',
+                        help='verifica o tempo de importação a frio dos módulos da linha de comando')
+    parser.add_argument('--orcamento', type=float, default=1000*ORCAMENTO_IMPORTACAO,
+                        help='tempo máximo da importação a frio [ms]')
+    args = parser.parse_args()
+
+    if args.importacao:
+        verificacoes = verificaImportacao(args.orcamento/1000, args.r)
+        for modulo, mediana, carregados, ok in verificacoes:
+            print("%-14s %6.0f ms (orçamento %.0f ms)%s  %s"
+                  % (modulo, 1000*mediana, args.orcamento,
+                     '  carregou ' + ', '.join(carregados) if carregados else '', 'ok' if ok else 'FALHA'))
+        return 0 if all(ok for _, _, _, ok in verificacoes) else 1
+
+    if not args.suite:
+        tempos = benchmarkRecebeValores(args.n, args.r, args.lixo)
+        print("recebeValores (%d valores): melhor %.1f ms, média %.1f ms"
+              % (args.n, 1000*min(tempos), 1000*sum(tempos)/len(tempos)))
+        return
+
+    suite = executaSuite(args.pontos, args.r, args.lixo)
+    razoes = {}
+    if args.compara:
+        with open(args.compara) as arquivo:
+            razoes = compara(suite, json.load(arquivo))
+    for medida in suite['resultados']:
+        razao = razoes.get((medida['etapa'], medida['conjunto']))
+        print("%-22s %-14s melhor %10.3f ms  mediana %10.3f ms%s"
+              % (medida['etapa'], medida['conjunto'], 1000*medida['melhor'], 1000*medida['mediana'],
+                 '' if razao is None else '  x%.2f' % razao))
+    if args.json:
+        with open(args.json, 'w') as arquivo:
+            json.dump(suite, arquivo, indent=1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_CALIBRACAO.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Tabela de calibração por frequência e por magnitude de cada placa
+Varreduras em resistores de referência dão, em cada frequência, o fator
+entre a resistência e a magnitude medida (sem calibração) e o desvio da
+fase; a correção de uma curva interpola a tabela na frequência e, entre os
+resistores, na magnitude medida
+As tabelas ficam em um diretório, uma por número de série da placa, e são
+reaproveitadas nas próximas sessões (placas sem número de série não têm
+tabela guardada)
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import os
+from time import time
+
+import numpy as np
+
+from PARAF_AMOSTRAS import corrigeAngulo
+
+# Diretório das tabelas (uma por placa)
+DIRETORIO_PADRAO = os.path.join(os.path.expanduser('~'), '.paraf', 'calibracao')
+
+
+def caminhoTabela(serie, diretorio=DIRETORIO_PADRAO):
+    if not serie:
+        raise ValueError("Placa sem número de série: a tabela não pode ser guardada")
+    return os.path.join(diretorio, 'placa_%s.npz' % serie)
+
+
+class TabelaCalibracao(object):
+    '''
+    Tabela de Calibração de uma Placa
+
+    freq é a grade (n,) da tabela, a da primeira varredura de referência.
+    Para cada resistor (em ordem crescente) são guardadas a magnitude sem
+    calibração (r, n) e a fase (r, n) medidas na grade.
+    '''
+    def __init__(self, serie, freq=None, resistores=(), magnitudes=None, fases=None, data=None):
+        self.serie = serie
+        self.freq = None if freq is None else np.asarray(freq, dtype=float)
+        self.resistores = np.asarray(resistores, dtype=float)
+        n = 0 if self.freq is None else len(self.freq)
+        self.magnitudes = np.empty((0, n)) if magnitudes is None else np.asarray(magnitudes, dtype=float)
+        self.fases = np.empty((0, n)) if fases is None else np.asarray(fases, dtype=float)
+        self.data = data
+
+    def __len__(self):
+        return len(self.resistores)
+
+    def adiciona(self, R, freq, mag, fas):
+        '''
+        Acrescenta (ou Substitui) a Varredura de um Resistor de Referência
+        mag é a magnitude sem calibração; a varredura é interpolada na grade
+        da tabela (em log da frequência)
+        '''
+        freq = np.asarray(freq, dtype=float)
+        mag = np.asarray(mag, dtype=float)
+        fas = np.asarray(fas, dtype=float)
+        validos = np.isfinite(freq) & np.isfinite(mag) & np.isfinite(fas) & (freq > 0) & (mag > 0)
+        if validos.sum() < 2:
+            raise ValueError("Varredura de calibração com menos de dois pontos válidos")
+        ordem = np.argsort(freq[validos])
+        freq, mag, fas = freq[validos][ordem], mag[validos][ordem], fas[validos][ordem]
+        if self.freq is None:
+            self.freq = freq
+            self.magnitudes = np.empty((0, len(freq)))
+            self.fases = np.empty((0, len(freq)))
+        logF = np.log(self.freq)
+        mag = np.exp(np.interp(logF, np.log(freq), np.log(mag)))
+        fas = np.interp(logF, np.log(freq), np.unwrap(np.radians(fas)))
+        fas = corrigeAngulo(np.degrees(fas))
+
+        # O mesmo resistor medido de novo substitui a medida anterior
+        mantidos = ~np.isclose(self.resistores, R, rtol=1e-6)
+        resistores = np.append(self.resistores[mantidos], R)
+        magnitudes = np.vstack((self.magnitudes[mantidos], mag))
+        fases = np.vstack((self.fases[mantidos], fas))
+        ordem = np.argsort(resistores)
+        self.resistores, self.magnitudes, self.fases = resistores[ordem], magnitudes[ordem], fases[ordem]
+        self.data = time()
+
+    def corrige(self, freq, mag, fas):
+        '''
+        Magnitude Calibrada e Fase Corrigida de Pontos Medidos
+
+        Em cada frequência, o fator (em log) e o desvio da fase são
+        interpolados entre os resistores de referência pela magnitude medida
+        (em log); fora da faixa dos resistores vale o resistor mais próximo.
+        '''
+        if not len(self):
+            raise ValueError("Tabela de calibração vazia")
+        freq = np.asarray(freq, dtype=float)
+        mag = np.asarray(mag, dtype=float)
+        fas = np.asarray(fas, dtype=float)
+
+        # Referências nas frequências dos pontos (r, n), limitadas à grade
+        logF = np.log(self.freq)
+        logf = np.log(np.atleast_1d(freq))
+        magRef = np.array([np.interp(logf, logF, np.log(valores)) for valores in self.magnitudes])
+        fasRef = np.array([np.interp(logf, logF, valores) for valores in self.fases])
+        fatores = np.log(self.resistores)[:, None] - magRef
+
+        if len(self) == 1:
+            fator, desvio = fatores[0], fasRef[0]
+        else:
+            # Par de resistores vizinhos da magnitude medida em cada ponto
+            logm = np.log(np.atleast_1d(mag))
+            colunas = np.arange(len(logm))
+            k = np.clip((logm > magRef).sum(axis=0) - 1, 0, len(self) - 2)
+            m0, m1 = magRef[k, colunas], magRef[k + 1, colunas]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = np.clip(np.nan_to_num((logm - m0)/(m1 - m0)), 0, 1)
+            fator = fatores[k, colunas]*(1 - t) + fatores[k + 1, colunas]*t
+            desvio = fasRef[k, colunas]*(1 - t) + fasRef[k + 1, colunas]*t
+
+        magCal = mag*np.exp(fator).reshape(mag.shape)
+        fasCal = corrigeAngulo(fas - desvio.reshape(fas.shape))
+        return magCal, fasCal
+
+    def fatorMedio(self):
+        '''
+        Fator de Calibração Médio (Equivalente ao Fator Escalar de Ensaio)
+        '''
+        return float(np.exp(np.mean(np.log(self.resistores)[:, None] - np.log(self.magnitudes))))
+
+    def salva(self, diretorio=DIRETORIO_PADRAO):
+        '''
+        Grava a Tabela no Diretório (Substituindo a Anterior da Placa)
+        '''
+        os.makedirs(diretorio, exist_ok=True)
+        caminho = caminhoTabela(self.serie, diretorio)
+        # Grava em um arquivo temporário para não corromper a tabela
+        temporario = caminho + '.tmp'
+        with open(temporario, 'wb') as arquivo:
+            np.savez(arquivo, serie=self.serie, freq=self.freq, resistores=self.resistores,
+                     magnitudes=self.magnitudes, fases=self.fases, data=self.data or time())
+        os.replace(temporario, caminho)
+        return caminho
+
+
+def carregaTabela(serie, diretorio=DIRETORIO_PADRAO):
+    '''
+    Tabela Guardada da Placa ou None (também para placas sem número de série)
+    '''
+    if not serie:
+        return None
+    caminho = caminhoTabela(serie, diretorio)
+    if not os.path.exists(caminho):
+        return None
+    with np.load(caminho) as arquivo:
+        return TabelaCalibracao(serie, arquivo['freq'], arquivo['resistores'], arquivo['magnitudes'],
+                                arquivo['fases'], float(arquivo['data']))
@@ -0,0 +1,289 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_CATALOGO.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Catálogo (SQLite) dos ensaios salvos, com uma linha por curva: alto-falante,
+bancada, placa, data, configuração da varredura, fator de calibração e
+parâmetros calculados, e o arquivo (e o índice no arquivo .paraf) da curva
+As consultas por alto-falante, data ou parâmetros usam os índices do banco,
+sem abrir nem analisar as curvas
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import os
+import socket
+import sqlite3
+import sys
+from datetime import datetime
+
+import numpy as np
+
+import PARAF_ARQUIVO
+import PARAF_PARAMETROS
+from PARAF_ARQUIVO import CONFIGURACAO
+from PARAF_LOTE import listaArquivos
+from PARAF_PARAMETROS import PARAMETROS
+
+CATALOGO_PADRAO = 'paraf.sqlite'
+
+# Colunas de cada ensaio (além do identificador)
+COLUNAS = (('arquivo', 'TEXT NOT NULL'), ('indice', 'INTEGER NOT NULL'),
+           ('altoFalante', 'TEXT'), ('bancada', 'TEXT'), ('placa', 'TEXT'),
+           ('data', 'REAL'), ('modificado', 'REAL'), ('pontos', 'INTEGER'), ('metodo', 'TEXT'),
+           ('fatorCal', 'REAL')) + \
+          tuple((nome, 'REAL') for nome in CONFIGURACAO + PARAMETROS) + (('status', 'INTEGER'),)
+NOMES = tuple(nome for nome, tipo in COLUNAS)
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS ensaios (
+    id INTEGER PRIMARY KEY,
+    %s,
+    UNIQUE (arquivo, indice)
+);
+CREATE INDEX IF NOT EXISTS ensaios_altoFalante ON ensaios (altoFalante, data);
+CREATE INDEX IF NOT EXISTS ensaios_data ON ensaios (data);
+CREATE INDEX IF NOT EXISTS ensaios_placa ON ensaios (placa, data);
+CREATE INDEX IF NOT EXISTS ensaios_FS ON ensaios (FS);
+''' % ',\n    '.join('%s %s' % coluna for coluna in COLUNAS)
+
+
+def _valor(valor):
+    # NaN (parâmetros não calculados) vira NULL
+    if isinstance(valor, (float, np.floating)):
+        return float(valor) if np.isfinite(valor) else None
+    if isinstance(valor, np.integer):
+        return int(valor)
+    return valor
+
+
+class Catalogo(object):
+    '''
+    Catálogo dos Ensaios Salvos
+
+    bancada identifica a bancada dos ensaios registrados (padrão: o nome
+    do computador). Os caminhos das curvas são guardados absolutos.
+    '''
+    def __init__(self, caminho=CATALOGO_PADRAO, bancada=None):
+        self.caminho = caminho
+        self.bancada = socket.gethostname() if bancada is None else bancada
+        self.conexao = sqlite3.connect(caminho)
+        self.conexao.row_factory = sqlite3.Row
+        self.conexao.executescript(ESQUEMA)
+        self.falhas = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fecha()
+
+    def fecha(self):
+        self.conexao.close()
+
+    def _insere(self, linhas):
+        comando = 'INSERT OR REPLACE INTO ensaios (%s) VALUES (%s)' % (', '.join(NOMES), ', '.join('?'*len(NOMES)))
+        with self.conexao:
+            self.conexao.executemany(comando, ([_valor(linha.get(nome)) for nome in NOMES] for linha in linhas))
+        return len(linhas)
+
+    def importaArquivo(self, caminho, bancada=None):
+        '''
+        Registra os Ensaios de um Arquivo .paraf Ainda Não Catalogados
+        Só o índice do arquivo é lido (os parâmetros já estão nos registros)
+        '''
+        caminho = os.path.abspath(caminho)
+        ultimo = self.conexao.execute('SELECT MAX(indice) FROM ensaios WHERE arquivo = ?', (caminho,)).fetchone()[0]
+        inicio = 0 if ultimo is None else ultimo + 1
+        with PARAF_ARQUIVO.Arquivo(caminho) as arquivo:
+            registros = arquivo.registros()[inicio:]
+        linhas = []
+        for indice, registro in enumerate(registros, inicio):
+            linha = dict(zip(CONFIGURACAO, registro['configuracao']))
+            linha.update(zip(PARAMETROS, registro['parametros']))
+            linha.update(arquivo=caminho, indice=indice, bancada=self.bancada if bancada is None else bancada,
+                         data=registro['data'], pontos=registro['pontos'], fatorCal=registro['fatorCal'],
+                         status=registro['status'])
+            linha.update((campo, registro[campo].decode('utf-8', 'replace'))
+                         for campo in ('metodo', 'altoFalante', 'placa'))
+            linhas.append(linha)
+        return self._insere(linhas)
+
+    def importaCurva(self, caminho, bancada=None, altoFalante=''):
+        '''
+        Registra uma Curva .npy (Formato de Ensaio.Salva) Ainda Não Catalogada
+        ou Alterada desde o Registro
+        A data é a de modificação do arquivo e os parâmetros são calculados
+        '''
+        caminho = os.path.abspath(caminho)
+        modificado = os.path.getmtime(caminho)
+        registrado = self.conexao.execute('SELECT modificado FROM ensaios WHERE arquivo = ?', (caminho,)).fetchone()
+        if registrado is not None and registrado['modificado'] == modificado:
+            return 0
+        curva = np.load(caminho)
+        if curva.ndim != 2 or len(curva) != 3:
+            raise ValueError("%s não é uma curva (frequência, magnitude, fase)" % caminho)
+        freq, mag, fas = curva
+        linha = PARAF_PARAMETROS.parametrosCurva(freq, mag)
+        linha.update(arquivo=caminho, indice=0, bancada=self.bancada if bancada is None else bancada,
+                     altoFalante=altoFalante, data=modificado, modificado=modificado, pontos=len(freq))
+        return self._insere([linha])
+
+    def registra(self, caminho, ensaio):
+        '''
+        Registra a Curva Recém Salva por Ensaio.Salva
+        Em um arquivo .paraf, registra os ensaios novos do arquivo
+        '''
+        if caminho.endswith(PARAF_ARQUIVO.EXTENSAO):
+            return self.importaArquivo(caminho)
+        linha = PARAF_PARAMETROS.parametrosCurva(ensaio.impFreq, ensaio.impMag)
+        linha.update(PARAF_ARQUIVO.configuracaoCurva(ensaio))
+        linha.update(arquivo=os.path.abspath(caminho), indice=0, bancada=self.bancada,
+                     altoFalante=ensaio.altoFalante, placa=ensaio.placa, data=ensaio.dataEnsaio,
+                     modificado=os.path.getmtime(caminho), pontos=len(ensaio.impFreq))
+        return self._insere([linha])
+
+    def importa(self, caminhos, bancada=None):
+        '''
+        Registra os Arquivos .paraf e .npy dos Caminhos (Diretórios Percorridos
+        Recursivamente) e Retorna o Número de Ensaios Novos (ou Curvas .npy
+        Alteradas)
+
+        Um arquivo que não pode ser lido não interrompe a importação: fica em
+        self.falhas [(caminho, erro)], com os demais arquivos registrados.
+        '''
+        novos = 0
+        self.falhas = []
+        for caminho in listaArquivos(caminhos, ('.npy', PARAF_ARQUIVO.EXTENSAO)):
+            try:
+                if caminho.endswith(PARAF_ARQUIVO.EXTENSAO):
+                    novos += self.importaArquivo(caminho, bancada)
+                else:
+                    novos += self.importaCurva(caminho, bancada)
+            except (OSError, EOFError, ValueError) as exc:
+                self.falhas.append((caminho, repr(exc)))
+        return novos
+
+    def consulta(self, altoFalante=None, placa=None, bancada=None, desde=None, ate=None,
+                 somenteValidos=False, **faixas):
+        '''
+        Retorna os Ensaios (sqlite3.Row) que Atendem aos Filtros, por Data
+
+        altoFalante terminado em '*' seleciona pelo prefixo (modelo). desde e
+        ate são datas (datetime ou segundos). faixas: nome de um parâmetro ou
+        de um campo da configuração e o intervalo (mínimo, máximo), com None
+        para um lado aberto. Ex.: consulta('STEEL400*', FS=(40, 45))
+        '''
+        condicoes, valores = [], []
+        if altoFalante is not None:
+            if altoFalante.endswith('*'):
+                # Faixa de texto em vez de LIKE, para usar o índice
+                condicoes.append('altoFalante >= ? AND altoFalante < ?')
+                valores += [altoFalante[:-1], altoFalante[:-1] + '\U0010ffff']
+            else:
+                condicoes.append('altoFalante = ?')
+                valores.append(altoFalante)
+        for nome, valor in (('placa', placa), ('bancada', bancada)):
+            if valor is not None:
+                condicoes.append('%s = ?' % nome)
+                valores.append(valor)
+        for operador, data in (('>=', desde), ('<=', ate)):
+            if data is not None:
+                condicoes.append('data %s ?' % operador)
+                valores.append(data.timestamp() if isinstance(data, datetime) else data)
+        if somenteValidos:
+            condicoes.append('status = %d' % PARAF_PARAMETROS.OK)
+        for nome, (minimo, maximo) in faixas.items():
+            if nome not in CONFIGURACAO + PARAMETROS:
+                raise ValueError("Campo do catálogo desconhecido: %s" % nome)
+            for operador, limite in (('>=', minimo), ('<=', maximo)):
+                if limite is not None:
+                    condicoes.append('%s %s ?' % (nome, operador))
+                    valores.append(limite)
+        comando = 'SELECT * FROM ensaios'
+        if condicoes:
+            comando += ' WHERE ' + ' AND '.join(condicoes)
+        return self.conexao.execute(comando + ' ORDER BY data', valores).fetchall()
+
+    def remove(self):
+        '''
+        Remove do Catálogo os Ensaios cujos Arquivos Não Existem Mais
+        '''
+        arquivos = [linha[0] for linha in self.conexao.execute('SELECT DISTINCT arquivo FROM ensaios')]
+        removidos = [(arquivo,) for arquivo in arquivos if not os.path.exists(arquivo)]
+        with self.conexao:
+            self.conexao.executemany('DELETE FROM ensaios WHERE arquivo = ?', removidos)
+        return len(removidos)
+
+
+def carregaEnsaio(linha, ensaio):
+    '''
+    Carrega no Objeto Ensaio a Curva de uma Linha do Catálogo
+    '''
+    ensaio.Carrega(linha['arquivo'], linha['indice'])
+
+
+def _data(texto):
+    return datetime.strptime(texto, '%Y-%m-%d')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='paraf-catalog', description='Catálogo dos ensaios salvos')
+    parser.add_argument('-c', '--catalogo', default=CATALOGO_PADRAO, help='banco de dados do catálogo')
+    comandos = parser.add_subparsers(dest='comando')
+    importaArgs = comandos.add_parser('importa', help='registra arquivos .paraf e .npy')
+    importaArgs.add_argument('caminhos', nargs='+', help='arquivos ou diretórios (percorridos recursivamente)')
+    importaArgs.add_argument('--bancada', help='bancada dos ensaios importados (padrão: o nome do computador)')
+    importaArgs.add_argument('--remove', action='store_true', help='remove os ensaios de arquivos apagados')
+    consultaArgs = comandos.add_parser('consulta', help='lista os ensaios que atendem aos filtros')
+    consultaArgs.add_argument('--alto-falante', help="identificação (terminada em '*' para um prefixo)")
+    consultaArgs.add_argument('--placa', help='número de série da placa')
+    consultaArgs.add_argument('--bancada', help='bancada')
+    consultaArgs.add_argument('--desde', type=_data, help='data inicial (AAAA-MM-DD)')
+    consultaArgs.add_argument('--ate', type=_data, help='data final (AAAA-MM-DD, exclusiva)')
+    consultaArgs.add_argument('--faixa', nargs=3, action='append', default=[], metavar=('CAMPO', 'MIN', 'MAX'),
+                              help='intervalo de um parâmetro (ex.: --faixa FS 40 45)')
+    consultaArgs.add_argument('--validos', action='store_true', help='somente curvas com parâmetros calculados')
+    consultaArgs.add_argument('--csv', help='grava o resultado em uma tabela CSV')
+    args = parser.parse_args()
+
+    with Catalogo(args.catalogo) as catalogo:
+        if args.comando == 'importa':
+            novos = catalogo.importa(args.caminhos, args.bancada)
+            removidos = catalogo.remove() if args.remove else 0
+            for caminho, erro in catalogo.falhas:
+                print("%s: %s" % (caminho, erro), file=sys.stderr)
+            print("%d ensaios novos, %d arquivos removidos -> %s" % (novos, removidos, args.catalogo))
+        elif args.comando == 'consulta':
+            faixas = {campo: (float(minimo), float(maximo)) for campo, minimo, maximo in args.faixa}
+            ate = args.ate.timestamp() - 1e-6 if args.ate is not None else None
+            linhas = catalogo.consulta(args.alto_falante, args.placa, args.bancada, args.desde, ate,
+                                       args.validos, **faixas)
+            if args.csv:
+                with open(args.csv, 'w', newline='') as arquivo:
+                    tabela = csv.writer(arquivo)
+                    tabela.writerow(NOMES)
+                    tabela.writerows(tuple(linha[nome] for nome in NOMES) for linha in linhas)
+            for linha in linhas:
+                data = datetime.fromtimestamp(linha['data']).strftime('%Y-%m-%d %H:%M') if linha['data'] else '-'
+                parametros = '  '.join('%s=%s' % (nome, '-' if linha[nome] is None else '%.3f' % linha[nome])
+                                       for nome in PARAMETROS)
+                print("%s %-14s %s  %s[%d]" % (data, linha['altoFalante'] or '-', parametros,
+                                               linha['arquivo'], linha['indice']))
+            print("%d ensaios" % len(linhas), file=sys.stderr)
+        else:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
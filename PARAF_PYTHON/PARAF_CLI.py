@@ -0,0 +1,250 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_CLI.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Linha de comando (paraf) para os ensaios sem a interface gráfica
+Mede a curva de impedância, calibra a placa, calcula os parâmetros de
+curvas salvas e exporta as curvas (CSV, gráfico ou outro formato), usando
+Ensaio; o matplotlib só é carregado para exportar um gráfico
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+import PARAF_ARQUIVO
+import ProtocolPy
+from PARAF_ENSAIO import Ensaio
+from PARAF_PARAMETROS import PARAMETROS
+
+# Opções da configuração do ensaio e as propriedades correspondentes do Ensaio
+OPCOES_ENSAIO = (
+    ('porta', 'porta'),
+    ('freq_inicial', 'freqInicial'),
+    ('freq_final', 'freqFinal'),
+    ('passo', 'passo'),
+    ('freq_rel_inicial', 'freqRelInicial'),
+    ('freq_rel_final', 'freqRelFinal'),
+    ('passo_rel', 'passoRel'),
+    ('fator_regime', 'fatorRegime'),
+    ('metodo', 'metodo'),
+    ('regime', 'toleranciaRegime'),
+    ('fator_cal', 'fatorCal'),
+    ('dir_cal', 'diretorioCal'),
+    ('alto_falante', 'altoFalante'),
+)
+# Formatos de gráfico exportados (pelo matplotlib)
+FORMATOS_GRAFICO = ('.png', '.pdf', '.svg')
+
+
+def _ensaio(args):
+    # Ensaio com as opções indicadas (as demais mantêm o padrão)
+    ens = Ensaio()
+    for opcao, propriedade in OPCOES_ENSAIO:
+        valor = getattr(args, opcao, None)
+        if valor is not None:
+            setattr(ens, propriedade, valor)
+    ens.amostrasBrutas = getattr(args, 'amostras', False)
+    ens.varreduraAdaptativa = getattr(args, 'adaptativa', False)
+    return ens
+
+
+def _calculaParametros(ens, ajuste=False):
+    # Parâmetros da curva carregada ou medida; retorna a falha (ou None)
+    try:
+        if ajuste:
+            ens.AjustaParametros()
+        else:
+            ens.CalculaParametros()
+    except ValueError as exc:
+        return str(exc)
+    return None
+
+
+def _linhaParametros(ens):
+    return "  ".join("%s=%.3f" % (nome, getattr(ens, nome)) for nome in PARAMETROS)
+
+
+def mede(args):
+    '''
+    Mede a Curva de Impedância, Calcula os Parâmetros e Salva a Curva
+    '''
+    ens = _ensaio(args)
+    ens.catalogo = args.catalogo
+    if args.metricas:
+        ens.metricas = ProtocolPy.Metricas()
+    with ens:
+        ens.CapturaImpedancia()
+    falha = _calculaParametros(ens, args.ajuste)
+    print("%d pontos  %s" % (len(ens.impFreq), falha or _linhaParametros(ens)))
+
+    if args.saida:
+        ens.Salva(args.saida)
+        print("-> %s" % args.saida)
+    if args.metricas:
+        if args.metricas.endswith('.prom'):
+            ens.metricas.salvaPrometheus(args.metricas, bancada=ens.porta or '')
+        else:
+            with open(args.metricas, 'w') as arquivo:
+                json.dump(ens.metricas.relatorio(), arquivo, indent=1)
+    return 0 if falha is None else 1
+
+
+def calibra(args):
+    '''
+    Calibra a Placa com um Resistor de Referência
+    '''
+    ens = _ensaio(args)
+    with ens:
+        if args.tabela:
+            ens.CalibraTabela(args.resistencia)
+            tabela = ens.tabelaCal
+            print("Tabela da placa %s: %d resistores (%s), fator médio %.6f"
+                  % (tabela.serie or '-', len(tabela), ', '.join('%g' % R for R in tabela.resistores),
+                     tabela.fatorMedio()))
+        else:
+            ens.Calibra(args.resistencia)
+            # O fator não é guardado: é passado aos próximos ensaios (--fator-cal)
+            print("fatorCal = %.8f" % ens.fatorCal)
+    return 0
+
+
+def analisa(args):
+    '''
+    Calcula os Parâmetros de Curvas Salvas
+    '''
+    linhas = []
+    falhas = 0
+    for caminho in args.arquivos:
+        ens = Ensaio()
+        ens.Carrega(caminho, args.indice)
+        falha = _calculaParametros(ens, args.ajuste)
+        falhas += falha is not None
+        print("%s  %s" % (caminho, falha or _linhaParametros(ens)))
+        linhas.append([caminho] + [None if falha else float(getattr(ens, nome)) for nome in PARAMETROS] +
+                      [falha or ''])
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as arquivo:
+            tabela = csv.writer(arquivo)
+            tabela.writerow(('arquivo',) + PARAMETROS + ('erro',))
+            tabela.writerows(linhas)
+    return 0 if falhas == 0 else 1
+
+
+def _exportaGrafico(ens, caminho, analitica):
+    # Gráfico da curva (e da curva analítica) sem tela
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+    ens.grafico(fig)
+    if analitica:
+        ens.PlotaCurvasAnaliticas(fig)
+    fig.savefig(caminho)
+
+
+def exporta(args):
+    '''
+    Exporta uma Curva Salva: Tabela CSV, Gráfico (.png, .pdf, .svg) ou
+    Outro Arquivo de Curvas (.npy, .paraf)
+    '''
+    # Entre arquivos .paraf o registro é copiado sem passar por um Ensaio
+    if args.arquivo.endswith(PARAF_ARQUIVO.EXTENSAO) and args.saida.endswith(PARAF_ARQUIVO.EXTENSAO):
+        PARAF_ARQUIVO.copiaEnsaio(args.arquivo, args.saida, args.indice)
+        print("%s -> %s" % (args.arquivo, args.saida))
+        return 0
+    ens = Ensaio()
+    ens.Carrega(args.arquivo, args.indice)
+    extensao = os.path.splitext(args.saida)[1].lower()
+    if extensao == '.csv':
+        with open(args.saida, 'w', newline='') as arquivo:
+            tabela = csv.writer(arquivo)
+            tabela.writerow(('freq', 'mag', 'fas'))
+            tabela.writerows(zip(ens.impFreq.tolist(), ens.impMag.tolist(), ens.impFas.tolist()))
+    elif extensao in FORMATOS_GRAFICO:
+        analitica = args.analitica and _calculaParametros(ens) is None
+        _exportaGrafico(ens, args.saida, analitica)
+    else:
+        _calculaParametros(ens)
+        ens.Salva(args.saida)
+    print("%s -> %s" % (args.arquivo, args.saida))
+    return 0
+
+
+def main():
+    # Configuração do ensaio, comum a mede e calibra
+    ensaioArgs = argparse.ArgumentParser(add_help=False)
+    ensaioArgs.add_argument('--porta', help='porta serial da placa (padrão: placa Arduino Due conectada)')
+    ensaioArgs.add_argument('--freq-inicial', type=float, help='frequência inicial [Hz]')
+    ensaioArgs.add_argument('--freq-final', type=float, help='frequência final [Hz]')
+    ensaioArgs.add_argument('--passo', type=float, help='passo da varredura (fator)')
+    ensaioArgs.add_argument('--freq-rel-inicial', type=float, help='início da faixa relevante [Hz]')
+    ensaioArgs.add_argument('--freq-rel-final', type=float, help='fim da faixa relevante [Hz]')
+    ensaioArgs.add_argument('--passo-rel', type=float, help='passo na faixa relevante (fator)')
+    ensaioArgs.add_argument('--fator-regime', type=float, help='espera pelo regime permanente [s]')
+    ensaioArgs.add_argument('--metodo', choices=('SWF', 'ZC'), help='cálculo da impedância')
+    ensaioArgs.add_argument('--regime', type=float, metavar='TOLERANCIA',
+                            help='regime permanente adaptativo (tolerância relativa)')
+    ensaioArgs.add_argument('--amostras', action='store_true',
+                            help='recebe as amostras e calcula as impedâncias no computador')
+    ensaioArgs.add_argument('--fator-cal', type=float, help='fator de calibração (sem tabela da placa)')
+    ensaioArgs.add_argument('--dir-cal', help='diretório das tabelas de calibração')
+
+    parser = argparse.ArgumentParser(prog='paraf', description='Ensaios do alto-falante sem a interface gráfica')
+    comandos = parser.add_subparsers(dest='comando')
+
+    medeArgs = comandos.add_parser('mede', aliases=['measure'], parents=[ensaioArgs],
+                                   help='mede a curva de impedância e calcula os parâmetros')
+    medeArgs.add_argument('-o', '--saida', help='curva medida (.npy ou .paraf)')
+    medeArgs.add_argument('--alto-falante', help='identificação do alto-falante')
+    medeArgs.add_argument('--adaptativa', action='store_true', help='varredura adaptativa')
+    medeArgs.add_argument('--ajuste', action='store_true', help='ajusta o modelo à curva complexa (inclui LE)')
+    medeArgs.add_argument('--catalogo', help='catálogo (SQLite) em que a curva é registrada')
+    medeArgs.add_argument('--metricas', help='relatório das métricas do ensaio (JSON ou .prom)')
+    medeArgs.set_defaults(executa=mede)
+
+    calibraArgs = comandos.add_parser('calibra', aliases=['calibrate'], parents=[ensaioArgs],
+                                      help='calibra a placa com um resistor de referência')
+    calibraArgs.add_argument('resistencia', type=float, help='resistência de referência [Ohm]')
+    calibraArgs.add_argument('--tabela', action='store_true',
+                             help='acrescenta a varredura à tabela de calibração da placa')
+    calibraArgs.set_defaults(executa=calibra)
+
+    analisaArgs = comandos.add_parser('analisa', aliases=['analyze'], help='calcula os parâmetros de curvas salvas')
+    analisaArgs.add_argument('arquivos', nargs='+', help='curvas salvas (.npy ou .paraf)')
+    analisaArgs.add_argument('--indice', type=int, default=-1, help='ensaio dos arquivos .paraf (padrão: o último)')
+    analisaArgs.add_argument('--ajuste', action='store_true', help='ajusta o modelo à curva complexa (inclui LE)')
+    analisaArgs.add_argument('--csv', help='grava os parâmetros em uma tabela CSV')
+    analisaArgs.set_defaults(executa=analisa)
+
+    exportaArgs = comandos.add_parser('exporta', aliases=['export'], help='exporta uma curva salva')
+    exportaArgs.add_argument('arquivo', help='curva salva (.npy ou .paraf)')
+    exportaArgs.add_argument('-o', '--saida', required=True,
+                             help='tabela (.csv), gráfico (%s) ou curva (.npy, .paraf)' % ', '.join(FORMATOS_GRAFICO))
+    exportaArgs.add_argument('--indice', type=int, default=-1, help='ensaio do arquivo .paraf (padrão: o último)')
+    exportaArgs.add_argument('--analitica', action='store_true', help='sobrepõe a curva analítica ao gráfico')
+    exportaArgs.set_defaults(executa=exporta)
+
+    args = parser.parse_args()
+    if not hasattr(args, 'executa'):
+        parser.print_help()
+        return 2
+    return args.executa(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
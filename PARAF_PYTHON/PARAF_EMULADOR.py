@@ -0,0 +1,939 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_EMULADOR.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Emula a placa Arduino Due (PARAF_ARDUINO) em um pseudo-terminal
+Reproduz o protocolo de Protocolo.cpp e a varredura de Ensaio.cpp
+Permite medir o desempenho do ProtocolPy sem a placa
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import os
+import tty
+import struct
+import queue
+import select
+import threading
+import argparse
+from collections import deque
+from time import sleep, perf_counter
+
+import numpy as np
+
+from ProtocolPy import Proto
+from PARAF_MODELO import impedancia
+from ProtocolPy.quadros import codificaBloco, codificaPacote, crc16
+
+
+class CargaThieleSmall(object):
+    '''
+    Modelo de Impedância do Alto-falante (Thiele-Small)
+    Mesmo modelo utilizado em Ensaio.PlotaCurvasAnaliticas (PARAF_MODELO)
+    '''
+    def __init__(self, RE=6.0, FS=50.0, RS=40.0, QMS=4.0, LE=0.0005, RED=0.0):
+        self.RE = RE
+        self.FS = FS
+        self.RS = RS
+        self.QMS = QMS
+        self.LE = LE
+        self.RED = RED
+
+    def impedancia(self, frequencia):
+        return impedancia(frequencia, self.RE, self.FS, self.RS, self.QMS, self.LE, self.RED)
+
+    def transitorio(self, frequencia, t):
+        '''
+        Transitório da Tensão após o Início do Sinal (Modelo Aproximado)
+        A parte mecânica parte do repouso e decai com a constante de tempo
+        QMS/(pi*FS) na frequência natural amortecida. O resultado é relativo
+        à amplitude da tensão em regime permanente.
+        '''
+        imp = self.impedancia(frequencia)
+        mot = (imp - self.RE - 2j*np.pi*frequencia*(self.LE + self.RED))/imp
+        ws = 2*np.pi*self.FS
+        wd = ws*np.sqrt(max(1 - 1/(4*self.QMS**2), 0.0))
+        return -abs(mot)*np.exp(-ws/(2*self.QMS)*t)*np.sin(wd*t + np.angle(mot))
+
+
+class FrenteAnalogica(object):
+    '''
+    Modelo dos Erros do Circuito de Medida da Placa
+
+    resistenciaSerie soma-se à carga (fios e resistor de medida da
+    corrente), o que torna o fator de calibração dependente da carga, e o
+    canal da corrente tem um filtro passa-baixas de primeira ordem com corte
+    em corteCorrente [Hz] (None = sem filtro), que muda o ganho e a fase
+    com a frequência.
+    '''
+    def __init__(self, resistenciaSerie=0.0, corteCorrente=None):
+        self.resistenciaSerie = resistenciaSerie
+        self.corteCorrente = corteCorrente
+
+    def impedanciaMedida(self, frequencia, imp):
+        imp = imp + self.resistenciaSerie
+        if self.corteCorrente:
+            imp = imp*(1 + 1j*frequencia/self.corteCorrente)
+        return imp
+
+
+class Enlace(object):
+    '''
+    Modelo da Velocidade e da Latência do Enlace USB
+    '''
+    def __init__(self, taxa=None, latencia=0.0):
+        # Taxa de transferência em bytes por segundo (None = ilimitada)
+        self.taxa = taxa
+        # Latência em segundos de cada sentido da comunicação
+        self.latencia = latencia
+
+    def duracao(self, nbytes):
+        # Tempo para transmitir os bytes
+        if self.taxa:
+            return nbytes/self.taxa
+        return 0.0
+
+    def ideal(self):
+        return not self.taxa and not self.latencia
+
+
+class EmuladorArduino(object):
+    '''
+    Emulador da Placa Arduino Due em um Pseudo-terminal
+    '''
+    # Taxa de amostragem da interrupção (Aprox. 44.1Khz)
+    TX_AMOSTRAGEM = 10500000/238
+    # Número de amostras capturadas para cada frequencia do ensaio
+    AMOSTRAS_CAPTURADAS = 4*1024
+    # Fator de calibração teórico (ver Ensaio.fatorCal)
+    FATOR_CAL = 1.8907793
+    # Maior amplitude dos sinais capturados (12 bits)
+    AMPLITUDE = 1500
+    # Transferência em blocos (Protocolo.h)
+    VALORES_BLOCO_MAX = 128
+    JANELA_MAX = 16
+    TIMEOUT_BLOCO = 0.05
+    # Identificação (Protocolo.h)
+    VERSAO_PROTOCOLO = 1
+    CAPACIDADES = (Proto.cap_blocos | Proto.cap_continuo | Proto.cap_configuracao | Proto.cap_bruto |
+                   Proto.cap_lista | Proto.cap_regime)
+    # Bytes de dados do pacote de configuração (Protocolo::TAMANHO_CONFIG)
+    TAMANHO_CONFIG = 29
+    # Frequências no pacote da lista (Protocolo::LISTA_MAX)
+    LISTA_MAX = 32
+    # Regime permanente adaptativo (Ensaio.h)
+    AMOSTRAS_BLOCO_REGIME = 2048
+    BLOCOS_REGIME = 2
+
+    def __init__(self, carga=None, enlace=None, escalaTempo=0.0, ruido=0.0, legado=False,
+                 serie=b'PARAF-EMULADOR', frente=None):
+        # Carga ligada à placa
+        self.carga = carga if carga is not None else CargaThieleSmall()
+        # Erros do circuito de medida (None = placa ideal)
+        self.frente = frente
+        # Modelo do enlace USB
+        self.enlace = enlace if enlace is not None else Enlace()
+        # Escala do tempo de captura (0 = instantâneo, 1 = tempo real)
+        self.escalaTempo = escalaTempo
+        # Desvio padrão do ruído das amostras em bits
+        self.ruido = ruido
+        self._aleatorio = np.random.RandomState(0)
+        # Emula o firmware original (sem os comandos adicionados depois)
+        self.legado = legado
+        # Número de série enviado na identificação (16 bytes)
+        self.serie = bytes(serie)[:16].ljust(16, b'\0')
+
+        # Propriedades do ensaio (Ensaio.cpp)
+        self._freqIni = 0.0
+        self._freqFim = 0.0
+        self._passo = 0.0
+        self._freqRelIni = 0.0
+        self._freqRelFim = 0.0
+        self._passoRel = 0.0
+        self._frequencia = 0.0
+        self._fatorRegime = 0.0
+        self._metodoImp = 0
+
+        # Estado da recepção das mensagens (Protocolo.cpp)
+        self._nbyte = 0
+        self.mensagem = [0, 0, 0]
+        # Pacote de configuração ou da lista em recepção (None fora do pacote)
+        self._pacote = None
+        self._codigoPacote = None
+        self._modoBloco = False
+        self._tamanhoBloco = 0
+        self._janela = 0
+        self._transferencia = 0
+
+        self.continuar_ensaio = False
+        self._modoContinuo = False
+        self._fimContinuo = False
+        self._modoBruto = False
+        # Lista de frequências do próximo ensaio
+        self._lista = []
+        self._iLista = 0
+        # Tolerância do regime adaptativo (0 = espera fixa) e tempos até o
+        # regime de cada ponto [ms]
+        self._tolRegime = 0.0
+        self._ciclosRegime = 0
+        self._temposRegime = []
+        self.amostrasSaida = None
+        self.amostrasEntrada = None
+        self.impFreq = []
+        self.impMag = []
+        self.impFas = []
+
+        # Contadores para os benchmarks
+        self.bytesEnviados = 0
+        self.valoresReenviados = 0
+        self.blocosReenviados = 0
+
+        self.porta = None
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._threadEntrega = None
+        self._executando = False
+
+        # Bytes recebidos, bytes ainda atravessando o enlace e bytes a entregar
+        self._pendentes = deque()
+        self._emTransito = deque()
+        self._entregas = queue.Queue()
+        self._livre = 0.0
+
+    def inicia(self):
+        '''
+        Abre o Pseudo-terminal e Inicia a Execução da Placa
+        '''
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.porta = os.ttyname(self._slave)
+
+        self._executando = True
+        self._threadEntrega = threading.Thread(target=self._entrega, daemon=True)
+        self._threadEntrega.start()
+        self._thread = threading.Thread(target=self._executa, daemon=True)
+        self._thread.start()
+        return self.porta
+
+    def encerra(self):
+        '''
+        Encerra a Execução e Fecha o Pseudo-terminal
+        '''
+        self._executando = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._threadEntrega is not None:
+            self._entregas.put(None)
+            self._threadEntrega.join()
+            self._threadEntrega = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = None
+        self._slave = None
+
+    def __enter__(self):
+        self.inicia()
+        return self
+
+    def __exit__(self, *args):
+        self.encerra()
+
+    # ------------------------------------------------------------------
+    # Porta serial
+    # ------------------------------------------------------------------
+    def _le(self, timeout):
+        # Recebe os bytes disponíveis (ou nenhum após o timeout)
+        pronto, _, _ = select.select([self._master], [], [], timeout)
+        if not pronto:
+            return b''
+        return os.read(self._master, 4096)
+
+    def _recebe(self, timeout):
+        # Acumula em _pendentes os bytes que já atravessaram o enlace
+        limite = perf_counter() + timeout
+        while True:
+            agora = perf_counter()
+            while self._emTransito and self._emTransito[0][0] <= agora:
+                self._pendentes.extend(self._emTransito.popleft()[1])
+            if self._pendentes or agora >= limite:
+                return
+            espera = limite - agora
+            if self._emTransito:
+                espera = min(espera, self._emTransito[0][0] - agora)
+            dados = self._le(espera)
+            if dados:
+                self._emTransito.append((perf_counter() + self.enlace.latencia, dados))
+
+    def _leByte(self):
+        # Bloqueia até receber um byte (como em Protocolo::enviaValor)
+        while self._executando:
+            if self._pendentes:
+                return self._pendentes.popleft()
+            self._recebe(0.05)
+        return Proto.esc
+
+    def _escreveTudo(self, dados):
+        while dados:
+            dados = dados[os.write(self._master, dados):]
+
+    def _escreve(self, dados):
+        self.bytesEnviados += len(dados)
+        if self.enlace.ideal():
+            self._escreveTudo(dados)
+            return
+        # Os bytes são entregues após a transmissão e a latência do enlace
+        self._livre = max(perf_counter(), self._livre) + self.enlace.duracao(len(dados))
+        self._entregas.put((self._livre + self.enlace.latencia, dados))
+
+    def _entrega(self):
+        # Escreve no pseudo-terminal os bytes que atravessaram o enlace
+        while True:
+            item = self._entregas.get()
+            if item is None:
+                return
+            tempo, dados = item
+            espera = tempo - perf_counter()
+            if espera > 0:
+                sleep(espera)
+            self._escreveTudo(dados)
+
+    def _executa(self):
+        # Equivalente ao loop() do PARAF_ARDUINO.ino
+        while self._executando:
+            if self.continuar_ensaio:
+                self.atualizaEnsaio()
+            else:
+                self._recebe(0.05)
+            self.atualizaSerial()
+
+    # ------------------------------------------------------------------
+    # Protocolo.cpp
+    # ------------------------------------------------------------------
+    def atualizaSerial(self):
+        # Processa todos os bytes recebidos
+        while self._pendentes:
+            byte_rec = self._pendentes.popleft()
+
+            # Bytes do pacote de configuração ou da lista: dados, CRC e byte final
+            if self._pacote is not None:
+                self._pacote.append(byte_rec)
+                if self._codigoPacote == Proto.configura_ensaio:
+                    tamanho = self.TAMANHO_CONFIG
+                else:
+                    # O tamanho da lista vem no primeiro byte
+                    if self._pacote[0] > self.LISTA_MAX:
+                        self._escreve(bytes([Proto.rec_falha]))
+                        self._pacote = None
+                        continue
+                    tamanho = 1 + 4*self._pacote[0]
+                if len(self._pacote) == tamanho + 3:
+                    if self._codigoPacote == Proto.configura_ensaio:
+                        self._processa_configuracao()
+                    else:
+                        self._processa_lista()
+                    self._pacote = None
+                continue
+
+            if self._nbyte == 0:
+                # Verifica se é o byte de início da mensagem
+                if byte_rec == Proto.mens_inicio:
+                    self._nbyte += 1
+                # O código de escape cancela o ensaio em andamento
+                elif byte_rec == Proto.esc and not self.legado:
+                    self.interrompeEnsaio()
+            elif self._nbyte <= 3:
+                self.mensagem[self._nbyte - 1] = byte_rec
+                self._nbyte += 1
+                # Início do pacote de configuração ou da lista
+                if (self._nbyte == 2 and byte_rec in (Proto.configura_ensaio, Proto.lista_frequencias)
+                        and not self.legado):
+                    self._pacote = bytearray()
+                    self._codigoPacote = byte_rec
+                    self._nbyte = 0
+            else:
+                # Verifica se é o byte final da mensagem
+                if byte_rec == Proto.mens_final:
+                    self._processa_mensagem()
+                # Descarta a mensagem caso não seja o byte final
+                self._nbyte = 0
+
+    def _processa_mensagem(self):
+        codigo = self.mensagem[0]
+        valor = self.mensagem[1] + (self.mensagem[2] << 8)
+
+        def decimal(atual):
+            # Compõe a parte decimal com a parte inteira atual (uint16)
+            inteiro = int(abs(atual)) & 0xFFFF
+            return float(np.float32(((inteiro << 16) + valor)/65536.0))
+
+        if codigo == Proto.inicia_ensaio:
+            self.iniciaEnsaio()
+        elif codigo == Proto.setFreqIniInt:
+            self.setFreqIni(valor)
+        elif codigo == Proto.setFreqIniDec:
+            self.setFreqIni(decimal(self._freqIni))
+        elif codigo == Proto.setFreqFimInt:
+            self.setFreqFim(valor)
+        elif codigo == Proto.setFreqFimDec:
+            self.setFreqFim(decimal(self._freqFim))
+        elif codigo == Proto.setPassoInt:
+            self.setPasso(valor)
+        elif codigo == Proto.setPassoDec:
+            self.setPasso(decimal(self._passo))
+        elif codigo == Proto.setFreqRelIniInt:
+            self._freqRelIni = valor
+        elif codigo == Proto.setFreqRelIniDec:
+            self._freqRelIni = decimal(self._freqRelIni)
+        elif codigo == Proto.setFreqRelFimInt:
+            self._freqRelFim = valor
+        elif codigo == Proto.setFreqRelFimDec:
+            self._freqRelFim = decimal(self._freqRelFim)
+        elif codigo == Proto.setPassoRelInt:
+            self._passoRel = valor
+        elif codigo == Proto.setPassoRelDec:
+            self._passoRel = decimal(self._passoRel)
+        elif codigo == Proto.setFatorRegimeInt:
+            self._fatorRegime = valor
+        elif codigo == Proto.setFatorRegimeDec:
+            self._fatorRegime = decimal(self._fatorRegime)
+        elif codigo == Proto.setMetodoSWF:
+            self._metodoImp = 0
+        elif codigo == Proto.setMetodoZC:
+            self._metodoImp = 1
+        elif codigo == Proto.modo_bloco and not self.legado:
+            # Tamanho do bloco e janela (zero retorna ao envio valor a valor)
+            self._tamanhoBloco = min(self.mensagem[1], self.VALORES_BLOCO_MAX)
+            self._janela = min(self.mensagem[2], self.JANELA_MAX)
+            self._modoBloco = self._tamanhoBloco > 0 and self._janela > 0
+            self._escreve(bytes([Proto.rec_sucesso]))
+        elif codigo == Proto.modo_continuo and not self.legado:
+            self._modoContinuo = self.mensagem[1] != 0
+            self._escreve(bytes([Proto.rec_sucesso]))
+        elif codigo == Proto.modo_bruto and not self.legado:
+            self._modoBruto = self.mensagem[1] != 0
+            self._escreve(bytes([Proto.rec_sucesso]))
+        elif codigo == Proto.modo_regime and not self.legado:
+            self._tolRegime = valor/10000.0
+            self._escreve(bytes([Proto.rec_sucesso]))
+        elif codigo == Proto.tempos_regime and not self.legado:
+            self.enviaValores(np.array(self._temposRegime, dtype=np.uint16))
+        elif codigo == Proto.reenvia_ponto and not self.legado:
+            self.reenviaPonto(valor)
+        elif codigo == Proto.identifica and not self.legado:
+            self.enviaIdentificacao()
+
+    def _processa_configuracao(self):
+        # Pacote: ! X freqIni freqFim passo freqRelIni freqRelFim passoRel fatorRegime metodo crc(2) #
+        dados = bytes(self._pacote[:self.TAMANHO_CONFIG])
+        crc = struct.unpack_from('<H', self._pacote, self.TAMANHO_CONFIG)[0]
+        if self._pacote[-1] != Proto.mens_final or crc != crc16(dados):
+            # O computador reenvia o pacote
+            self._escreve(bytes([Proto.rec_falha]))
+            return
+
+        # Mesma ordem dos comandos individuais
+        freqIni, freqFim, passo, freqRelIni, freqRelFim, passoRel, fatorRegime, metodo = \
+            struct.unpack('<7fB', dados)
+        self.setFreqIni(freqIni)
+        self.setFreqFim(freqFim)
+        self.setPasso(passo)
+        self._freqRelIni = freqRelIni
+        self._freqRelFim = freqRelFim
+        self._passoRel = passoRel
+        self._fatorRegime = fatorRegime
+        self._metodoImp = metodo
+        # Confirma a configuração
+        self._escreve(bytes([Proto.rec_sucesso]))
+
+    def _processa_lista(self):
+        # Pacote: ! Y n freq(4n) crc(2) #
+        tamanho = len(self._pacote) - 3
+        dados = bytes(self._pacote[:tamanho])
+        crc = struct.unpack_from('<H', self._pacote, tamanho)[0]
+        if self._pacote[-1] != Proto.mens_final or crc != crc16(dados):
+            self._escreve(bytes([Proto.rec_falha]))
+            return
+        self._lista = [float(f) for f in struct.unpack_from('<%df' % dados[0], dados, 1)]
+        self._escreve(bytes([Proto.rec_sucesso]))
+
+    def enviaValor(self, valor):
+        # Envia as mensagens do byte menos e mais significativo
+        self._escreve(bytes([Proto.mens_inicio, Proto.byte_LS, valor & 0x00FF, Proto.mens_final,
+                             Proto.mens_inicio, Proto.byte_MS, (valor & 0xFF00) >> 8, Proto.mens_final]))
+        # Recebe a resposta
+        return self._leByte()
+
+    def enviaValores(self, valores):
+        # Utiliza a transferência em blocos caso tenha sido negociada
+        if self._modoBloco:
+            return self.enviaValoresBloco(valores)
+
+        # Envia o número de valores
+        if self.enviaValor(len(valores)) == Proto.esc:
+            return False
+
+        # Envia cada um dos valores
+        n = 0
+        while n < len(valores):
+            resposta = self.enviaValor(int(valores[n]))
+            if resposta == Proto.rec_sucesso:
+                n += 1
+            elif resposta == Proto.esc:
+                return False
+            else:
+                self.valoresReenviados += 1
+        return True
+
+    def enviaValoresBloco(self, valores):
+        '''
+        Envia os Valores em Blocos com Janela Deslizante (Protocolo::enviaValoresBloco)
+        '''
+        dados = np.asarray(valores, dtype='<u2').tobytes()
+        tamanho = len(dados) // 2
+        nBlocos = max(1, -(-tamanho // self._tamanhoBloco))
+        self._transferencia = (self._transferencia + 1) & 0xFF
+
+        base = 0
+        proximo = 0
+        confirmados = set()
+        tempoEnvio = {}
+        nbyte = 0
+        resposta = [0, 0, 0]
+        while base < nBlocos and self._executando:
+            # Envia os blocos que cabem na janela
+            while proximo < nBlocos and proximo < base + self._janela:
+                self._enviaBloco(dados, tamanho, proximo)
+                tempoEnvio[proximo] = perf_counter()
+                proximo += 1
+
+            # Recebe as respostas
+            self._recebe(self.TIMEOUT_BLOCO)
+            if self._pendentes:
+                byte_rec = self._pendentes.popleft()
+                if nbyte == 0:
+                    # Se receber o código de escape interrompe o envio
+                    if byte_rec == Proto.esc:
+                        return False
+                    if byte_rec == Proto.mens_inicio:
+                        nbyte = 1
+                elif nbyte <= 3:
+                    resposta[nbyte - 1] = byte_rec
+                    nbyte += 1
+                else:
+                    nbyte = 0
+                    seq = resposta[1] + (resposta[2] << 8)
+                    if byte_rec != Proto.mens_final or not base <= seq < proximo or seq in confirmados:
+                        continue
+                    if resposta[0] == Proto.bloco_conf:
+                        confirmados.add(seq)
+                    elif resposta[0] == Proto.bloco_reenv:
+                        self._enviaBloco(dados, tamanho, seq)
+                        tempoEnvio[seq] = perf_counter()
+                        self.blocosReenviados += 1
+                    # Avança a janela
+                    while base < proximo and base in confirmados:
+                        base += 1
+            # Reenvia o bloco mais antigo caso a confirmação não chegue
+            elif perf_counter() - tempoEnvio[base] > self.TIMEOUT_BLOCO:
+                self._enviaBloco(dados, tamanho, base)
+                tempoEnvio[base] = perf_counter()
+                self.blocosReenviados += 1
+        return True
+
+    def _enviaBloco(self, dados, tamanho, seq):
+        inicio = seq*self._tamanhoBloco
+        n = min(max(tamanho - inicio, 0), self._tamanhoBloco)
+        bloco = dados[2*inicio:2*(inicio + n)]
+        self._escreve(codificaBloco(self._transferencia, seq, tamanho, bloco))
+
+    def enviaPonto(self, indice):
+        # Índice e as palavras LSB/MSB da frequência, magnitude e fase
+        dados = struct.pack('<Hfff', indice, self.impFreq[indice], self.impMag[indice], self.impFas[indice])
+        self._escreve(codificaPacote(Proto.ponto_dados, dados))
+
+    def enviaFimPontos(self, total):
+        self._escreve(codificaPacote(Proto.fim_pontos, struct.pack('<H', total)))
+
+    def enviaIdentificacao(self):
+        dados = struct.pack('<BH', self.VERSAO_PROTOCOLO, self.CAPACIDADES) + self.serie
+        self._escreve(codificaPacote(Proto.identifica, dados))
+
+    # ------------------------------------------------------------------
+    # Ensaio.cpp
+    # ------------------------------------------------------------------
+    def setFreqIni(self, frequencia):
+        self._freqIni = frequencia
+        # Caso a frequencia relevante não seja definida
+        if self._freqRelIni == 0:
+            self._freqRelIni = self._freqIni
+
+    def setFreqFim(self, frequencia):
+        self._freqFim = frequencia
+        # Caso a frequencia relevante não seja definida
+        if self._freqRelFim == 0:
+            self._freqRelFim = self._freqFim
+
+    def setPasso(self, passo):
+        self._passo = passo
+        # Caso o passo relevante não seja definido
+        if self._passoRel == 0:
+            self._passoRel = self._passo
+
+    def setFrequencia(self, frequencia):
+        # A placa trabalha com float de 32 bits
+        self._frequencia = float(np.float32(frequencia))
+
+    def iniciaEnsaio(self):
+        self._iLista = 0
+        self.setFrequencia(self._lista[0] if self._lista else self._freqIni)
+        self.impFreq = []
+        self.impMag = []
+        self.impFas = []
+        self._temposRegime = []
+        self._fimContinuo = False
+        self.continuar_ensaio = True
+
+    def interrompeEnsaio(self):
+        # Cancela a varredura em andamento (esc recebido fora de uma mensagem)
+        if not self.continuar_ensaio:
+            return
+        self.continuar_ensaio = False
+        self._modoContinuo = False
+        self._modoBruto = False
+        self._lista = []
+        self._tolRegime = 0.0
+
+    def reenviaPonto(self, indice):
+        # Pedido do fim do ensaio contínuo
+        if indice == 0xFFFF:
+            if self._fimContinuo:
+                self.enviaFimPontos(len(self.impFreq))
+        elif indice < len(self.impFreq):
+            self.enviaPonto(indice)
+
+    def _sinais(self, f, n):
+        # Tensão e corrente (sem o nível DC e o ruído) nas amostras n após o
+        # início do sinal, com o transitório da carga
+        imp = self.carga.impedancia(f) if f > 0 else self.carga.RE
+        if self.frente is not None:
+            imp = self.frente.impedanciaMedida(f, imp)
+        magBits = abs(imp)/self.FATOR_CAL
+        # Mantém a maior amplitude dentro dos 12 bits do conversor
+        if magBits > 1:
+            ampTensao, ampCorrente = self.AMPLITUDE, self.AMPLITUDE/magBits
+        else:
+            ampTensao, ampCorrente = self.AMPLITUDE*magBits, self.AMPLITUDE
+
+        t = n/self.TX_AMOSTRAGEM
+        wt = 2*np.pi*f*t
+        tensao = ampTensao*np.sin(wt)
+        if f > 0 and hasattr(self.carga, 'transitorio'):
+            tensao += ampTensao*self.carga.transitorio(f, t)
+        corrente = ampCorrente*np.sin(wt - np.angle(imp))
+        return tensao, corrente
+
+    def _inicioCaptura(self, f):
+        # Ciclos até o início da captura (Ensaio::InterrupcaoTC4): o último
+        # ciclo antes de _fatorRegime segundos ou o fim do bloco em que a
+        # impedância convergiu no regime adaptativo
+        limite = self._fatorRegime*f
+        ciclos = max(int(np.ceil(limite)) - 1, 0)
+        if not self._tolRegime or f <= 0 or ciclos == 0:
+            return ciclos
+
+        porCiclo = self.TX_AMOSTRAGEM/f
+        ciclosBloco = int(np.ceil(self.AMOSTRAS_BLOCO_REGIME/porCiclo))
+        blocos = ciclos//ciclosBloco
+        if blocos == 0:
+            return ciclos
+        # Somas em fase e quadratura de cada bloco de ciclos completos
+        limites = np.ceil(np.arange(0, blocos*ciclosBloco + 1, ciclosBloco)*porCiclo).astype(int)
+        n = np.arange(limites[-1])
+        tensao, corrente = self._sinais(f, n)
+        wt = 2*np.pi*f*n/self.TX_AMOSTRAGEM
+        somas = [np.add.reduceat(sinal*ref, limites[:-1])
+                 for sinal in (tensao, corrente) for ref in (np.cos(wt), np.sin(wt))]
+        z = (somas[0] + 1j*somas[1])/(somas[2] + 1j*somas[3])
+        # Comparação de cada bloco com o anterior (o primeiro com zero)
+        converge = np.abs(np.diff(z, prepend=0)) <= self._tolRegime*np.abs(z)
+        seguidas = 0
+        for b, ok in enumerate(converge):
+            seguidas = seguidas + 1 if ok else 0
+            if seguidas >= self.BLOCOS_REGIME:
+                return min((b + 1)*ciclosBloco, ciclos)
+        return ciclos
+
+    def _capturaAmostras(self):
+        '''
+        Sintetiza as Amostras de Tensão e Corrente na Carga
+        '''
+        f = self._frequencia
+        self._ciclosRegime = self._inicioCaptura(f)
+        inicio = int(np.ceil(self._ciclosRegime*self.TX_AMOSTRAGEM/f)) if f > 0 else 0
+        # Tempo de regime permanente e de captura das amostras
+        if self.escalaTempo:
+            duracao = (inicio + self.AMOSTRAS_CAPTURADAS)/self.TX_AMOSTRAGEM
+            fim = perf_counter() + duracao*self.escalaTempo
+            # Continua atendendo a porta serial durante a captura
+            while self._executando and perf_counter() < fim:
+                self._recebe(min(0.05, max(fim - perf_counter(), 0)))
+                self.atualizaSerial()
+
+        n = np.arange(self.AMOSTRAS_CAPTURADAS + 1)
+        tensao, corrente = self._sinais(f, inicio + n)
+        tensao += 2048
+        corrente += 2048
+        if self.ruido:
+            tensao += self._aleatorio.normal(0, self.ruido, n.size)
+            corrente += self._aleatorio.normal(0, self.ruido, n.size)
+        self.amostrasSaida = np.clip(np.round(tensao), 0, 4095).astype(np.uint16)
+        self.amostrasEntrada = np.clip(np.round(corrente), 0, 4095).astype(np.uint16)
+
+    def atualizaEnsaio(self):
+        # Ensaio com uma lista de frequências (o fim da lista não é capturado)
+        lista = len(self._lista) > 0
+        if not lista or self._iLista < len(self._lista):
+            # Captura as amostras para a frequência atual
+            self._capturaAmostras()
+        if not self.continuar_ensaio:
+            return
+
+        # Se foi um ensaio com uma única frequencia
+        if not lista and (abs(self._passo) == 0 or self._freqIni == self._freqFim):
+            self.continuar_ensaio = False
+            self._modoContinuo = False
+            self._modoBruto = False
+            self._guardaTempoRegime()
+            self._tolRegime = 0.0
+            if self.enviaValores(self.amostrasSaida[:self.AMOSTRAS_CAPTURADAS]):
+                self.enviaValores(self.amostrasEntrada[:self.AMOSTRAS_CAPTURADAS])
+
+        # Se já terminou um ensaio de múltiplas frequências (ou a lista)
+        elif (self._iLista >= len(self._lista)) if lista else (self._frequencia > self._freqFim):
+            self.continuar_ensaio = False
+            # A lista e o regime adaptativo valem apenas para um ensaio
+            self._lista = []
+            self._tolRegime = 0.0
+            # No modo de amostras uma transferência vazia encerra o ensaio
+            if self._modoBruto:
+                self._modoBruto = False
+                self.enviaValores(np.empty(0, dtype=np.uint16))
+                return
+            # No ensaio contínuo os pontos já foram enviados
+            if self._modoContinuo:
+                self._modoContinuo = False
+                self._fimContinuo = True
+                self.enviaFimPontos(len(self.impFreq))
+                return
+            for valores in (self.impFreq, self.impMag, self.impFas):
+                LSB, MSB = _divideFloat(valores)
+                if not self.enviaValores(LSB):
+                    break
+                if not self.enviaValores(MSB):
+                    break
+
+        # Caso não tenha terminado o ensaio de múltiplas frequências
+        else:
+            self._guardaTempoRegime()
+            # Envia a frequência e as amostras sem calcular a impedância
+            if self._modoBruto:
+                LSB, MSB = _divideFloat([self._frequencia])
+                for valores in ((LSB[0], MSB[0]), self.amostrasSaida[:self.AMOSTRAS_CAPTURADAS],
+                                self.amostrasEntrada[:self.AMOSTRAS_CAPTURADAS]):
+                    if not self.enviaValores(np.asarray(valores, dtype=np.uint16)):
+                        self.interrompeEnsaio()
+                        return
+            elif self._metodoImp == 0:
+                self.calculaImpedanciaSWF()
+            elif self._metodoImp == 1:
+                self.calculaImpedanciaZC()
+
+            # Envia o ponto calculado
+            if self._modoContinuo:
+                self.enviaPonto(len(self.impFreq) - 1)
+
+            # Próxima frequência da lista
+            if lista:
+                self._iLista += 1
+                if self._iLista < len(self._lista):
+                    self.setFrequencia(self._lista[self._iLista])
+            # Caso esteja nas frequencias relevantes
+            elif self._freqRelIni < self._frequencia < self._freqRelFim:
+                self.setFrequencia(np.float32(self._frequencia)*np.float32(self._passoRel))
+            else:
+                self.setFrequencia(np.float32(self._frequencia)*np.float32(self._passo))
+
+    def _guardaTempoRegime(self):
+        # Tempo até o início da captura da frequência atual [ms]
+        tempo = 1000.0*self._ciclosRegime/self._frequencia if self._frequencia > 0 else 0.0
+        self._temposRegime.append(min(tempo, 65535.0))
+
+    def _guardaImpedancia(self, impMag, impFas):
+        self.impFreq.append(self._frequencia)
+        self.impMag.append(impMag)
+        self.impFas.append(impFas)
+
+    def calculaImpedanciaZC(self):
+        '''
+        Impedância pelo Método do Cruzamento por Zero (Ensaio::calculaImpedanciaZC)
+        '''
+        N = self.AMOSTRAS_CAPTURADAS
+        saida = self.amostrasSaida.astype(float)
+        entrada = self.amostrasEntrada.astype(float)
+
+        # Valor médio DC e valor RMS
+        saidaDC = saida[:N].mean()
+        entradaDC = entrada[:N].mean()
+        impMag = np.sqrt(np.mean((saida[:N] - saidaDC)**2))/np.sqrt(np.mean((entrada[:N] - entradaDC)**2))
+
+        def cruzamentos(amostras, nivel, referencia):
+            # Passagens por zero ascendentes com interpolação linear
+            i = np.flatnonzero((amostras[:-1] < nivel) & (amostras[1:] > nivel))
+            S0 = amostras[i] - referencia
+            S1 = amostras[i + 1] - referencia
+            return i - S0/(S1 - S0)
+
+        zeroSaida = cruzamentos(saida, saidaDC, saidaDC)
+        # A placa compara a entrada com o valor DC da saída
+        zeroEntrada = cruzamentos(entrada, saidaDC, entradaDC)
+        if len(zeroSaida) < 2 or len(zeroEntrada) < 1:
+            self._guardaImpedancia(impMag, 0.0)
+            return
+
+        impFas = 360.0*((zeroEntrada[0] - zeroSaida[0])/(zeroSaida[1] - zeroSaida[0]))
+
+        # Corrige o ângulo
+        impFas = np.fmod(impFas, 360.0)
+        if impFas > 180.0:
+            impFas -= 360.0
+        elif impFas < -180.0:
+            impFas += 360.0
+        self._guardaImpedancia(impMag, impFas)
+
+    def calculaImpedanciaSWF(self):
+        '''
+        Impedância pelo Método de Ajuste de Curvas Senoidais (Ensaio::calculaImpedanciaSWF)
+        '''
+        N = self.AMOSTRAS_CAPTURADAS
+        T = 1/self.TX_AMOSTRAGEM
+        W = 2*np.pi*self._frequencia
+        pA1 = pA2 = pB1 = pB2 = 2048.0
+
+        n = np.arange(N)
+        saida = self.amostrasSaida[:N].astype(float)
+        entrada = self.amostrasEntrada[:N].astype(float)
+        cosWTn = np.cos(W*T*n)
+        sinWTn = np.sin(W*T*n)
+        r1 = -2.0*np.pi*pA1*T*n*sinWTn + 2.0*np.pi*pB1*T*n*cosWTn
+        r2 = -2.0*np.pi*pA2*T*n*sinWTn + 2.0*np.pi*pB2*T*n*cosWTn
+
+        # Matrizes E e G
+        E = np.zeros((7, 7))
+        E[0, 0] = E[4, 4] = np.dot(cosWTn, cosWTn)
+        E[0, 1] = E[1, 0] = E[4, 5] = E[5, 4] = np.dot(cosWTn, sinWTn)
+        E[0, 2] = E[2, 0] = E[4, 6] = E[6, 4] = cosWTn.sum()
+        E[1, 1] = E[5, 5] = np.dot(sinWTn, sinWTn)
+        E[1, 2] = E[2, 1] = E[5, 6] = E[6, 5] = sinWTn.sum()
+        E[2, 2] = E[6, 6] = N
+        E[0, 3] = E[3, 0] = np.dot(cosWTn, r1)
+        E[1, 3] = E[3, 1] = np.dot(sinWTn, r1)
+        E[2, 3] = E[3, 2] = r1.sum()
+        E[3, 3] = np.dot(r1, r1) + np.dot(r2, r2)
+        E[3, 4] = E[4, 3] = np.dot(cosWTn, r2)
+        E[3, 5] = E[5, 3] = np.dot(sinWTn, r2)
+        E[3, 6] = E[6, 3] = r2.sum()
+        G = np.array([np.dot(cosWTn, saida),
+                      np.dot(sinWTn, saida),
+                      saida.sum(),
+                      np.dot(saida, r1) + np.dot(entrada, r2),
+                      np.dot(cosWTn, entrada),
+                      np.dot(sinWTn, entrada),
+                      entrada.sum()])
+        X = np.linalg.solve(E, G)
+
+        # Módulo e fase da impedância
+        impMag = np.hypot(X[0], X[1])/np.hypot(X[4], X[5])
+        impFas = 180.0*(np.arctan(X[0]/X[1]) - np.arctan(X[4]/X[5]))/np.pi
+        self._guardaImpedancia(impMag, impFas)
+
+
+def _divideFloat(valores):
+    '''
+    Divide Valores float32 em Palavras de 16 bits (LSB, MSB)
+    '''
+    palavras = np.asarray(valores, dtype='<f4').view('<u2')
+    return palavras[0::2], palavras[1::2]
+
+
+def benchmark(emulador, repeticoes=3, teste=False):
+    '''
+    Mede o Tempo de uma Varredura Completa (ou do Sinal de Teste) através do ProtocolPy
+    '''
+    from PARAF_ENSAIO import Ensaio
+
+    ens = Ensaio()
+    ens.porta = emulador.porta
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = perf_counter()
+        if teste:
+            ens.CapturaSinalTeste()
+        else:
+            ens.CapturaImpedancia()
+        tempos.append(perf_counter() - inicio)
+    pontos = len(ens.testTens) if teste else len(ens.impFreq)
+    return pontos, tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulador da placa PARAF_ARDUINO')
+    parser.add_argument('--carga', nargs=6, type=float, metavar=('RE', 'FS', 'RS', 'QMS', 'LE', 'RED'),
+                        default=(6.0, 50.0, 40.0, 4.0, 0.0005, 0.0), help='parâmetros da carga')
+    parser.add_argument('--taxa', type=float, default=None, help='taxa do enlace em bytes/s')
+    parser.add_argument('--latencia', type=float, default=0.0, help='latência do enlace em segundos')
+    parser.add_argument('--escala-tempo', type=float, default=0.0,
+                        help='escala do tempo de captura (0 = instantâneo, 1 = tempo real)')
+    parser.add_argument('--ruido', type=float, default=0.0, help='ruído das amostras em bits')
+    parser.add_argument('--legado', action='store_true',
+                        help='emula o firmware original (envio valor a valor)')
+    parser.add_argument('--serie', default='PARAF-EMULADOR',
+                        help='número de série enviado na identificação (até 16 caracteres)')
+    parser.add_argument('--frente', nargs=2, type=float, metavar=('RSERIE', 'FC'),
+                        help='erros do circuito de medida: resistência em série e corte do canal da corrente')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N',
+                        help='executa N varreduras e mede o tempo')
+    parser.add_argument('--teste', action='store_true',
+                        help='mede a captura do sinal de teste em vez da varredura')
+    args = parser.parse_args()
+
+    emulador = EmuladorArduino(CargaThieleSmall(*args.carga), Enlace(args.taxa, args.latencia),
+                               args.escala_tempo, args.ruido, args.legado, args.serie.encode(),
+                               FrenteAnalogica(*args.frente) if args.frente else None)
+    with emulador:
+        print("Emulador na porta %s" % emulador.porta)
+        if args.benchmark:
+            pontos, tempos = benchmark(emulador, args.benchmark, args.teste)
+            print("%d pontos, melhor tempo %.3f s, média %.3f s" % (pontos, min(tempos), sum(tempos)/len(tempos)))
+            print("%d bytes enviados, %d valores e %d blocos reenviados"
+                  % (emulador.bytesEnviados, emulador.valoresReenviados, emulador.blocosReenviados))
+        else:
+            try:
+                while True:
+                    sleep(1)
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    main()
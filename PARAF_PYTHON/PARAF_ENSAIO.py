@@ -16,12 +16,75 @@ Implementado no Computador em Python 3.6
 '''
 # -*- coding: utf-8 -*-
 
+import functools
+import serial
+from time import time
 import ProtocolPy
-import matplotlib.pyplot as plt
-from matplotlib import ticker
-from numpy import save, load, array, arange, ones
-from numpy import sqrt, pi, fft, abs, angle, cos
-from scipy.signal import flattop
+import PARAF_ADAPTATIVO
+import PARAF_AMOSTRAS
+import PARAF_ARQUIVO
+import PARAF_CALIBRACAO
+import PARAF_CATALOGO
+import PARAF_MODELO
+import PARAF_PARAMETROS
+from numpy import save, load, array, arange, ones, vstack
+from numpy import sqrt, fft, abs, angle, cos
+# matplotlib e SciPy (PARAF_AJUSTE) são importados nos métodos que os usam,
+# para que os ensaios sem gráficos (PARAF_CLI) iniciem rápido
+
+
+def _reconecta(metodo):
+    '''
+    Repete a Ação uma Vez após Reabrir a Sessão caso a Conexão Caia
+    Uma placa que não responde (TempoEsgotado) não é reconectada: o erro
+    chega ao usuário sem repetir a varredura
+    '''
+    @functools.wraps(metodo)
+    def executa(self, *args, **kwargs):
+        try:
+            return metodo(self, *args, **kwargs)
+        except ProtocolPy.TempoEsgotado:
+            raise
+        except (serial.SerialException, OSError) as exc:
+            if self.ard is None:
+                raise
+            print("Falha na comunicação com a placa (%s), reconectando." % exc)
+            self.ard.reconecta()
+            return metodo(self, *args, **kwargs)
+    return executa
+
+
+def _reconectaAsync(metodo):
+    '''
+    Repete a Ação uma Vez após Reabrir a Sessão caso a Conexão Caia (asyncio)
+    '''
+    @functools.wraps(metodo)
+    async def executa(self, *args, **kwargs):
+        try:
+            return await metodo(self, *args, **kwargs)
+        except ProtocolPy.TempoEsgotado:
+            raise
+        except (serial.SerialException, OSError) as exc:
+            if self.ard is None:
+                raise
+            print("Falha na comunicação com a placa (%s), reconectando." % exc)
+            await self.ard.reconecta()
+            return await metodo(self, *args, **kwargs)
+    return executa
+
+
+def _etapa(nome):
+    '''
+    Soma a Duração do Método na Etapa das Métricas do Ensaio
+    '''
+    def decora(metodo):
+        @functools.wraps(metodo)
+        def executa(self, *args, **kwargs):
+            with self.metricas.etapa(nome):
+                return metodo(self, *args, **kwargs)
+        return executa
+    return decora
+
 
 class Ensaio(object):
     '''
@@ -37,10 +100,42 @@ class Ensaio(object):
         self.passoRel = 1.03
         self.fatorRegime = 1
         self.metodo = 'SWF'
+        # Recebe as amostras de cada frequência e calcula a impedância no
+        # computador (placas com Proto.cap_bruto)
+        self.amostrasBrutas = False
+        # Varredura adaptativa: varredura grossa com passoAdaptativo e novas
+        # frequências só onde a curva pede, até passoRel (freqRelInicial e
+        # freqRelFinal não são usadas)
+        self.varreduraAdaptativa = False
+        self.passoAdaptativo = 1.25
+        self.iteracoesAdaptativas = 6
+        # Regime permanente adaptativo: tolerância relativa entre as
+        # impedâncias de blocos seguidos de ciclos (None = espera fixa de
+        # fatorRegime segundos, que passa a ser a espera máxima)
+        self.toleranciaRegime = None
+        
+        # Porta serial da placa (None procura pelo VID/PID USB)
+        self.porta = None
+        # Sessão com a placa, mantida aberta entre os ensaios
+        self.ard = None
+        # Cancelamento pedido antes de a sessão existir (aplicado por conecta)
+        self._cancelamentoPendente = False
+        # Métricas da comunicação e das etapas (ProtocolPy.Metricas() registra
+        # cada captura; metricas.relatorio() descreve a última)
+        self.metricas = ProtocolPy.METRICAS_NULAS
+        
+        # Tabela de calibração por frequência e magnitude da placa conectada
+        # (PARAF_CALIBRACAO), usada no lugar de fatorCal quando existe; é
+        # carregada de diretorioCal ao conectar (None não grava nem carrega)
+        self.tabelaCal = None
+        self.diretorioCal = PARAF_CALIBRACAO.DIRETORIO_PADRAO
+        # Um fator de calibração indicado ou medido (Calibra) desativa a
+        # tabela na sessão; CalibraTabela volta a usá-la
+        self._semTabela = False
         
         # Fator de calibração
         # TEÓRICO
-        self.fatorCal = 1.8907793
+        self._fatorCal = 1.8907793
         # BOM PARA 4 Ohm
         #self.fatorCal = 2.16
         # BOM PARA 100 Ohm
@@ -56,6 +151,20 @@ class Ensaio(object):
         self.impFreq = None
         self.impMag = None
         self.impFas = None
+        # Amostras (frequências, tensão, corrente) da curva, se recebidas
+        self.amostras = None
+        # Tempo até o regime permanente de cada ponto [s], se informado pela placa
+        self.temposRegime = None
+        # Identificação da curva nos arquivos de medidas: data do ensaio,
+        # alto-falante medido e número de série da placa
+        self.dataEnsaio = None
+        self.altoFalante = ''
+        self.placa = ''
+        # Registro de origem de uma curva carregada de um arquivo .paraf
+        # (PARAF_ARQUIVO.carregaEnsaio; None para uma curva medida ou .npy)
+        self.infoCurva = None
+        # Catálogo (PARAF_CATALOGO) em que as curvas salvas são registradas
+        self.catalogo = None
         
         # Parâmetros do Alto-falante
         self.RE = 0
@@ -66,27 +175,128 @@ class Ensaio(object):
         self.QTS = 0
         self.LE = 0
         self.RED = 0
+        # Erro relativo RMS do último ajuste (AjustaParametros)
+        self.erroAjuste = None
+        
+        # Grade logarítmica das curvas analíticas (de freqAnalitica a freqFinal)
+        self.freqAnalitica = 0.1
+        self.pontosAnaliticos = 2000
+        
+        
+    def conecta(self):
+        '''
+        Abre a Sessão com a Placa ou Retorna a Sessão Aberta
+        '''
+        # Outra porta indicada: encerra a sessão anterior
+        if self.ard is not None and self.ard.porta != self.porta:
+            self.desconecta()
+        if self.ard is None:
+            self.ard = ProtocolPy.Proto(self.porta)
+        elif not self.ard.ser.is_open:
+            self.ard.reconecta()
+        self.ard.metricas = self.metricas
+        if self._cancelamentoPendente:
+            self._cancelamentoPendente = False
+            self.ard.cancela()
+        self._carregaTabela()
+        return self.ard
+        
+    @property
+    def fatorCal(self):
+        return self._fatorCal
         
+    @fatorCal.setter
+    def fatorCal(self, fator):
+        # O fator indicado vale no lugar da tabela da placa
+        self._fatorCal = fator
+        self._semTabela = True
+        self.tabelaCal = None
         
+    def _seriePlaca(self):
+        identificacao = self.ard.identificacao if self.ard is not None else None
+        return identificacao['serie'] if identificacao is not None else ''
+        
+    def _carregaTabela(self):
+        # Tabela de calibração guardada da placa (outra placa: troca a tabela)
+        serie = self._seriePlaca()
+        if self.tabelaCal is not None and self.tabelaCal.serie == serie:
+            return
+        self.tabelaCal = None
+        # Placas sem número de série não têm tabela guardada
+        if self.diretorioCal is not None and serie and not self._semTabela:
+            self.tabelaCal = PARAF_CALIBRACAO.carregaTabela(serie, self.diretorioCal)
+        
+    def desconecta(self):
+        '''
+        Encerra a Sessão com a Placa
+        '''
+        if self.ard is not None:
+            self.ard.fecha()
+            self.ard = None
+            
+    def Cancela(self, cancelar=True):
+        '''
+        Cancela a Captura em Andamento (Chamado de Outra Thread)
+        A captura é interrompida com ProtocolPy.EnsaioCancelado. Sem sessão
+        aberta, o pedido vale para a sessão aberta em seguida por conecta;
+        Cancela(False) desfaz um pedido ainda não atendido.
+        '''
+        # O pedido é guardado antes de olhar a sessão: conecta aplica o que
+        # chegou antes dela e o que chega depois vai direto para a sessão
+        self._cancelamentoPendente = cancelar
+        ard = self.ard
+        if ard is not None:
+            self._cancelamentoPendente = False
+            ard.cancela(cancelar)
+            
+    def NumeroPontos(self):
+        '''
+        Número de Frequências da Varredura Configurada (como Ensaio::atualizaEnsaio)
+        Retorna None se os passos não avançam a frequência ou se a varredura
+        é adaptativa (número de pontos conhecido só no fim)
+        '''
+        if self.varreduraAdaptativa:
+            return None
+        return ProtocolPy.contaPontos(self.freqInicial, self.freqFinal, self.passo,
+                                      self.freqRelInicial, self.freqRelFinal, self.passoRel)
+        
+    def ResumoRegime(self):
+        '''
+        Resumo dos Tempos até o Regime Permanente do Último Ensaio [s]
+        Retorna a espera total, o tempo de captura das amostras e a maior
+        espera com a sua frequência, ou None se a placa não informou os tempos
+        '''
+        if self.temposRegime is None or len(self.temposRegime) == 0:
+            return None
+        i = self.temposRegime.argmax()
+        return {'espera': float(self.temposRegime.sum()),
+                # 4096 amostras por ponto na taxa de amostragem da placa
+                'captura': len(self.temposRegime)*4096/PARAF_AMOSTRAS.TX_AMOSTRAGEM,
+                'maxima': float(self.temposRegime[i]),
+                'freqMaxima': float(self.impFreq[i])}
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.desconecta()
+        
+    @_reconecta
     def Calibra(self, R):
         '''
         Determina o Fator de Calibração de acordo com uma Resistencia Conhecida
         '''
-        # Inicializa a Comunicação com o Arudinotype filter text
-        ard = ProtocolPy.Proto()    
+        # Inicializa a Comunicação com o Arudino
+        ard = self.conecta()
         # Seta as Propriedades do Ensaio Realizado na Resistência Conhecida 
-        ard.setaFrequenciaInicial(11)
-        ard.setaFrequenciaFinal(15)
-        ard.setaPasso(2.0)
-        ard.setaFrequenciaRelInicial(11)
-        ard.setaFrequenciaRelFinal(15)
-        ard.setaPassoRel(2.0)
-        ard.setaFatorRegime(1)
-        ard.setaMetodoImpedancia('SWF')
+        ard.configuraEnsaio(11, 15, 2.0, 11, 15, 2.0, 1, 'SWF')
         
         # Inicia o ensaio e captura os dados
         ard.iniciaEnsaio()
         freq, mag, fas = ard.recebeImpedancias()           
+        self._guardaCalibracao(R, mag)
+        
+    def _guardaCalibracao(self, R, mag):
         impMag = array(mag)
 
         # Calcula a Média dos Valores dos Bits   
@@ -100,17 +310,43 @@ class Ensaio(object):
         
         print(self.fatorCal)
         
+    @_reconecta
+    def CalibraTabela(self, R):
+        '''
+        Acrescenta à Tabela de Calibração da Placa a Varredura de um Resistor
+        de Referência (com a Configuração do Ensaio)
+        Com dois ou mais resistores a correção depende também da magnitude
+        '''
+        ard = self.conecta()
+        self._configuraEnsaio(ard)
+        ard.iniciaEnsaio(regime=self.toleranciaRegime)
+        freq, mag, fas = ard.recebeImpedancias()
+        self._guardaTabela(R, freq, mag, fas)
+        
+    def _guardaTabela(self, R, freq, mag, fas):
+        self._semTabela = False
+        if self.tabelaCal is None:
+            self.tabelaCal = PARAF_CALIBRACAO.TabelaCalibracao(self._seriePlaca())
+        self.tabelaCal.adiciona(R, freq, mag, fas)
+        # Guardada para as próximas sessões com a mesma placa; a tabela de
+        # uma placa sem número de série vale só nesta sessão
+        if self.diretorioCal is not None and self.tabelaCal.serie:
+            self.tabelaCal.salva(self.diretorioCal)
+        
+    @_reconecta
     def CapturaSinalTeste(self):
         '''
         Captura os Sinais de Tensão e Corrente em uma Frequencia para o Teste do Dispositivo
         '''
-        ard = ProtocolPy.Proto()
+        ard = self.conecta()
         ard.setaFrequencia(self.testFreq)
         ard.setaFatorRegime(self.testDuracao)
         ard.iniciaEnsaio()
         tens = ard.recebeValores()
         corr = ard.recebeValores()
+        self._guardaSinalTeste(tens, corr)
         
+    def _guardaSinalTeste(self, tens, corr):
         self.testTens = array(tens)
         self.testCorr = array(corr)
         
@@ -124,54 +360,255 @@ class Ensaio(object):
             
         #comVal() 
 
+    def _configuraEnsaio(self, ard):
+        # Frequências, passos, fator de regime permanente e método de cálculo
+        # da impedância em um pacote (não reenviado se não mudou)
+        ard.configuraEnsaio(self.freqInicial, self.freqFinal, self.passo,
+                            self.freqRelInicial, self.freqRelFinal, self.passoRel,
+                            self.fatorRegime, self.metodo)
+
+    @_reconecta
     def CapturaImpedancia(self):
         '''
         Captura a Curva de Impedância a partir do Arduino Due 
         ''' 
+        # A varredura adaptativa decide as frequências a partir dos pontos
+        if self.varreduraAdaptativa:
+            for _ in self.iterCapturaImpedancia():
+                pass
+            return
+        
+        self.metricas.iniciaEnsaio()
+        try:
+            self._capturaImpedancia()
+        finally:
+            self.metricas.finalizaEnsaio()
+        
+    def _capturaImpedancia(self):
         # Inicializa a Comunicação com o Arudino
-        ard = ProtocolPy.Proto()    
-        # Seta a frequencia inicial e final do ensaio 
-        ard.setaFrequenciaInicial(self.freqInicial)
-        ard.setaFrequenciaFinal(self.freqFinal)
-        # Seta o passo do ensaio
-        ard.setaPasso(self.passo)
-        # Seta a frequencia inicial e final relevante
-        ard.setaFrequenciaRelInicial(self.freqRelInicial)
-        ard.setaFrequenciaRelFinal(self.freqRelFinal)
-        # Seta o passo para as frequencias relevantes
-        ard.setaPassoRel(self.passoRel)
-        # Seta o fator de regime permanente
-        ard.setaFatorRegime(self.fatorRegime)
-        # Seta o método de cálculo da impedância
-        ard.setaMetodoImpedancia(self.metodo)
+        ard = self.conecta()
+        # Configura o ensaio
+        self._configuraEnsaio(ard)
         
         # Inicia o ensaio
-        ard.iniciaEnsaio()
+        ard.iniciaEnsaio(bruto=self.amostrasBrutas, regime=self.toleranciaRegime)
         
-        # Recebe os valores das impedâncias
-        freq, mag, fas = ard.recebeImpedancias()           
+        # Recebe as amostras e calcula as impedâncias de uma vez
+        if ard.modoBruto:
+            self._guardaAmostras(*ard.recebeAmostras())
+        else:
+            # Recebe os valores das impedâncias
+            freq, mag, fas = ard.recebeImpedancias()           
+            self._guardaImpedancias(freq, mag, fas)
+        
+        # Tempos até o regime permanente, na ordem dos pontos
+        self.temposRegime = ard.recebeTemposRegime()
+        
+    def _identificaCurva(self):
+        # Data e placa da curva recém medida
+        self.dataEnsaio = time()
+        self.placa = self._seriePlaca()
+        self.infoCurva = None
         
+    def _corrige(self, freq, mag, fas):
+        # Magnitude calibrada e fase (vetores ou um ponto): pela tabela da
+        # placa ou pelo fator de calibração
+        if self.tabelaCal is None:
+            return self.fatorCal*mag, fas
+        mag, fas = self.tabelaCal.corrige(freq, mag, fas)
+        if mag.ndim == 0:
+            return float(mag), float(fas)
+        return mag, fas
+        
+    def _guardaImpedancias(self, freq, mag, fas, amostras=None):
+        self._identificaCurva()
         # Guarda os valores
-        self.impFreq = array(freq)
-        self.impMag = array(mag)
-        self.impFas = array(fas)        
+        self.impFreq = array(freq, dtype=float)
+        self.impMag = array(mag, dtype=float)
+        self.impFas = array(fas, dtype=float)        
+        self.amostras = amostras
+                
+        # Corrige a magnitude (e a fase, com a tabela) de acordo com a calibração
+        self.impMag, self.impFas = self._corrige(self.impFreq, self.impMag, self.impFas)
+        
+    @_etapa('calculo_amostras')
+    def _guardaAmostras(self, freq, saida, entrada):
+        # Impedâncias de todas as frequências calculadas a partir das amostras
+        mag, fas = PARAF_AMOSTRAS.calculaImpedancias(freq, saida, entrada, self.metodo)
+        self._guardaImpedancias(freq, mag, fas, (freq, saida, entrada))
+        
+    @_etapa('calculo_amostras')
+    def _pontoAmostras(self, freq, saida, entrada):
+        # Impedância de uma frequência (calculada enquanto a placa captura a próxima)
+        mag, fas = PARAF_AMOSTRAS.calculaImpedancias(freq, saida, entrada, self.metodo)
+        return (freq,) + self._corrige(freq, mag[0], fas[0])
+        
+    def RecalculaImpedancia(self, metodo=None):
+        '''
+        Recalcula a Curva a partir das Amostras Guardadas (sem Novo Ensaio)
+        metodo: 'SWF' ou 'ZC' (padrão: o método do ensaio)
+        '''
+        if self.amostras is None:
+            raise ValueError("A curva não tem amostras guardadas")
+        if metodo is not None:
+            self.metodo = metodo
+        self._guardaAmostras(*self.amostras)
+        
+    def iterCapturaImpedancia(self):
+        '''
+        Captura a Curva de Impedância Ponto a Ponto
+        Gera (frequência, magnitude corrigida, fase) durante o ensaio
+        '''
+        self.metricas.iniciaEnsaio()
+        # Inicializa a Comunicação com o Arudino
+        ard = self.conecta()
+        pontos, capturas, tempos = [], [], []
+        try:
+            if self.varreduraAdaptativa:
+                # Varredura grossa e as listas pedidas pelo refinamento
+                self._configuraVarreduraGrossa(ard)
+                yield from self._iterPassagem(ard, pontos, capturas, tempos)
+                yield from self._iterRefinamento(ard, pontos, capturas, tempos)
+            else:
+                # Configura o ensaio
+                self._configuraEnsaio(ard)
+                
+                # Inicia o ensaio com o envio contínuo dos pontos (ou das amostras)
+                yield from self._iterPassagem(ard, pontos, capturas, tempos)
+        except (serial.SerialException, OSError):
+            # A sessão é reaberta no próximo ensaio
+            ard.fecha()
+            raise
+        finally:
+            self.metricas.finalizaEnsaio()
+        self._guardaPontos(pontos, capturas, tempos)
+        
+    def _iterPassagem(self, ard, pontos, capturas, tempos):
+        # Um ensaio com o envio contínuo dos pontos (ou das amostras) e os
+        # tempos de regime dos seus pontos
+        inicio = len(pontos)
+        ard.iniciaEnsaio(continuo=True, bruto=self.amostrasBrutas, regime=self.toleranciaRegime)
+        yield from self._iterPontos(ard, pontos, capturas)
+        self._associaTempos(pontos[inicio:], ard.recebeTemposRegime(), tempos)
+        
+    def _associaTempos(self, pontos, temposPassagem, tempos):
+        # Os pontos de um ensaio são medidos em ordem crescente de frequência
+        if temposPassagem is not None and len(temposPassagem) == len(pontos):
+            tempos.extend(zip(sorted(ponto[0] for ponto in pontos), temposPassagem))
+        
+    def _iterPontos(self, ard, pontos, capturas):
+        # Pontos do ensaio iniciado, guardados em pontos (e as amostras em capturas)
+        if ard.modoBruto:
+            for captura in ard.iterAmostras():
+                capturas.append(captura)
+                ponto = self._pontoAmostras(*captura)
+                pontos.append(ponto)
+                yield ponto
+        else:
+            for freq, mag, fas in ard.iterImpedancias():
+                ponto = (freq,) + self._corrige(freq, mag, fas)
+                pontos.append(ponto)
+                yield ponto
                 
-        # Corrige a magnitude de acordo com o fator de correção
-        self.impMag = self.fatorCal*self.impMag       
+    def _configuraVarreduraGrossa(self, ard):
+        # Passo único, sem frequências relevantes
+        return ard.configuraEnsaio(self.freqInicial, self.freqFinal, self.passoAdaptativo,
+                                   self.freqInicial, self.freqInicial, self.passoAdaptativo,
+                                   self.fatorRegime, self.metodo)
+        
+    def _configuraFrequenciaUnica(self, ard, freq):
+        # Ensaio de uma frequência: a placa envia as amostras da tensão e da corrente
+        return ard.configuraEnsaio(freq, freq, 0, freq, freq, 0, self.fatorRegime, self.metodo)
+        
+    def _refinaVarredura(self, pontos):
+        # Próximas frequências a partir dos pontos medidos
+        freq, mag, fas = zip(*pontos)
+        return PARAF_ADAPTATIVO.refinaVarredura(freq, mag, fas, self.passoRel)
+        
+    def _iterRefinamento(self, ard, pontos, capturas, tempos):
+        # Medidas só nas frequências pedidas pelo refinamento, até não haver
+        # novas ou esgotar as iterações
+        for _ in range(self.iteracoesAdaptativas):
+            novas = self._refinaVarredura(pontos)
+            if len(novas) == 0:
+                break
+            if ard.suportaLista():
+                # Uma varredura por lista de até ard.tamanhoLista frequências
+                for i in range(0, len(novas), ard.tamanhoLista):
+                    ard.configuraLista(novas[i:i + ard.tamanhoLista])
+                    yield from self._iterPassagem(ard, pontos, capturas, tempos)
+            else:
+                # Placas sem a lista: um ensaio de frequência única por ponto
+                for freq in novas:
+                    self._configuraFrequenciaUnica(ard, freq)
+                    ard.iniciaEnsaio(regime=self.toleranciaRegime)
+                    captura = (freq, ard.recebeValores(), ard.recebeValores())
+                    capturas.append(captura)
+                    ponto = self._pontoAmostras(*captura)
+                    pontos.append(ponto)
+                    self._associaTempos([ponto], ard.recebeTemposRegime(), tempos)
+                    yield ponto
+        
+    def _guardaPontos(self, pontos, capturas=None, tempos=None):
+        self._identificaCurva()
+        # Guarda os valores em ordem de frequência (pontos reenviados chegam depois)
+        pontos.sort()
+        self.impFreq = array([p[0] for p in pontos])
+        self.impMag = array([p[1] for p in pontos])
+        self.impFas = array([p[2] for p in pontos])
+        self.amostras = None
+        self.temposRegime = None
+        # Os tempos de regime são guardados se vieram em todos os pontos
+        if tempos and len(tempos) == len(pontos):
+            self.temposRegime = array([tempo for freq, tempo in sorted(tempos)])
+        # As amostras são guardadas se vieram em todos os pontos
+        if capturas and len(capturas) == len(pontos):
+            capturas.sort(key=lambda captura: captura[0])
+            freq, saida, entrada = zip(*capturas)
+            self.amostras = (array(freq), vstack(saida), vstack(entrada))
         
+    @_etapa('salva')
     def Salva(self, filename='dados_curva.npy'):
         '''
         Salva em um Arquivo os Valores da Curva
+        Arquivos .paraf (PARAF_ARQUIVO) recebem a curva como mais um ensaio,
+        com a configuração, a calibração e a identificação
+        Com um catálogo (caminho do banco SQLite), a curva é registrada nele
         '''
-        valores = self.impFreq, self.impMag, self.impFas 
-        save(filename, valores)
+        if filename.endswith(PARAF_ARQUIVO.EXTENSAO):
+            PARAF_ARQUIVO.salvaEnsaio(filename, self)
+        else:
+            valores = self.impFreq, self.impMag, self.impFas 
+            save(filename, valores)
+            # As amostras ficam em outro arquivo, ao lado da curva (as de
+            # uma curva anterior salva com o mesmo nome são removidas)
+            if self.amostras is not None:
+                PARAF_AMOSTRAS.salvaAmostras(filename, *self.amostras)
+            else:
+                PARAF_AMOSTRAS.removeAmostras(filename)
         
+        if self.catalogo is not None:
+            with PARAF_CATALOGO.Catalogo(self.catalogo) as catalogo:
+                catalogo.registra(filename, self)
         
-    def Carrega(self, filename='dados_curva.npy'):
+        
+    @_etapa('carrega')
+    def Carrega(self, filename='dados_curva.npy', indice=-1):
         '''
         Carrega os Valores da Curva a partir de um Arquivo
+        indice: ensaio de um arquivo .paraf (padrão: o último)
         '''
+        if filename.endswith(PARAF_ARQUIVO.EXTENSAO):
+            PARAF_ARQUIVO.carregaEnsaio(filename, self, indice)
+            return
+        # O .npy guarda só a curva: sem data, alto-falante e placa
+        self.dataEnsaio = None
+        self.altoFalante = ''
+        self.placa = ''
+        self.infoCurva = None
         self.impFreq, self.impMag, self.impFas = load(filename)
+        self.amostras = PARAF_AMOSTRAS.carregaAmostras(filename, self.impFreq)
+        self.temposRegime = None
         
     def PlotaSinalTeste(self, fig):
         '''
@@ -230,6 +667,7 @@ class Ensaio(object):
                 x_ticks = [1/self.testFreq, 4096*Ts]
             k+=1
         ax1.set_xticks(x_ticks)
+        from matplotlib import ticker
         scale_x = 1e-3
         ticks_x = ticker.FuncFormatter(lambda x, pos: ('$%.1f$'%(x/scale_x)).replace('.',','))
         ax1.xaxis.set_major_formatter(ticks_x)
@@ -245,6 +683,7 @@ class Ensaio(object):
         nAmostras = (4*1024)
         # Janela
         if flat is True:
+            from scipy.signal import flattop
             window = flattop(nAmostras)
         else:
             window = ones(nAmostras)
@@ -271,6 +710,7 @@ class Ensaio(object):
         ax4.plot(fftCorrFas, '-bo')
 
 
+    @_etapa('grafico')
     def grafico(self, fig, sobrepor=False):
         '''
         Plota o gráfico das Curvas de Magnitude e Fase da Impedância
@@ -291,33 +731,31 @@ class Ensaio(object):
         ax1.set_ylabel("Magnitude [$\Omega$]")
         ax2.set_ylabel("Fase [°]")        
 
-        ax1.plot(self.impFreq, self.impMag, '-ro')            
-        ax2.plot(self.impFreq, self.impFas, '-bo')
+        # Sem curva medida (ensaio em andamento) as linhas começam vazias
+        if self.impFreq is None:
+            ax1.plot([], [], '-ro')
+            ax2.plot([], [], '-bo')
+        else:
+            ax1.plot(self.impFreq, self.impMag, '-ro')            
+            ax2.plot(self.impFreq, self.impFas, '-bo')
         
     
+    def CurvaAnalitica(self):
+        '''
+        Retorna a Curva Analítica (freq, mag, fas) dos Parâmetros do Alto-falante
+        '''
+        # Curva vetorizada (reutilizada do cache enquanto os parâmetros não mudam)
+        parametros = (self.RE, self.FS, self.RS, self.QMS, self.LE, self.RED)
+        return PARAF_MODELO.curvaAnalitica(parametros, self.freqAnalitica,
+                                           self.freqFinal, self.pontosAnaliticos)
+        
+    @_etapa('grafico')
     def PlotaCurvasAnaliticas(self, fig):
         '''
         Plota o gráfico Analítico das Curvas de Magnitude e Fase 
         De acordo com os Parâmetros do Alto-falante
         '''
-        impFreq = []
-        impMag = []
-        impFas = []
-        
-        ws = self.FS*2*pi
-        res = self.RS - self.RE 
-        
-        for f in arange(0.1, self.freqFinal, 0.1):
-            
-            impFreq.append(f)        
-            
-            S = 2*pi*f*1j
-            
-            impLin = self.RE + res/(1 + self.QMS * (S/ws + ws/S))       
-            imp = self.RED*S + self.LE*S + impLin
-                    
-            impMag.append(abs(imp))
-            impFas.append(angle(imp, deg=True))   
+        impFreq, impMag, impFas = self.CurvaAnalitica()
                 
         # Plota os resultados
         axlist = fig.axes
@@ -327,75 +765,353 @@ class Ensaio(object):
         ax2.plot(impFreq, impFas, '-.b') 
         
         
+    @_etapa('parametros')
     def CalculaParametros(self):
         '''
         Calcula os Valores dos Parâmetros do Alto-falante
         '''
-        impFreq = self.impFreq
-        impMag = self.impMag
-        
-        # Encontra o primeiro máximo da curva de impedância
-        k = 7
-        for i in range(k, len(impFreq) - k):
-            topo = True
-            for ki in range(1, k):
-                if (impMag[i] - impMag[i-ki] > 0) and (impMag[i] - impMag[i+ki] > 0):
-                    topo = topo and True
-                else:
-                    topo = False
-    
-            if topo is True:
-                iS = i
-                    
-        A = impFreq[iS-1]
-        B = impFreq[iS]
-        C = impFreq[iS+1]
-        fA = impMag[iS-1]
-        fB = impMag[iS]
-        fC = impMag[iS+1]
-        
-        # Determina o avalor da Frequencia de Ressonancia (interpolação parabólica) 
-        self.FS = B + (1/2) * ( (fA - fB)*(C-B)**2 - (fC - fB)*(B-A)**2 )/( (fA - fB)*(C-B) + (fC - fB)*(B-A) )
-        # Determina o valor da Impedância na Frequencia de ressonancia
-        self.RS = fA*((self.FS-B)*(self.FS-C))/((A-B)*(A-C)) +\
-                  fB*((self.FS-C)*(self.FS-A))/((B-C)*(B-A)) +\
-                  fC*((self.FS-A)*(self.FS-B))/((C-A)*(C-B))
-        
-        # Determina o valor da Resistência CC 
-        self.RE = min(impMag)  
-        
-        # Determina a impedância Z12
-        z12 = sqrt(self.RE*self.RS)
-        
-        # Encontra a primeira frequencia
-        iB = 0
-        for i in range (1, len(impFreq) - 1):
-            if impMag[i] > z12:
-                iB = i
-                break
-        iA = i - 1
-        # Interpolação linear    
-        F1 =   (  impFreq[iA] * (1 - (z12 - impMag[iA])/(impMag[iB] - impMag[iA])) 
-                + impFreq[iB] * ((z12 - impMag[iA])/(impMag[iB] - impMag[iA])))
+        parametros = PARAF_PARAMETROS.parametrosCurva(self.impFreq, self.impMag)
+        if parametros['status'] != PARAF_PARAMETROS.OK:
+            raise ValueError("Parâmetros não calculados: %s" % PARAF_PARAMETROS.DESCRICAO[parametros['status']])
+        
+        self.RE = parametros['RE']
+        self.FS = parametros['FS']
+        self.RS = parametros['RS']
+        self.QMS = parametros['QMS']
+        self.QES = parametros['QES']
+        self.QTS = parametros['QTS']
+        
+    @_etapa('ajuste')
+    def AjustaParametros(self):
+        '''
+        Ajusta o Modelo à Curva de Impedância Complexa Medida (Inclusive LE)
+        Parte dos parâmetros extraídos como em CalculaParametros e dos
+        parâmetros atuais (ensaio anterior), mantendo RED fixo
+        '''
+        import PARAF_AJUSTE
+        
+        inicial = None
+        if self.FS > 0:
+            inicial = (self.RE, self.FS, self.RS, self.QMS, self.LE)
+        ajuste = PARAF_AJUSTE.ajustaCurva(self.impFreq, self.impMag, self.impFas, inicial, self.RED)
+        if ajuste['status'] != PARAF_PARAMETROS.OK:
+            raise ValueError("Parâmetros não ajustados: %s" % PARAF_PARAMETROS.DESCRICAO[ajuste['status']])
+        
+        self.RE = ajuste['RE']
+        self.FS = ajuste['FS']
+        self.RS = ajuste['RS']
+        self.QMS = ajuste['QMS']
+        self.QES = ajuste['QES']
+        self.QTS = ajuste['QTS']
+        self.LE = ajuste['LE']
+        self.erroAjuste = ajuste['erro']
+                
+class GraficoImpedancia(object):
+    '''
+    Gráfico das Curvas de Impedância com Atualização Incremental
+
+    Os eixos e as linhas são criados uma vez em monta(). A curva analítica é
+    alterada com set_data e redesenhada sozinha sobre o fundo guardado no
+    último desenho completo (blitting). A figura só é refeita quando o
+    leiaute muda (sobrepor) ou quando outro gráfico a ocupou (limpa()).
+    Durante um ensaio, a curva medida cresce a cada ponto (adicionaPonto).
+    '''
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.fig = canvas.figure
+        self.sobrepor = None
+        self._linhasMedidas = None
+        self._linhasAnaliticas = None
+        self._fundo = None
+        self._pontos = None
+        # Cada desenho completo (zoom, redimensionamento, eixo) renova o fundo
+        canvas.mpl_connect('draw_event', self._guardaFundo)
+        
+    @property
+    def montado(self):
+        return self._linhasAnaliticas is not None
+        
+    def limpa(self):
+        '''
+        Limpa a Figura para Outro Gráfico
+        '''
+        self.fig.clear()
+        self.sobrepor = None
+        self._linhasMedidas = None
+        self._linhasAnaliticas = None
+        self._fundo = None
+        self._pontos = None
+        
+    def monta(self, ensaio, sobrepor=False, eixoLog=False):
+        '''
+        Cria os Eixos e as Linhas das Curvas Medida e Analítica
+        '''
+        self.limpa()
+        ensaio.grafico(self.fig, sobrepor)
+        ax1, ax2 = self.fig.axes[:2]
+        self._linhasMedidas = (ax1.lines[0], ax2.lines[0])
+        # A curva analítica não altera os limites e é desenhada à parte
+        self._linhasAnaliticas = (ax1.plot([], [], '-.r', animated=True, scalex=False, scaley=False)[0],
+                                  ax2.plot([], [], '-.b', animated=True, scalex=False, scaley=False)[0])
+        ax1.set_xscale('log' if eixoLog else 'linear')
+        self.sobrepor = sobrepor
+        self.canvas.draw()
+        
+    def atualizaMedidas(self, ensaio):
+        '''
+        Substitui a Curva Medida (Novo Ensaio) sem Refazer os Eixos
+        '''
+        self._pontos = None
+        for linha, valores in zip(self._linhasMedidas, (ensaio.impMag, ensaio.impFas)):
+            linha.set_data(ensaio.impFreq, valores)
+        # Os limites seguem só a curva medida
+        for linha in self._linhasAnaliticas:
+            linha.set_data([], [])
+        for ax in self.fig.axes:
+            ax.relim()
+            ax.autoscale_view()
+        self.canvas.draw_idle()
+        
+    def iniciaCaptura(self, ensaio, sobrepor=False, eixoLog=False):
+        '''
+        Esvazia a Curva Medida para os Pontos do Ensaio que Começa
+        '''
+        if not self.montado or self.sobrepor != sobrepor:
+            self.monta(ensaio, sobrepor, eixoLog)
+        self._pontos = []
+        for linha in self._linhasMedidas + self._linhasAnaliticas:
+            linha.set_data([], [])
+        self.canvas.draw_idle()
+        
+    def adicionaPonto(self, freq, mag, fas):
+        '''
+        Acrescenta um Ponto Recebido à Curva Medida
+        Pontos reenviados chegam fora de ordem: a curva é mantida em ordem
+        de frequência
+        '''
+        if not self.montado or self._pontos is None:
+            return
+        self._pontos.append((freq, mag, fas))
+        self._pontos.sort()
+        freqs, mags, fases = zip(*self._pontos)
+        for linha, valores in zip(self._linhasMedidas, (mags, fases)):
+            linha.set_data(freqs, valores)
+        for ax in self.fig.axes:
+            ax.relim()
+            ax.autoscale_view()
+        self.canvas.draw_idle()
+        
+    def eixoLog(self, log):
+        self.fig.axes[0].set_xscale('log' if log else 'linear')
+        self.canvas.draw_idle()
+        
+    def atualizaAnalitica(self, curva, visivel=True):
+        '''
+        Altera a Curva Analítica (freq, mag, fas) e Redesenha Apenas as suas Linhas
+        '''
+        freq, mag, fas = curva
+        for linha, valores in zip(self._linhasAnaliticas, (mag, fas)):
+            linha.set_data(freq, valores)
+            linha.set_visible(visivel)
+        # Sem fundo guardado (figura ainda não desenhada)
+        if self._fundo is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self._fundo)
+        self._desenhaAnaliticas()
+        self.canvas.blit(self.fig.bbox)
+        
+    def _guardaFundo(self, evento):
+        if not self.montado:
+            return
+        self._fundo = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._desenhaAnaliticas()
+        
+    def _desenhaAnaliticas(self):
+        for linha in self._linhasAnaliticas:
+            linha.axes.draw_artist(linha)
+        
+        
+class AsyncEnsaio(Ensaio):
+    '''
+    Ensaio de um Alto-falante com asyncio
+
+    As capturas são corrotinas que usam uma sessão ProtocolPy.AsyncProto, de
+    modo que várias placas são controladas no mesmo processo:
+
+        await asyncio.gather(*(ens.CapturaImpedancia() for ens in ensaios))
+    '''
+    async def conecta(self):
+        '''
+        Abre a Sessão com a Placa ou Retorna a Sessão Aberta
+        '''
+        # Outra porta indicada: encerra a sessão anterior
+        if self.ard is not None and self.ard.porta != self.porta:
+            self.desconecta()
+        if self.ard is None:
+            ard = ProtocolPy.AsyncProto(self.porta)
+            await ard.abre()
+            self.ard = ard
+        elif not self.ard.ser.is_open:
+            await self.ard.reconecta()
+        self.ard.metricas = self.metricas
+        if self._cancelamentoPendente:
+            self._cancelamentoPendente = False
+            self.ard.cancela()
+        self._carregaTabela()
+        return self.ard
+        
+    async def __aenter__(self):
+        return self
     
-        # Encontra a segunda frequencia
-        iB = 0
-        for i in range (iS, len(impFreq) - 1):
-            if impMag[i] < z12:
-                iB = i
-                break
-        iA = i - 1
-        # Interpolação linear    
-        F2 =   (  impFreq[iA] * (1 - (z12 - impMag[iA])/(impMag[iB] - impMag[iA])) 
-                + impFreq[iB] * ((z12 - impMag[iA])/(impMag[iB] - impMag[iA])))
-        
-        #Calcula QMS
-        self.QMS = (self.FS/(F2-F1))*sqrt(self.RS/self.RE)
-        # Calcula QES
-        self.QES = self.QMS/(self.RS/self.RE - 1)
-        #Calcula QTS
-        self.QTS = self.QMS*(self.RE/self.RS)
+    async def __aexit__(self, *args):
+        self.desconecta()
+        
+    @_reconectaAsync
+    async def Calibra(self, R):
+        '''
+        Determina o Fator de Calibração de acordo com uma Resistencia Conhecida
+        '''
+        ard = await self.conecta()
+        # Seta as Propriedades do Ensaio Realizado na Resistência Conhecida 
+        await ard.configuraEnsaio(11, 15, 2.0, 11, 15, 2.0, 1, 'SWF')
+        
+        # Inicia o ensaio e captura os dados
+        await ard.iniciaEnsaio()
+        freq, mag, fas = await ard.recebeImpedancias()
+        self._guardaCalibracao(R, mag)
+        
+    @_reconectaAsync
+    async def CalibraTabela(self, R):
+        '''
+        Acrescenta à Tabela de Calibração da Placa a Varredura de um Resistor
+        de Referência (com a Configuração do Ensaio)
+        '''
+        ard = await self.conecta()
+        await self._configuraEnsaio(ard)
+        await ard.iniciaEnsaio(regime=self.toleranciaRegime)
+        freq, mag, fas = await ard.recebeImpedancias()
+        self._guardaTabela(R, freq, mag, fas)
+        
+    @_reconectaAsync
+    async def CapturaSinalTeste(self):
+        '''
+        Captura os Sinais de Tensão e Corrente em uma Frequencia para o Teste do Dispositivo
+        '''
+        ard = await self.conecta()
+        await ard.setaFrequencia(self.testFreq)
+        await ard.setaFatorRegime(self.testDuracao)
+        await ard.iniciaEnsaio()
+        tens = await ard.recebeValores()
+        corr = await ard.recebeValores()
+        self._guardaSinalTeste(tens, corr)
+        
+    async def _configuraEnsaio(self, ard):
+        # Frequências, passos, fator de regime permanente e método de cálculo
+        # da impedância em um pacote (não reenviado se não mudou)
+        await ard.configuraEnsaio(self.freqInicial, self.freqFinal, self.passo,
+                                  self.freqRelInicial, self.freqRelFinal, self.passoRel,
+                                  self.fatorRegime, self.metodo)
+        
+    @_reconectaAsync
+    async def CapturaImpedancia(self):
+        '''
+        Captura a Curva de Impedância a partir do Arduino Due 
+        '''
+        if self.varreduraAdaptativa:
+            async for _ in self.iterCapturaImpedancia():
+                pass
+            return
+        self.metricas.iniciaEnsaio()
+        try:
+            await self._capturaImpedancia()
+        finally:
+            self.metricas.finalizaEnsaio()
+        
+    async def _capturaImpedancia(self):
+        ard = await self.conecta()
+        await self._configuraEnsaio(ard)
+        await ard.iniciaEnsaio(bruto=self.amostrasBrutas, regime=self.toleranciaRegime)
+        if ard.modoBruto:
+            self._guardaAmostras(*(await ard.recebeAmostras()))
+        else:
+            freq, mag, fas = await ard.recebeImpedancias()
+            self._guardaImpedancias(freq, mag, fas)
+        self.temposRegime = await ard.recebeTemposRegime()
+        
+    async def iterCapturaImpedancia(self):
+        '''
+        Captura a Curva de Impedância Ponto a Ponto (async for)
+        Gera (frequência, magnitude corrigida, fase) durante o ensaio
+        '''
+        self.metricas.iniciaEnsaio()
+        ard = await self.conecta()
+        pontos, capturas, tempos = [], [], []
+        try:
+            if self.varreduraAdaptativa:
+                # Varredura grossa e as listas pedidas pelo refinamento
+                await self._configuraVarreduraGrossa(ard)
+                async for ponto in self._iterPassagem(ard, pontos, capturas, tempos):
+                    yield ponto
+                async for ponto in self._iterRefinamento(ard, pontos, capturas, tempos):
+                    yield ponto
+            else:
+                await self._configuraEnsaio(ard)
+                async for ponto in self._iterPassagem(ard, pontos, capturas, tempos):
+                    yield ponto
+        except (serial.SerialException, OSError):
+            # A sessão é reaberta no próximo ensaio
+            ard.fecha()
+            raise
+        finally:
+            self.metricas.finalizaEnsaio()
+        self._guardaPontos(pontos, capturas, tempos)
+        
+    async def _iterPassagem(self, ard, pontos, capturas, tempos):
+        # Um ensaio com o envio contínuo dos pontos e os tempos de regime
+        inicio = len(pontos)
+        await ard.iniciaEnsaio(continuo=True, bruto=self.amostrasBrutas, regime=self.toleranciaRegime)
+        async for ponto in self._iterPontos(ard, pontos, capturas):
+            yield ponto
+        self._associaTempos(pontos[inicio:], await ard.recebeTemposRegime(), tempos)
+        
+    async def _iterPontos(self, ard, pontos, capturas):
+        # Pontos do ensaio iniciado, guardados em pontos (e as amostras em capturas)
+        if ard.modoBruto:
+            async for captura in ard.iterAmostras():
+                capturas.append(captura)
+                ponto = self._pontoAmostras(*captura)
+                pontos.append(ponto)
+                yield ponto
+        else:
+            async for freq, mag, fas in ard.iterImpedancias():
+                ponto = (freq,) + self._corrige(freq, mag, fas)
+                pontos.append(ponto)
+                yield ponto
                 
+    async def _iterRefinamento(self, ard, pontos, capturas, tempos):
+        # Medidas nas frequências pedidas pelo refinamento (ver Ensaio._iterRefinamento)
+        for _ in range(self.iteracoesAdaptativas):
+            novas = self._refinaVarredura(pontos)
+            if len(novas) == 0:
+                break
+            if ard.suportaLista():
+                for i in range(0, len(novas), ard.tamanhoLista):
+                    await ard.configuraLista(novas[i:i + ard.tamanhoLista])
+                    async for ponto in self._iterPassagem(ard, pontos, capturas, tempos):
+                        yield ponto
+            else:
+                for freq in novas:
+                    await self._configuraFrequenciaUnica(ard, freq)
+                    await ard.iniciaEnsaio(regime=self.toleranciaRegime)
+                    captura = (freq, await ard.recebeValores(), await ard.recebeValores())
+                    capturas.append(captura)
+                    ponto = self._pontoAmostras(*captura)
+                    pontos.append(ponto)
+                    self._associaTempos([ponto], await ard.recebeTemposRegime(), tempos)
+                    yield ponto
+        
+        
 def main():
     ens = Ensaio()
     ens.Calibra(100.00)
@@ -0,0 +1,198 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_LOTE.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Calcula os parâmetros das curvas salvas por Ensaio.Salva (.npy) em lote,
+sem a interface, distribuindo os arquivos entre vários processos
+Um manifesto (hash e data de modificação de cada arquivo) faz com que
+uma nova execução processe apenas os arquivos novos ou alterados
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+from time import perf_counter
+
+import numpy as np
+
+import PARAF_PARAMETROS
+from PARAF_PARAMETROS import PARAMETROS
+
+# Intervalo entre as gravações do manifesto durante o processamento [s]
+INTERVALO_MANIFESTO = 5.0
+
+
+def listaArquivos(caminhos, extensoes=('.npy',)):
+    '''
+    Retorna os Arquivos com as Extensões Indicadas (.npy) dos Caminhos
+    (Diretórios Percorridos Recursivamente)
+    '''
+    arquivos = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            for raiz, diretorios, nomes in os.walk(caminho):
+                diretorios.sort()
+                arquivos.extend(os.path.join(raiz, nome) for nome in sorted(nomes) if nome.endswith(extensoes))
+        else:
+            arquivos.append(caminho)
+    return [os.path.abspath(arquivo) for arquivo in arquivos]
+
+
+def hashArquivo(caminho, tamanhoBloco=1 << 20):
+    resumo = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(tamanhoBloco), b''):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
+
+def _analisa(tarefa):
+    '''
+    Processo do Pool: calcula os parâmetros de um arquivo
+
+    Um arquivo com a data alterada mas com o mesmo conteúdo (hash) não é
+    carregado novamente (resultado None). Um arquivo que não pode ser lido
+    (removido, link quebrado, sem permissão) fica com um erro no manifesto
+    e é tentado de novo na próxima execução.
+    '''
+    caminho, hashAnterior = tarefa
+    try:
+        info = os.stat(caminho)
+        entrada = {'mtime': info.st_mtime_ns, 'tamanho': info.st_size, 'hash': hashArquivo(caminho)}
+    except OSError as exc:
+        entrada = {'mtime': None, 'tamanho': None, 'hash': None}
+        return caminho, entrada, {'status': None, 'erro': repr(exc)}
+    if entrada['hash'] == hashAnterior:
+        return caminho, entrada, None
+
+    try:
+        # Mesmo formato de Ensaio.Salva: (frequência, magnitude, fase)
+        impFreq, impMag, impFas = np.load(caminho)
+        parametros = PARAF_PARAMETROS.parametrosCurva(impFreq, impMag)
+    except Exception as exc:
+        return caminho, entrada, {'status': None, 'erro': repr(exc)}
+    parametros['erro'] = None
+    return caminho, entrada, parametros
+
+
+class Lote(object):
+    '''
+    Análise em Lote com Manifesto Incremental
+
+    O manifesto guarda, para cada arquivo, a data de modificação, o tamanho,
+    o hash e os parâmetros calculados. Arquivos com a mesma data e tamanho
+    não são lidos; com a data alterada são lidos apenas para o hash.
+    '''
+    def __init__(self, manifesto):
+        self.manifesto = manifesto
+        self.entradas = {}
+        if os.path.exists(manifesto):
+            with open(manifesto) as arquivo:
+                self.entradas = json.load(arquivo)
+
+    def salvaManifesto(self):
+        # Grava em um arquivo temporário para não corromper o manifesto
+        temporario = self.manifesto + '.tmp'
+        with open(temporario, 'w') as arquivo:
+            json.dump(self.entradas, arquivo, indent=1, sort_keys=True)
+        os.replace(temporario, self.manifesto)
+
+    def pendentes(self, arquivos):
+        '''
+        Retorna as Tarefas (arquivo, hash anterior) dos Arquivos Novos ou Alterados
+        (ou que não puderam ser lidos, cujo erro é registrado por _analisa)
+        '''
+        tarefas = []
+        for caminho in arquivos:
+            anterior = self.entradas.get(caminho)
+            try:
+                info = os.stat(caminho)
+            except OSError:
+                tarefas.append((caminho, None))
+                continue
+            if (anterior is not None and anterior['mtime'] == info.st_mtime_ns and
+                    anterior['tamanho'] == info.st_size):
+                continue
+            tarefas.append((caminho, anterior['hash'] if anterior is not None else None))
+        return tarefas
+
+    def executa(self, arquivos, processos=None, tamanhoLote=16):
+        '''
+        Processa os Arquivos Pendentes e Retorna (processados, reaproveitados)
+        '''
+        # Arquivos removidos saem do manifesto
+        existentes = set(arquivos)
+        for caminho in list(self.entradas):
+            if caminho not in existentes:
+                del self.entradas[caminho]
+
+        tarefas = self.pendentes(arquivos)
+        processados = 0
+        if tarefas:
+            ultimaGravacao = perf_counter()
+            with multiprocessing.Pool(processos) as pool:
+                for caminho, entrada, resultado in pool.imap_unordered(_analisa, tarefas, tamanhoLote):
+                    # Conteúdo igual: mantém os parâmetros calculados antes
+                    if resultado is None:
+                        resultado = self.entradas[caminho]['resultado']
+                    else:
+                        processados += 1
+                    entrada['resultado'] = resultado
+                    self.entradas[caminho] = entrada
+                    if perf_counter() - ultimaGravacao > INTERVALO_MANIFESTO:
+                        self.salvaManifesto()
+                        ultimaGravacao = perf_counter()
+        self.salvaManifesto()
+        return processados, len(arquivos) - processados
+
+    def salvaTabela(self, saida, arquivos):
+        '''
+        Grava a Tabela de Parâmetros (CSV) dos Arquivos
+        '''
+        with open(saida, 'w', newline='') as arquivo:
+            tabela = csv.writer(arquivo)
+            tabela.writerow(('arquivo', 'status', 'situacao') + PARAMETROS + ('erro',))
+            for caminho in arquivos:
+                resultado = self.entradas[caminho]['resultado']
+                status = resultado['status']
+                if status is None:
+                    tabela.writerow((caminho, '', 'erro') + ('',)*len(PARAMETROS) + (resultado['erro'],))
+                    continue
+                tabela.writerow((caminho, status, PARAF_PARAMETROS.DESCRICAO[status]) +
+                                tuple('' if status != PARAF_PARAMETROS.OK else resultado[nome]
+                                      for nome in PARAMETROS) + ('',))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='paraf-batch',
+                                     description='Calcula os parâmetros das curvas salvas (.npy) em lote')
+    parser.add_argument('caminhos', nargs='+', help='arquivos .npy ou diretórios (percorridos recursivamente)')
+    parser.add_argument('-o', '--saida', default='parametros.csv', help='tabela de parâmetros (CSV)')
+    parser.add_argument('--manifesto', help='manifesto dos arquivos processados (padrão: SAIDA.manifesto.json)')
+    parser.add_argument('-j', '--processos', type=int, help='processos (padrão: número de CPUs)')
+    args = parser.parse_args()
+
+    arquivos = listaArquivos(args.caminhos)
+    lote = Lote(args.manifesto or args.saida + '.manifesto.json')
+    inicio = perf_counter()
+    processados, reaproveitados = lote.executa(arquivos, args.processos)
+    lote.salvaTabela(args.saida, arquivos)
+    print("%d arquivos: %d processados, %d sem alteração (%.1f s) -> %s"
+          % (len(arquivos), processados, reaproveitados, perf_counter() - inicio, args.saida))
+
+
+if __name__ == "__main__":
+    main()
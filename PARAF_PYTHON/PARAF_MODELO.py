@@ -0,0 +1,123 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_MODELO.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Modelo analítico da impedância do alto-falante (RE, FS, RS, QMS, LE, RED)
+Avaliação vetorizada em uma grade logarítmica de frequências, com cache
+das curvas já calculadas e avaliação de vários conjuntos de parâmetros
+de uma vez (uma linha por conjunto)
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+from functools import lru_cache
+
+import numpy as np
+
+# Ordem dos parâmetros do modelo nas tuplas e nas linhas das matrizes
+PARAMETROS_MODELO = ('RE', 'FS', 'RS', 'QMS', 'LE', 'RED')
+# Curvas mantidas no cache
+TAMANHO_CACHE = 64
+
+
+def impedancia(freq, RE, FS, RS, QMS, LE, RED):
+    '''
+    Impedância Complexa do Modelo nas Frequências freq
+
+    Os argumentos seguem as regras de broadcast do NumPy: parâmetros com
+    forma (m, 1) e freq com forma (n,) resultam em uma matriz (m, n).
+    '''
+    ws = 2*np.pi*np.asarray(FS, dtype=float)
+    S = 2j*np.pi*np.asarray(freq, dtype=float)
+    # FS = 0 ou freq = 0 levam a divisões por zero (curva sem ressonância)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        impLin = RE + (np.subtract(RS, RE))/(1 + QMS*(S/ws + ws/S))
+    return np.add(RED, LE)*S + impLin
+
+
+def jacobiano(freq, RE, FS, RS, QMS, LE):
+    '''
+    Derivadas Analíticas da Impedância em Relação a (RE, FS, RS, QMS, LE)
+
+    Retorna uma matriz complexa (..., n, 5), com as mesmas regras de
+    broadcast de impedancia(). A derivada em relação a RED é igual à de LE
+    (o modelo só depende de LE + RED).
+    '''
+    ws = 2*np.pi*np.asarray(FS, dtype=float)
+    S = 2j*np.pi*np.asarray(freq, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = S/ws + ws/S
+        D = 1 + QMS*x
+        dRE = 1 - 1/D
+        dRS = 1/D
+        dQMS = -np.subtract(RS, RE)*x/D**2
+        dFS = -np.subtract(RS, RE)*QMS*2*np.pi*(1/S - S/ws**2)/D**2
+    return np.stack(np.broadcast_arrays(dRE, dFS, dRS, dQMS, S), axis=-1)
+
+
+@lru_cache(maxsize=TAMANHO_CACHE)
+def gradeLog(freqInicial, freqFinal, pontos):
+    '''
+    Grade de Frequências Logarítmica (Somente Leitura)
+    '''
+    freq = np.geomspace(freqInicial, freqFinal, int(pontos))
+    freq.flags.writeable = False
+    return freq
+
+
+def _magnitudeFase(imp):
+    return np.abs(imp), np.angle(imp, deg=True)
+
+
+@lru_cache(maxsize=TAMANHO_CACHE)
+def _curvaCache(parametros, freqInicial, freqFinal, pontos):
+    freq = gradeLog(freqInicial, freqFinal, pontos)
+    mag, fas = _magnitudeFase(impedancia(freq, *parametros))
+    mag.flags.writeable = False
+    fas.flags.writeable = False
+    return freq, mag, fas
+
+
+def curvaAnalitica(parametros, freqInicial=0.1, freqFinal=2000.0, pontos=2000):
+    '''
+    Retorna a Curva Analítica (freq, mag, fas) de um Conjunto de Parâmetros
+
+    parametros é uma sequência na ordem de PARAMETROS_MODELO. As curvas são
+    guardadas em um cache LRU indexado pelos parâmetros e pela grade, e os
+    vetores retornados são somente leitura.
+    '''
+    parametros = tuple(float(valor) for valor in parametros)
+    if len(parametros) != len(PARAMETROS_MODELO):
+        raise ValueError("O modelo tem %d parâmetros (%s)" % (len(PARAMETROS_MODELO), ', '.join(PARAMETROS_MODELO)))
+    return _curvaCache(parametros, float(freqInicial), float(freqFinal), int(pontos))
+
+
+def curvasAnaliticas(parametros, freq):
+    '''
+    Avalia Vários Conjuntos de Parâmetros de uma Vez
+
+    parametros é uma matriz (m, 6) na ordem de PARAMETROS_MODELO e freq um
+    vetor (n,). Retorna as matrizes (m, n) de magnitude e fase.
+    '''
+    parametros = np.atleast_2d(np.asarray(parametros, dtype=float))
+    if parametros.shape[-1] != len(PARAMETROS_MODELO):
+        raise ValueError("O modelo tem %d parâmetros (%s)" % (len(PARAMETROS_MODELO), ', '.join(PARAMETROS_MODELO)))
+    # Colunas (m, 1) contra a linha de frequências (n,)
+    colunas = [parametros[:, [i]] for i in range(len(PARAMETROS_MODELO))]
+    return _magnitudeFase(impedancia(np.asarray(freq, dtype=float), *colunas))
+
+
+def limpaCache():
+    '''
+    Descarta as Curvas e Grades Guardadas
+    '''
+    _curvaCache.cache_clear()
+    gradeLog.cache_clear()
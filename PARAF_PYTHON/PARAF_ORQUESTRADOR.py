@@ -0,0 +1,308 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_ORQUESTRADOR.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Distribui uma fila de ensaios entre várias placas Arduino Due
+Cada placa (bancada) é atendida por um processo próprio e os resultados
+(curvas e parâmetros) são reunidos no processo principal
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import queue
+from time import perf_counter
+
+from numpy import array, save
+
+import ProtocolPy
+from PARAF_PARAMETROS import PARAMETROS
+
+# Propriedades do Ensaio que podem ser definidas em cada trabalho
+PROPRIEDADES = ('freqInicial', 'freqFinal', 'passo', 'freqRelInicial', 'freqRelFinal',
+                'passoRel', 'fatorRegime', 'metodo', 'fatorCal')
+
+
+def descobrePlacas():
+    '''
+    Retorna as Portas Seriais das Placas Conectadas (VID/PID USB)
+    '''
+    return ProtocolPy.listaPlacas()
+
+
+def _bancada(porta, trabalhos, eventos, maxFalhas, diretorioMetricas=None):
+    '''
+    Processo de uma Bancada: executa os trabalhos da fila na placa da porta
+
+    Envia ao processo principal ('inicio', porta, trabalho) antes de cada
+    ensaio e ('ok', ...) ou ('falha', ...) depois. Após maxFalhas falhas
+    seguidas a bancada é retirada de serviço ('bancada', porta, erro).
+    Com diretorioMetricas, as métricas da bancada são gravadas após cada
+    trabalho em paraf_<porta>.prom (formato de texto do Prometheus).
+    '''
+    from PARAF_ENSAIO import Ensaio
+
+    # Sessão com a placa mantida entre os trabalhos
+    sessao = Ensaio()
+    sessao.porta = porta
+    falhas = 0
+
+    # Métricas de todos os trabalhos da bancada
+    metricas = ProtocolPy.Metricas() if diretorioMetricas else ProtocolPy.METRICAS_NULAS
+
+    def exportaMetricas():
+        if diretorioMetricas:
+            arquivo = 'paraf_%s.prom' % os.path.basename(porta)
+            metricas.salvaPrometheus(os.path.join(diretorioMetricas, arquivo), bancada=porta)
+
+    while True:
+        trabalho = trabalhos.get()
+        if trabalho is None:
+            sessao.desconecta()
+            return
+        eventos.put(('inicio', porta, trabalho))
+
+        ens = Ensaio()
+        ens.porta = porta
+        ens.ard = sessao.ard
+        ens.metricas = metricas
+        for nome, valor in trabalho['config'].items():
+            setattr(ens, nome, valor)
+
+        try:
+            ens.CapturaImpedancia()
+        except Exception as exc:
+            sessao.ard = ens.ard
+            falhas += 1
+            exportaMetricas()
+            eventos.put(('falha', porta, trabalho, repr(exc)))
+            if falhas >= maxFalhas:
+                eventos.put(('bancada', porta, repr(exc)))
+                return
+            continue
+        sessao.ard = ens.ard
+        falhas = 0
+
+        # Uma curva sem ressonância não é uma falha da bancada
+        try:
+            ens.CalculaParametros()
+            parametros = {nome: float(getattr(ens, nome)) for nome in PARAMETROS}
+        except Exception:
+            parametros = None
+        curva = (ens.impFreq, ens.impMag, ens.impFas)
+        exportaMetricas()
+        eventos.put(('ok', porta, trabalho, curva, parametros))
+
+
+class Orquestrador(object):
+    '''
+    Fila de Ensaios Distribuída entre as Bancadas
+
+    Cada trabalho é um alto-falante (identificação) e a configuração do
+    ensaio. Um trabalho que falha volta para a fila (possivelmente para outra
+    bancada) até maxTentativas. Uma bancada que falha maxFalhasBancada vezes
+    seguidas é retirada de serviço sem interromper as demais.
+    '''
+    def __init__(self, portas=None, maxTentativas=3, maxFalhasBancada=2, diretorioMetricas=None):
+        # Sem portas indicadas, utiliza as placas encontradas pelo VID/PID
+        self.portas = list(portas) if portas is not None else descobrePlacas()
+        self.maxTentativas = maxTentativas
+        self.maxFalhasBancada = maxFalhasBancada
+        # Diretório dos arquivos .prom das bancadas (None: sem métricas)
+        self.diretorioMetricas = diretorioMetricas
+
+        self.trabalhos = []
+        # Resultados por identificador do trabalho
+        self.resultados = {}
+        self.bancadasFora = {}
+
+    def adiciona(self, driver, **config):
+        '''
+        Adiciona um Ensaio à Fila e Retorna o Identificador do Trabalho
+        '''
+        for nome in config:
+            if nome not in PROPRIEDADES:
+                raise ValueError("Propriedade do ensaio desconhecida: %s" % nome)
+        trabalho = {'id': len(self.trabalhos), 'driver': driver, 'config': config, 'tentativa': 1}
+        self.trabalhos.append(trabalho)
+        return trabalho['id']
+
+    def _resultado(self, trabalho, porta, curva=None, parametros=None, erro=None):
+        impFreq, impMag, impFas = curva if curva is not None else (None, None, None)
+        self.resultados[trabalho['id']] = {
+            'driver': trabalho['driver'],
+            'config': trabalho['config'],
+            'porta': porta,
+            'tentativas': trabalho['tentativa'],
+            'impFreq': impFreq,
+            'impMag': impMag,
+            'impFas': impFas,
+            'parametros': parametros,
+            'erro': erro,
+        }
+
+    def executa(self, intervalo=0.5):
+        '''
+        Executa os Trabalhos em Paralelo, um Processo por Bancada
+        '''
+        if not self.portas:
+            raise RuntimeError("Nenhuma placa encontrada")
+
+        fila = multiprocessing.Queue()
+        eventos = multiprocessing.Queue()
+        for trabalho in self.trabalhos:
+            fila.put(trabalho)
+
+        if self.diretorioMetricas:
+            os.makedirs(self.diretorioMetricas, exist_ok=True)
+        processos = {}
+        for porta in self.portas:
+            processo = multiprocessing.Process(target=_bancada, daemon=True,
+                                               args=(porta, fila, eventos, self.maxFalhasBancada,
+                                                     self.diretorioMetricas))
+            processo.start()
+            processos[porta] = processo
+
+        # Trabalho em execução em cada bancada
+        emAndamento = {}
+        pendentes = len(self.trabalhos)
+
+        def repete(trabalho, porta, erro):
+            # Devolve o trabalho à fila ou registra a falha definitiva
+            nonlocal pendentes
+            if trabalho['tentativa'] < self.maxTentativas:
+                trabalho = dict(trabalho, tentativa=trabalho['tentativa'] + 1)
+                fila.put(trabalho)
+            else:
+                self._resultado(trabalho, porta, erro=erro)
+                pendentes -= 1
+
+        while pendentes > 0:
+            try:
+                evento = eventos.get(timeout=intervalo)
+            except queue.Empty:
+                evento = None
+
+            if evento is not None:
+                tipo, porta = evento[0], evento[1]
+                if tipo == 'inicio':
+                    emAndamento[porta] = evento[2]
+                elif tipo == 'ok':
+                    emAndamento.pop(porta, None)
+                    self._resultado(evento[2], porta, evento[3], evento[4])
+                    pendentes -= 1
+                    print("%s: %s concluído" % (porta, evento[2]['driver']))
+                elif tipo == 'falha':
+                    emAndamento.pop(porta, None)
+                    print("%s: falha em %s: %s" % (porta, evento[2]['driver'], evento[3]))
+                    repete(evento[2], porta, evento[3])
+                elif tipo == 'bancada':
+                    self.bancadasFora[porta] = evento[2]
+                    print("%s: bancada retirada de serviço" % porta)
+                continue
+
+            # Bancadas encerradas de forma inesperada: devolve o trabalho em execução
+            for porta, processo in processos.items():
+                if not processo.is_alive() and porta not in self.bancadasFora:
+                    self.bancadasFora[porta] = "processo encerrado (código %s)" % processo.exitcode
+                    if porta in emAndamento:
+                        repete(emAndamento.pop(porta), porta, self.bancadasFora[porta])
+
+            # Sem bancadas em serviço: os trabalhos restantes falham
+            if all(not processo.is_alive() for processo in processos.values()):
+                while True:
+                    try:
+                        trabalho = fila.get(timeout=intervalo)
+                    except queue.Empty:
+                        break
+                    self._resultado(trabalho, None, erro="nenhuma bancada em serviço")
+                    pendentes -= 1
+                break
+
+        # Encerra as bancadas
+        for _ in processos:
+            fila.put(None)
+        for processo in processos.values():
+            processo.join(intervalo)
+            if processo.is_alive():
+                processo.terminate()
+        return self.resultados
+
+    def salva(self, diretorio):
+        '''
+        Salva as Curvas (driver_id.npy) e a Tabela de Parâmetros (parametros.csv)
+        '''
+        os.makedirs(diretorio, exist_ok=True)
+        with open(os.path.join(diretorio, 'parametros.csv'), 'w', newline='') as arquivo:
+            tabela = csv.writer(arquivo)
+            tabela.writerow(('id', 'driver', 'porta', 'tentativas', 'erro') + PARAMETROS)
+            for idTrabalho, resultado in sorted(self.resultados.items()):
+                parametros = resultado['parametros'] or {}
+                tabela.writerow((idTrabalho, resultado['driver'], resultado['porta'],
+                                 resultado['tentativas'], resultado['erro'] or '') +
+                                tuple(parametros.get(nome, '') for nome in PARAMETROS))
+                if resultado['impFreq'] is not None:
+                    curva = array([resultado['impFreq'], resultado['impMag'], resultado['impFas']])
+                    nome = '%s_%d.npy' % (resultado['driver'], idTrabalho)
+                    # Mesmo formato de Ensaio.Salva
+                    save(os.path.join(diretorio, nome), curva)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ensaios em paralelo em várias placas')
+    parser.add_argument('drivers', nargs='*', help='identificação dos alto-falantes a ensaiar')
+    parser.add_argument('--trabalhos', help='arquivo JSON com a lista de trabalhos '
+                        '({"driver": ..., propriedades do ensaio})')
+    parser.add_argument('--portas', nargs='+', help='portas das placas (padrão: placas Arduino Due conectadas)')
+    parser.add_argument('--tentativas', type=int, default=3, help='tentativas por trabalho')
+    parser.add_argument('--falhas-bancada', type=int, default=2,
+                        help='falhas seguidas que retiram uma bancada de serviço')
+    parser.add_argument('--saida', help='diretório para as curvas e a tabela de parâmetros')
+    parser.add_argument('--metricas', metavar='DIR',
+                        help='diretório dos arquivos .prom de cada bancada (coletor de arquivos '
+                        'de texto do node_exporter)')
+    args = parser.parse_args()
+
+    orquestrador = Orquestrador(args.portas, args.tentativas, args.falhas_bancada, args.metricas)
+    for driver in args.drivers:
+        orquestrador.adiciona(driver)
+    if args.trabalhos:
+        with open(args.trabalhos) as arquivo:
+            for trabalho in json.load(arquivo):
+                trabalho = dict(trabalho)
+                orquestrador.adiciona(str(trabalho.pop('driver')), **trabalho)
+
+    print("%d trabalhos em %d bancadas: %s" % (len(orquestrador.trabalhos), len(orquestrador.portas),
+                                               ', '.join(orquestrador.portas)))
+    inicio = perf_counter()
+    resultados = orquestrador.executa()
+    duracao = perf_counter() - inicio
+
+    for idTrabalho, resultado in sorted(resultados.items()):
+        parametros = resultado['parametros']
+        if parametros is not None:
+            print("%-12s %s  " % (resultado['driver'], resultado['porta']) +
+                  "  ".join("%s=%.3f" % (nome, parametros[nome]) for nome in PARAMETROS))
+        else:
+            print("%-12s %s  %s" % (resultado['driver'], resultado['porta'],
+                                    resultado['erro'] or 'parâmetros não calculados'))
+    print("%d trabalhos em %.1f s" % (len(resultados), duracao))
+
+    if args.saida:
+        orquestrador.salva(args.saida)
+
+
+if __name__ == "__main__":
+    main()
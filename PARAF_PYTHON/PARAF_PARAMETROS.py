@@ -0,0 +1,157 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: PARAF_PARAMETROS.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Extração vetorizada dos parâmetros do alto-falante (RE, FS, RS, QMS, QES, QTS)
+a partir de uma curva de impedância ou de um conjunto de curvas
+Cada curva recebe um código de situação em vez de gerar uma exceção
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# Parâmetros extraídos de cada curva
+PARAMETROS = ('RE', 'FS', 'RS', 'QMS', 'QES', 'QTS')
+
+# Situação da extração de cada curva
+OK = 0
+SEM_PICO = 1        # Nenhum máximo da magnitude com k pontos menores de cada lado
+SEM_F1 = 2          # A magnitude não ultrapassa Z12 antes do fim da curva
+SEM_F2 = 3          # A magnitude não volta abaixo de Z12 após a ressonância
+INVALIDO = 4        # Valores não finitos ou RS <= RE
+DESCRICAO = {
+    OK: 'ok',
+    SEM_PICO: 'ressonância não encontrada',
+    SEM_F1: 'primeira frequência de Z12 não encontrada',
+    SEM_F2: 'segunda frequência de Z12 não encontrada',
+    INVALIDO: 'parâmetros inválidos',
+}
+
+
+def _empilha(freq, mag):
+    # Curvas (m, n) completadas com NaN e o número de pontos de cada uma
+    if isinstance(mag, np.ndarray) and mag.ndim == 2:
+        mag = mag.astype(float)
+        freq = np.asarray(freq, dtype=float)
+        freq = np.broadcast_to(freq, mag.shape) if freq.ndim == 1 else freq
+        return freq, mag, np.full(mag.shape[0], mag.shape[1])
+
+    # Grade irregular: listas de curvas com tamanhos diferentes
+    if not isinstance(freq, (list, tuple)) or np.ndim(freq[0]) == 0:
+        freq = [freq]*len(mag)
+    tamanhos = np.array([len(curva) for curva in mag])
+    n = tamanhos.max() if len(tamanhos) else 0
+    freqs = np.full((len(mag), n), np.nan)
+    mags = np.full((len(mag), n), np.nan)
+    for i, (f, m) in enumerate(zip(freq, mag)):
+        freqs[i, :len(m)] = f[:len(m)]
+        mags[i, :len(m)] = m
+    return freqs, mags, tamanhos
+
+
+def _interpola(freq, mag, linhas, iA, iB, z12):
+    # Frequência em que a reta entre os pontos iA e iB passa por z12
+    fA, fB = freq[linhas, iA], freq[linhas, iB]
+    mA, mB = mag[linhas, iA], mag[linhas, iB]
+    t = (z12 - mA)/(mB - mA)
+    return fA*(1 - t) + fB*t
+
+
+def extraiParametros(freq, mag, k=7):
+    '''
+    Extrai os Parâmetros de um Conjunto de Curvas
+
+    mag é uma matriz (m, n) com uma curva por linha e freq a grade comum (n,)
+    ou uma matriz (m, n). Para curvas de tamanhos diferentes, freq e mag são
+    listas de vetores (ou freq um vetor comum a todas).
+
+    Retorna um dicionário com um vetor (m,) para cada parâmetro e o vetor
+    'status' com a situação de cada curva (OK, SEM_PICO, ...). Os parâmetros
+    das curvas com falha são NaN.
+    '''
+    freq, mag, tamanhos = _empilha(freq, mag)
+    m, n = mag.shape
+    linhas = np.arange(m)
+    colunas = np.arange(n)
+    status = np.full(m, OK)
+    
+    # Curvas curtas demais para conter um pico
+    if n <= 2*k:
+        resultado = {nome: np.full(m, np.nan) for nome in PARAMETROS}
+        resultado['status'] = np.full(m, SEM_PICO)
+        return resultado
+
+    # Ressonância: primeiro ponto maior que os k - 1 vizinhos de cada lado,
+    # a pelo menos k pontos das extremidades (NaN nunca é maior)
+    topo = np.zeros((m, n), dtype=bool)
+    topo[:, k:n - k] = True
+    centro = mag[:, k:n - k]
+    with np.errstate(invalid='ignore'):
+        for ki in range(1, k):
+            topo[:, k:n - k] &= (centro > mag[:, k - ki:n - k - ki]) & (centro > mag[:, k + ki:n - k + ki])
+    topo &= colunas < (tamanhos - k)[:, None]
+    temPico = topo.any(axis=1)
+    status[~temPico] = SEM_PICO
+    # Curvas sem pico usam um índice qualquer e são descartadas no fim
+    iS = np.where(temPico, topo.argmax(axis=1), 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Interpolação parabólica da frequência e da impedância na ressonância
+        A, B, C = freq[linhas, iS - 1], freq[linhas, iS], freq[linhas, iS + 1]
+        fA, fB, fC = mag[linhas, iS - 1], mag[linhas, iS], mag[linhas, iS + 1]
+        FS = B + (1/2)*((fA - fB)*(C - B)**2 - (fC - fB)*(B - A)**2)/((fA - fB)*(C - B) + (fC - fB)*(B - A))
+        RS = (fA*((FS - B)*(FS - C))/((A - B)*(A - C)) +
+              fB*((FS - C)*(FS - A))/((B - C)*(B - A)) +
+              fC*((FS - A)*(FS - B))/((C - A)*(C - B)))
+
+        # Resistência CC e impedância Z12
+        RE = np.nanmin(mag, axis=1)
+        z12 = np.sqrt(RE*RS)
+
+        # Primeira frequência: primeiro ponto acima de Z12 (entre 1 e n - 2)
+        busca = (colunas >= 1) & (colunas < (tamanhos - 1)[:, None])
+        acima = busca & (mag > z12[:, None])
+        achouF1 = acima.any(axis=1)
+        iB = np.where(achouF1, acima.argmax(axis=1), 1)
+        F1 = _interpola(freq, mag, linhas, iB - 1, iB, z12)
+
+        # Segunda frequência: primeiro ponto abaixo de Z12 após a ressonância
+        abaixo = busca & (colunas >= iS[:, None]) & (mag < z12[:, None])
+        achouF2 = abaixo.any(axis=1)
+        iB = np.where(achouF2, abaixo.argmax(axis=1), 1)
+        F2 = _interpola(freq, mag, linhas, iB - 1, iB, z12)
+
+        QMS = (FS/(F2 - F1))*np.sqrt(RS/RE)
+        QES = QMS/(RS/RE - 1)
+        QTS = QMS*(RE/RS)
+
+    status[(status == OK) & ~achouF1] = SEM_F1
+    status[(status == OK) & ~achouF2] = SEM_F2
+    resultado = {'RE': RE, 'FS': FS, 'RS': RS, 'QMS': QMS, 'QES': QES, 'QTS': QTS}
+    finitos = np.logical_and.reduce([np.isfinite(valores) for valores in resultado.values()])
+    status[(status == OK) & (~finitos | (RS <= RE))] = INVALIDO
+    for valores in resultado.values():
+        valores[status != OK] = np.nan
+    resultado['status'] = status
+    return resultado
+
+
+def parametrosCurva(freq, mag, k=7):
+    '''
+    Extrai os Parâmetros de uma Curva
+
+    Retorna um dicionário com os parâmetros (float) e o 'status' (int).
+    '''
+    resultado = extraiParametros(np.asarray(freq, dtype=float), np.asarray(mag, dtype=float)[None, :], k)
+    parametros = {nome: float(resultado[nome][0]) for nome in PARAMETROS}
+    parametros['status'] = int(resultado['status'][0])
+    return parametros
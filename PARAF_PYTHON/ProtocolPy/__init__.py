@@ -18,11 +18,65 @@ Implementado no Computador em Python 3.6
 
 import serial
 import serial.tools as tools
-from time import sleep
+from serial.tools import list_ports
+from time import sleep, perf_counter
 from sys import byteorder
 from decimal import *
 import struct
 
+import numpy as np
+
+from .quadros import AnalisadorQuadros, RecepcaoBlocos, RecepcaoPontos, REENVIA_FIM, compoeFloats, codificaPacote
+from .metricas import Metricas, MetricasNulas, METRICAS_NULAS
+
+
+# USB VID/PID do Arduino Due (porta nativa e porta de programação)
+VID_ARDUINO = 0x2341
+PID_DUE = (0x003E, 0x003D)
+
+
+def listaPlacas():
+    '''
+    Retorna as Portas Seriais das Placas Arduino Due Conectadas (VID/PID USB)
+    '''
+    return [info.device for info in sorted(list_ports.comports())
+            if info.vid == VID_ARDUINO and info.pid in PID_DUE]
+
+
+def contaPontos(freqInicial, freqFinal, passo, freqRelInicial, freqRelFinal, passoRel):
+    '''
+    Número de Frequências de uma Varredura (como Ensaio::atualizaEnsaio)
+    Retorna None se os passos não avançam a frequência
+    '''
+    if passo == 0 or freqInicial == freqFinal:
+        return 1
+    if passo <= 1 or passoRel <= 1:
+        return None
+    # A placa trabalha com float de 32 bits
+    passo, passoRel = np.float32(passo), np.float32(passoRel)
+    freq = np.float32(freqInicial)
+    pontos = 0
+    while freq <= freqFinal:
+        pontos += 1
+        if freqRelInicial < freq < freqRelFinal:
+            freq = freq*passoRel
+        else:
+            freq = freq*passo
+    return pontos
+
+
+class TempoEsgotado(serial.SerialTimeoutException):
+    '''
+    A Placa Não Respondeu Dentro do Prazo
+    '''
+
+
+class EnsaioCancelado(Exception):
+    '''
+    A Captura foi Cancelada pelo Computador (Proto.cancela)
+    '''
+
+
 class Proto(object):
     '''
     Protocolo de comunicação Serial
@@ -53,6 +107,29 @@ class Proto(object):
 
     inicia_ensaio       =   0x41 # A   - Inicia o ensaio
 
+    modo_bloco          =   0x42 # B   - Negocia a transferência em blocos (tamanho do bloco, janela)
+    bloco_dados         =   0x62 # b   - Bloco de valores
+    bloco_conf          =   0x6B # k   - Bloco recebido com sucesso
+    bloco_reenv         =   0x72 # r   - Pede o reenvio de um bloco
+    
+    modo_continuo       =   0x43 # C   - Envia cada ponto do próximo ensaio assim que é calculado
+    reenvia_ponto       =   0x44 # D   - Pede o reenvio de um ponto (0xFFFF = fim do ensaio)
+    ponto_dados         =   0x70 # p   - Ponto do ensaio (índice, frequência, magnitude, fase)
+    fim_pontos          =   0x66 # f   - Fim do ensaio contínuo (número de pontos)
+
+    identifica          =   0x56 # V   - Identifica a placa (versão, capacidades e número de série)
+    cap_blocos          =   0x0001 #   - Capacidade: transferência em blocos
+    cap_continuo        =   0x0002 #   - Capacidade: ensaio contínuo
+    configura_ensaio    =   0x58 # X   - Configura o ensaio em um pacote (frequências, passos, fator de regime e método)
+    cap_configuracao    =   0x0004 #   - Capacidade: configuração em um pacote
+    modo_bruto          =   0x57 # W   - Envia as amostras de cada frequência do próximo ensaio (sem calcular a impedância)
+    cap_bruto           =   0x0008 #   - Capacidade: envio das amostras
+    lista_frequencias   =   0x59 # Y   - Frequências do próximo ensaio em um pacote (número e frequências)
+    cap_lista           =   0x0010 #   - Capacidade: lista de frequências
+    modo_regime         =   0x45 # E   - Regime permanente adaptativo no próximo ensaio (tolerância em 0.01 %)
+    tempos_regime       =   0x65 # e   - Pede os tempos até o regime permanente do último ensaio
+    cap_regime          =   0x0020 #   - Capacidade: regime adaptativo e tempos de regime
+
     size                =   0x73 # s   - Tamanho do pacote
     byte_LS             =   0x61 # a   - Byte menos significativo
     byte_MS             =   0x7A # z   - Byte mais significativo
@@ -61,90 +138,216 @@ class Proto(object):
     rec_falha           =   0x6E # n   - Falha no recebimento do valor
     esc                 =   0x1B # ESC - Valor de escape que interrompe um envio
 
-    # Porta serial
-    ser = serial.Serial()
-    serialDelay = 0.0  
+    # Prazos da comunicação [s]: escrita na porta, intervalo entre os bytes de
+    # uma resposta e margem da espera pelos resultados do ensaio, somada à
+    # duração da varredura configurada (None = sem limite)
+    prazoEscrita = 1.0
+    prazoResposta = 2.0
+    prazoEnsaio = 600.0
+    # Captura das amostras de cada ponto (AMOSTRAS_CAPTURADAS/TX_AMOSTRAGEM) [s]
+    duracaoCaptura = 4*1024/(10500000/238)
+    # Tempo máximo de cada leitura bloqueante da porta [s]
+    intervaloLeitura = 0.05
+    _aguardandoEnsaio = False
+    
+    # Transferência em blocos: valores por bloco, blocos sem confirmação
+    # e tempo de espera pela resposta de placas antigas [s]
+    tamanhoBloco = 64
+    janelaBloco = 8
+    timeoutNegociacao = 0.25
+    # Envios do pacote de configuração sem confirmação antes de desistir
+    tentativasConfiguracao = 3
+    # Frequências por pacote da lista (Protocolo::LISTA_MAX)
+    tamanhoLista = 32
+    # Intervalo sem pontos após o qual o fim do ensaio contínuo é pedido [s]
+    timeoutPonto = 1.0
+    _cancelado = False
+    # Métricas da comunicação (uma instância de Metricas passa a registrar)
+    metricas = METRICAS_NULAS
       
 
-    def __init__(self):
-        # Configura a porta serial
-        portNum = 0
+    def __init__(self, porta=None, modoBloco=True):
+        # Porta serial própria (uma instância por placa)
+        self.ser = serial.Serial()
         self.ser.baudrate = 230400        
-         
+        # Leituras e escritas bloqueantes (sem espera ativa)
+        self.ser.timeout = self.intervaloLeitura
+        self.ser.write_timeout = self.prazoEscrita
+        self.porta = porta
+        self._modoBlocoPedido = modoBloco
+        
+        # Analisador das mensagens recebidas
+        self.analisador = AnalisadorQuadros()
+        self._ultimaTransferencia = None
+        self.modoBloco = False
+        self.modoContinuo = False
+        self._suportaContinuo = False
+        self.modoBruto = False
+        self.modoRegime = False
+        self.identificacao = None
+        # Última configuração do ensaio confirmada pela placa
+        self._configuracao = None
+        # Pontos e fator de regime configurados (duração da varredura)
+        self._pontosVarredura = None
+        self._pontosLista = None
+        self._fatorRegime = 0.0
+        self._prazoVarredura = self.prazoEnsaio
+        # Bytes recebidos desde a criação (progresso das capturas)
+        self.bytesRecebidos = 0
+        
         # Abre a porta serial
-        while not self.ser.isOpen():
+        self.abre()
+        
+    def _candidatas(self, serie=None):
+        # Porta indicada (ex.: emulador) ou placas encontradas pelo VID/PID;
+        # outros dispositivos seriais não são abertos (só com a porta indicada)
+        if self.porta is not None:
+            return [(self.porta, True)]
+        return [(porta, serie is None) for porta in listaPlacas()]
+    
+    def _aceita(self, conhecida, serie):
+        # Verifica a identificação da placa recém aberta
+        if self.identificacao is None:
+            return conhecida
+        return serie is None or self.identificacao['serie'] == serie
+        
+    def abre(self, serie=None):
+        '''
+        Abre a Porta Serial e Inicia a Sessão com a Placa
+        Com serie, aceita apenas a placa com este número de série
+        '''
+        erro = None
+        for porta, conhecida in self._candidatas(serie):
             try:
-                self.ser.port = '/dev/ttyACM' + str(portNum)
+                self.ser.port = porta
                 self.ser.open()
-            except serial.serialutil.SerialException as exc:
+                sleep(0.02)
+                self._iniciaSessao()
+            except serial.SerialException as exc:
                 print("Erro Serial: %s"%(exc))
-                portNum += 1
-                self.ser.is_open = 0
-                if portNum <= 10:
-                    pass
-                else:
-                    print("Não foi possível abrir a porta Serial: %s"%(exc))
-                    raise
-                           
-        sleep(0.02)
+                erro = exc
+                self.fecha()
+                continue
+            if self._aceita(conhecida, serie):
+                print("Porta serial %s aberta." %(self.ser.port))
+                return
+            self.fecha()
         
-        print("Porta serial %s aberta." %(self.ser.port))
-       
+        if erro is not None:
+            print("Não foi possível abrir a porta Serial: %s"%(erro))
+            raise erro
+        raise serial.SerialException("Nenhuma placa encontrada")
+        
+    def _iniciaSessao(self):
         # Limpa o buffer
-        while(self.ser.in_waiting > 0): self.ser.read(1)
-        while(self.ser.out_waiting > 0): sleep(self.serialDelay)
+        self._limpaRecepcao()
         
         # Envia o código de escape
-        self.ser.write(bytes([self.esc]))
-        self.ser.flush()
-        while(self.ser.out_waiting > 0): sleep(self.serialDelay)
+        self._escreve(bytes([self.esc]))
         
-    def _enviaComando(self, comando):        
-        # Cria a mensagem
-        mensagem = bytearray([self.mens_inicio,
-                              comando,
-                              comando,
-                              comando,
-                              self.mens_final])
-        # Envia a mensagem
-        self.ser.write(mensagem)
-        self.ser.flush()
-        while(self.ser.out_waiting > 0): sleep(self.serialDelay)
+        # Placas que não se identificam têm o firmware original
+        self.identificaPlaca()
+        if self._capacidades(self.cap_blocos) and self._modoBlocoPedido:
+            self.negociaModoBloco(self.tamanhoBloco, self.janelaBloco)
         
-    def _setaValor(self, valor, codigoInt, codigoDec=None):
+    def _capacidades(self, capacidade):
+        # Verifica se a placa identificada suporta a capacidade
+        return self.identificacao is not None and bool(self.identificacao['capacidades'] & capacidade)
+        
+    def _interpretaIdentificacao(self, dados):
+        versao, capacidades = struct.unpack_from('<BH', dados)
+        return {'versao': versao, 'capacidades': capacidades, 'serie': dados[3:19].hex()}
+        
+    def _zeraSessao(self):
+        # Estado negociado com a placa
+        self._limpaRecepcao()
+        self.identificacao = None
+        self.modoBloco = False
+        self.analisador.modoBloco = False
+        self.modoContinuo = False
+        self._suportaContinuo = False
+        self.modoBruto = False
+        self.modoRegime = False
+        self._ultimaTransferencia = None
+        self._configuracao = None
+        
+    def fecha(self):
+        '''
+        Fecha a Porta Serial
+        '''
+        if self.ser.is_open:
+            try:
+                self._limpaRecepcao()
+                self.ser.close()
+            except Exception:
+                # Placa já desconectada
+                self.ser.fd = None
+                self.ser.is_open = False
+            
+    def reconecta(self, tentativas=5, intervalo=1.0):
+        '''
+        Reabre a Sessão com a Mesma Placa (ex.: após reiniciar ou desconectar)
+        '''
+        serie = self.identificacao['serie'] if self.identificacao is not None else None
+        self.fecha()
+        self.metricas.conta('reconexoes')
+        for tentativa in range(tentativas):
+            try:
+                self.abre(serie)
+                return
+            except serial.SerialException:
+                if tentativa == tentativas - 1:
+                    raise
+                sleep(intervalo)
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.fecha()
+        
+    def _escreve(self, dados):
+        # Escreve e aguarda a transmissão (no máximo prazoEscrita)
+        try:
+            self.ser.write(dados)
+            self.ser.flush()
+        except serial.SerialTimeoutException as exc:
+            raise TempoEsgotado("Escrita na porta %s não concluída em %g s"
+                                % (self.ser.port, self.prazoEscrita)) from exc
+        self.metricas.conta('bytes_enviados', len(dados))
+        
+    def _compoeMensagem(self, codigo, valor1, valor2):
+        # Mensagem de 5 bytes: ! código valor1 valor2 #
+        return bytearray([self.mens_inicio,
+                          codigo,
+                          valor1,
+                          valor2,
+                          self.mens_final])
+        
+    def _compoeValor(self, valor, codigoInt, codigoDec=None):
         valorInt, valorDec = divmod(valor, 1)      
        
         # Compõe a mensagem da parte inteira
         valorInt_LSB = (int(valorInt) & 0x00FF)
         valorInt_MSB = (int(valorInt) & 0xFF00) >> 8   
-        mensagem = bytearray([self.mens_inicio,
-                              codigoInt,
-                              valorInt_LSB,
-                              valorInt_MSB,
-                              self.mens_final])
-        
-        # Envia a mensagem da parte inteira
-        self.ser.write(mensagem)
-        self.ser.flush()
-        while(self.ser.out_waiting > 0):
-            sleep(self.serialDelay)
+        mensagem = self._compoeMensagem(codigoInt, valorInt_LSB, valorInt_MSB)
         
         if codigoDec is not None:
             # Compõe a mensagem da parte decimal
             valorDec = int(valorDec*65536)
             valorDec_LSB = (valorDec & 0x00FF)
             valorDec_MSB = (valorDec & 0xFF00) >> 8
-            mensagem = bytearray([self.mens_inicio,
-                                  codigoDec,
-                                  valorDec_LSB,
-                                  valorDec_MSB,
-                                  self.mens_final])
-            
-            # Envia a mensagem da parte decimal
-            self.ser.write(mensagem)
-            self.ser.flush()
-            while(self.ser.out_waiting > 0):
-                sleep(self.serialDelay)          
+            mensagem += self._compoeMensagem(codigoDec, valorDec_LSB, valorDec_MSB)
+        return mensagem
+        
+    def _enviaComando(self, comando):        
+        # Envia a mensagem
+        self._escreve(self._compoeMensagem(comando, comando, comando))
+        
+    def _setaValor(self, valor, codigoInt, codigoDec=None):
+        # Envia as mensagens da parte inteira e da parte decimal
+        self._configuracao = None
+        self._escreve(self._compoeValor(valor, codigoInt, codigoDec))
         
     def setaFrequenciaInicial(self, frequencia):
         self._setaValor(frequencia, self.setFreqIniInt, self.setFreqIniDec)
@@ -168,157 +371,489 @@ class Proto(object):
         self.setaFrequenciaInicial(frequencia)
         self.setaFrequenciaFinal(frequencia)
         self.setaPasso(0.0)  
+        self._pontosVarredura = 1
         
     def setaFatorRegime(self, fator):
         self._setaValor(fator, self.setFatorRegimeInt, self.setFatorRegimeDec)
+        self._fatorRegime = fator
         
     def setaMetodoImpedancia(self, metodo):
+        self._configuracao = None
         if metodo == 'SWF' or metodo == 0:
             self._enviaComando(self.setMetodoSWF)
         elif metodo == 'ZC' or metodo ==1:
             self._enviaComando(self.setMetodoZC)
+            
+    def _compoeConfiguracao(self, freqInicial, freqFinal, passo, freqRelInicial, freqRelFinal,
+                            passoRel, fatorRegime, metodo):
+        # Dados do pacote de configuração: 7 float32 e o método
+        if metodo == 'SWF' or metodo == 0:
+            metodoImp = 0
+        elif metodo == 'ZC' or metodo == 1:
+            metodoImp = 1
+        else:
+            raise ValueError("Método de cálculo da impedância desconhecido: %s" % metodo)
+        return struct.pack('<7fB', freqInicial, freqFinal, passo, freqRelInicial, freqRelFinal,
+                           passoRel, fatorRegime, metodoImp)
         
-    def iniciaEnsaio(self):
-        # Limpa o buffer
-        while(self.ser.in_waiting > 0):
-            self.ser.read(1)
-        while(self.ser.out_waiting > 0):
-            sleep(self.serialDelay)  
+    def configuraEnsaio(self, freqInicial, freqFinal, passo, freqRelInicial, freqRelFinal,
+                        passoRel, fatorRegime, metodo):
+        '''
+        Envia a Configuração do Ensaio em um Único Pacote Confirmado pela Placa
+        Uma configuração igual à última confirmada não é reenviada. Placas sem
+        o pacote de configuração recebem os comandos individuais.
+        '''
+        dados = self._compoeConfiguracao(freqInicial, freqFinal, passo, freqRelInicial, freqRelFinal,
+                                         passoRel, fatorRegime, metodo)
+        self._pontosVarredura = contaPontos(freqInicial, freqFinal, passo, freqRelInicial,
+                                            freqRelFinal, passoRel)
+        self._fatorRegime = fatorRegime
+        if dados == self._configuracao:
+            return
+        
+        with self.metricas.etapa('configuracao'):
+            if not self._capacidades(self.cap_configuracao):
+                self.setaFrequenciaInicial(freqInicial)
+                self.setaFrequenciaFinal(freqFinal)
+                self.setaPasso(passo)
+                self.setaFrequenciaRelInicial(freqRelInicial)
+                self.setaFrequenciaRelFinal(freqRelFinal)
+                self.setaPassoRel(passoRel)
+                self.setaFatorRegime(fatorRegime)
+                self.setaMetodoImpedancia(metodo)
+                return
+        
+            if not self._enviaPacote(self.configura_ensaio, dados):
+                raise TempoEsgotado("A placa não confirmou a configuração do ensaio")
+            self._configuracao = dados
+        
+    def _compoeTolerancia(self, regime):
+        # Tolerância do regime adaptativo em 0.01 % (16 bits, valor1 = LSB)
+        tolerancia = min(max(int(round(regime*10000)), 1), 0xFFFF)
+        return tolerancia & 0xFF, tolerancia >> 8
+        
+    def recebeTemposRegime(self):
+        '''
+        Recebe o Tempo até o Regime Permanente de Cada Ponto do Último Ensaio [s]
+        Na ordem em que os pontos foram medidos; None se a placa não informa
+        '''
+        if not self._capacidades(self.cap_regime):
+            return None
+        self._limpaRecepcao()
+        self._enviaComando(self.tempos_regime)
+        return self.recebeValores()/1000.0
+        
+    def suportaLista(self):
+        '''
+        Verifica se a Placa Aceita a Lista de Frequências (configuraLista)
+        '''
+        return self._capacidades(self.cap_lista)
+        
+    def configuraLista(self, frequencias):
+        '''
+        Envia as Frequências Medidas no Próximo Ensaio, na Ordem Dada
+        A lista substitui a varredura configurada apenas no próximo ensaio
+        e tem no máximo tamanhoLista frequências.
+        '''
+        dados = self._compoeLista(frequencias)
+        with self.metricas.etapa('configuracao'):
+            if not self._enviaPacote(self.lista_frequencias, dados):
+                raise TempoEsgotado("A placa não confirmou a lista de frequências")
+        self._pontosLista = len(frequencias)
+        
+    def _calculaPrazoEnsaio(self):
+        # Margem (prazoEnsaio) mais a espera do regime e a captura de cada
+        # ponto do próximo ensaio; sem limite se prazoEnsaio é None
+        pontos = self._pontosLista if self._pontosLista else self._pontosVarredura
+        self._pontosLista = None
+        if self.prazoEnsaio is None or not pontos:
+            return self.prazoEnsaio
+        return self.prazoEnsaio + pontos*(max(float(self._fatorRegime), 0.0) + self.duracaoCaptura)
+        
+    def _compoeLista(self, frequencias):
+        # Dados do pacote da lista: número de frequências e as frequências (float32)
+        if not self.suportaLista():
+            raise ValueError("A placa não aceita a lista de frequências")
+        if not 0 < len(frequencias) <= self.tamanhoLista:
+            raise ValueError("A lista deve ter de 1 a %d frequências" % self.tamanhoLista)
+        return struct.pack('<B%df' % len(frequencias), len(frequencias), *frequencias)
+        
+    def _enviaPacote(self, codigo, dados):
+        # Reenvia o pacote rejeitado (CRC) ou sem confirmação
+        for tentativa in range(self.tentativasConfiguracao):
+            if tentativa:
+                self.metricas.conta('pacotes_reenviados')
+            self._limpaRecepcao()
+            self._escreve(codificaPacote(codigo, dados))
+            if self._aguardaConfirmacao(self.timeoutNegociacao):
+                return True
+        self.metricas.conta('pacotes_recusados')
+        return False
+        
+    def _enviaMensagem(self, codigo, valor1, valor2):
+        # Envia uma mensagem de 5 bytes: ! código valor1 valor2 #
+        self._escreve(self._compoeMensagem(codigo, valor1, valor2))
+        
+    def _negocia(self, codigo, valor1, valor2):
+        # Envia um comando que a placa confirma (placas antigas não respondem)
+        self._limpaRecepcao()
+        self._enviaMensagem(codigo, valor1, valor2)
+        if self._aguardaByte(self.rec_sucesso, self.timeoutNegociacao):
+            return True
+        self.metricas.conta('negociacoes_recusadas')
+        return False
+        
+    def negociaModoBloco(self, tamanhoBloco, janela):
+        '''
+        Pede à placa a transferência em blocos com janela deslizante
+        Retorna False caso a placa não responda (envio valor a valor)
+        '''
+        self.modoBloco = self._negocia(self.modo_bloco, tamanhoBloco, janela)
+        self.modoBloco = self.modoBloco and tamanhoBloco > 0 and janela > 0
+        if self.modoBloco:
+            self.tamanhoBloco = tamanhoBloco
+            self.janelaBloco = janela
+        self.analisador.modoBloco = self.modoBloco
+        return self.modoBloco
+        
+    def _leDisponiveis(self):
+        # Lê os bytes disponíveis de uma vez ou bloqueia até o primeiro
+        # byte (no máximo intervaloLeitura)
+        return self.ser.read(max(1, self.ser.in_waiting))
+        
+    def _recebeBytes(self, prazo, etapa='recepcao'):
+        # Entrega ao analisador os bytes recebidos até o prazo (None = sem limite)
+        # A espera pelos bytes é somada à etapa das métricas
+        limite = None if prazo is None else perf_counter() + prazo
+        with self.metricas.etapa(etapa):
+            while True:
+                if self._cancelado:
+                    self._interrompe()
+                dados = self._leDisponiveis()
+                if dados:
+                    break
+                if limite is not None and perf_counter() >= limite:
+                    return False
+        self._alimenta(dados)
+        return True
+        
+    def _alimenta(self, dados):
+        # Extrai as mensagens dos bytes recebidos e atualiza as métricas
+        self.bytesRecebidos += len(dados)
+        analisador = self.analisador
+        extraidos, ressincronizacoes = analisador.extraidos, analisador.ressincronizacoes
+        with self.metricas.etapa('analise'):
+            analisador.alimenta(dados)
+        self.metricas.conta('bytes_recebidos', len(dados))
+        self.metricas.conta('quadros_recebidos', analisador.extraidos - extraidos)
+        if analisador.ressincronizacoes != ressincronizacoes:
+            self.metricas.conta('ressincronizacoes', analisador.ressincronizacoes - ressincronizacoes)
+                
+    def cancela(self, cancelar=True):
+        '''
+        Pede o Cancelamento da Captura em Andamento (Pode Ser Chamado de Outra Thread)
+        A recepção envia o esc à placa e gera EnsaioCancelado.
+        '''
+        self._cancelado = cancelar
+        
+    def _interrompe(self):
+        # Repete o esc enquanto a placa continuar enviando: cada envio em
+        # andamento (varredura, valores ou blocos) é interrompido por um esc
+        self._cancelado = False
+        self.metricas.conta('cancelamentos')
+        self._aguardandoEnsaio = False
+        self._escreve(bytes([self.esc]))
+        limite = perf_counter() + self.prazoResposta
+        ultimo = perf_counter()
+        while perf_counter() - ultimo < self.timeoutNegociacao and perf_counter() < limite:
+            if self._leDisponiveis():
+                ultimo = perf_counter()
+                self._escreve(bytes([self.esc]))
+        self._limpaRecepcao()
+        raise EnsaioCancelado("Captura cancelada")
+        
+    def _aguardaDados(self):
+        # Os resultados do ensaio só chegam após a varredura (_calculaPrazoEnsaio)
+        prazo = self._prazoVarredura if self._aguardandoEnsaio else self.prazoResposta
+        etapa = 'espera_placa' if self._aguardandoEnsaio else 'recepcao'
+        if not self._recebeBytes(prazo, etapa):
+            raise TempoEsgotado("A placa não respondeu em %g s" % prazo)
+        self._aguardandoEnsaio = False
+        
+    def _aguardaByte(self, byte_esperado, timeout):
+        # Aguarda um byte específico até o tempo limite
+        limite = perf_counter() + timeout
+        while perf_counter() < limite:
+            if byte_esperado in self._leDisponiveis():
+                return True
+        return False
+        
+    def _aguardaConfirmacao(self, timeout):
+        # Aguarda a confirmação (True) ou a falha (False) até o tempo limite
+        limite = perf_counter() + timeout
+        while perf_counter() < limite:
+            dados = self._leDisponiveis()
+            if self.rec_sucesso in dados:
+                return True
+            if self.rec_falha in dados:
+                return False
+        return False
+        
+    def identificaPlaca(self):
+        '''
+        Pede a Versão do Protocolo, as Capacidades e o Número de Série da Placa
+        Retorna None caso a placa não responda (firmware original)
+        '''
+        self._zeraSessao()
+        self.analisador.tamanhosPacotes = {self.identifica: 19}
+        self._enviaMensagem(self.identifica, 0, 0)
+        
+        limite = perf_counter() + self.timeoutNegociacao
+        while self.identificacao is None and self._aguardaPacote(limite - perf_counter()):
+            pacote = self.analisador.pacotes.popleft()
+            if pacote is not None and pacote[0] == self.identifica:
+                self.identificacao = self._interpretaIdentificacao(pacote[1])
+        
+        self.analisador.tamanhosPacotes = {}
+        self._suportaContinuo = self._capacidades(self.cap_continuo)
+        return self.identificacao
+        
+    def iniciaEnsaio(self, continuo=False, bruto=False, regime=None):
+        with self.metricas.etapa('inicio'):
+            # Limpa o buffer
+            self._limpaRecepcao()
             
-        # Envia o código de escape
-        self.ser.write(bytes([self.esc]))
-        self.ser.flush()
-        while(self.ser.out_waiting > 0): sleep(self.serialDelay)
+            # Envia o código de escape
+            self._escreve(bytes([self.esc]))
+        
+            # Inicia cada captura quando a impedância estabiliza dentro da
+            # tolerância relativa regime (o fator de regime vira a espera máxima)
+            self.modoRegime = False
+            if regime and self._capacidades(self.cap_regime):
+                self.modoRegime = self._negocia(self.modo_regime, *self._compoeTolerancia(regime))
+        
+            # Pede as amostras de cada frequência em vez das impedâncias
+            self.modoBruto = False
+            if bruto and self._capacidades(self.cap_bruto):
+                self.modoBruto = self._negocia(self.modo_bruto, 1, 0)
+        
+            # Pede o envio de cada ponto assim que é calculado
+            self.modoContinuo = False
+            if continuo and self._suportaContinuo and not self.modoBruto:
+                self.modoContinuo = self._negocia(self.modo_continuo, 1, 0)
+            if self.modoContinuo:
+                self.analisador.tamanhosPacotes = {self.ponto_dados: 14, self.fim_pontos: 2}
+            else:
+                self.analisador.tamanhosPacotes = {}
+        
+            # Envia comando para iniciar o ensaio
+            self._prazoVarredura = self._calculaPrazoEnsaio()
+            self._enviaComando(self.inicia_ensaio)
+            self._aguardandoEnsaio = True
+        
         
-        # Envia comando para iniciar o ensaio
-        self._enviaComando(self.inicia_ensaio)
+    def _limpaRecepcao(self):
+        # Descarta os bytes recebidos e as mensagens ainda não lidas
+        self.analisador.limpa()
+        try:
+            self.ser.reset_input_buffer()
+        except serial.SerialException:
+            raise
+        except Exception as exc:
+            # termios.error em um descritor inválido (placa desconectada)
+            raise serial.SerialException("Falha ao limpar a recepção: %s" % exc)
         
+    def _recebeQuadro(self):
+        # Recebe até haver uma mensagem válida
+        quadros = self.analisador.quadros
+        while not quadros:
+            self._aguardaDados()
+        return quadros.popleft()
         
     def recebeMensagem(self):
-        sucesso = False
-        mensagem = ['\x00','\x00']
-        
-        # Recebe até a mensagem ser válida
-        while sucesso == False:
-                    
-            # Recebe o primeiro byte
-            while(self.ser.in_waiting == 0): sleep(self.serialDelay)   
-            byte_rec = self.ser.read(1)   
-              
-            # Checa o byte de inicio da mensagem
-            if (byte_rec == bytes([self.mens_inicio])):
-                
-                # Recebe o segundo byte
-                while(self.ser.in_waiting == 0): sleep(self.serialDelay)
-                mensagem[0] = self.ser.read(1) 
-                
-                # Recebe o terceiro byte
-                while(self.ser.in_waiting == 0): sleep(self.serialDelay)
-                mensagem[1] = self.ser.read(1)
-                
-                # Recebe o quarto byte
-                while(self.ser.in_waiting == 0): sleep(self.serialDelay)
-                byte_rec = self.ser.read(1)                    
-                       
-                # Verifica o byte final da mensagem
-                if (byte_rec == bytes([self.mens_final])):
-                    sucesso = True         
-                               
-        return mensagem
+        codigo, valor = self._recebeQuadro()
+        return [bytes([codigo]), bytes([valor])]
     
     
     def recebeValor(self):
         nmensagem = 0
         valor_LSB = 0
-        valor_MSB = 0        
         
         # Recebe mensagens até o valor ser válido
         while nmensagem < 2:            
-            mensagem = self.recebeMensagem()
+            codigo, byte_valor = self._recebeQuadro()
                         
             # Verifica se é o byte menos significativo
-            if (nmensagem == 0) and (mensagem[0] == bytes([self.byte_LS])):
+            if (nmensagem == 0) and (codigo == self.byte_LS):
                 # Grava o byte menos significativo
-                valor_LSB = int.from_bytes(mensagem[1], byteorder='big')
+                valor_LSB = byte_valor
                 nmensagem += 1
             # Verifica se é o byte mais significativo
-            elif (nmensagem == 1) and (mensagem[0] == bytes([self.byte_MS])):
-                # Grava o byte menos significativo
-                valor_MSB = int.from_bytes(mensagem[1], byteorder='big')
-                
+            elif (nmensagem == 1) and (codigo == self.byte_MS):
                 # Compõe o valor
-                valor = int.from_bytes([valor_MSB, valor_LSB], byteorder='big')               
+                valor = (byte_valor << 8) | valor_LSB
                 
                 # Avisa que o valor foi recebido com sucesso
-                self.ser.write(bytes([self.rec_sucesso]))
-                self.ser.flush()
-                while(self.ser.out_waiting > 0): sleep(self.serialDelay)            
+                self._escreve(bytes([self.rec_sucesso]))
                 nmensagem += 1
             else:
                 # Tenta novamente
                 print("Falha ao receber valor.")
-                self.ser.write(bytes([self.rec_falha]))
-                self.ser.flush()
-                while(self.ser.out_waiting > 0): sleep(self.serialDelay)
+                self.metricas.conta('valores_rejeitados')
+                self._escreve(bytes([self.rec_falha]))
                 nmensagem = 0
         
         return valor
     
     
+    def _recebeBloco(self):
+        # Recebe até haver um bloco (ou um bloco inválido, None)
+        blocos = self.analisador.blocos
+        while not blocos:
+            self._aguardaDados()
+        return blocos.popleft()
+    
+    
+    def _recebeValoresBloco(self):
+        # Confirma cada bloco ou pede o reenvio dos blocos inválidos
+        recepcao = RecepcaoBlocos(self.tamanhoBloco, self._ultimaTransferencia)
+        while not recepcao.completa:
+            codigo, seq = recepcao.trata(self._recebeBloco())
+            if codigo == self.bloco_reenv:
+                self.metricas.conta('blocos_reenvio')
+            self._enviaMensagem(codigo, seq & 0x00FF, (seq & 0xFF00) >> 8)
+        
+        self._ultimaTransferencia = recepcao.transferencia
+        return recepcao.valores()
+    
+    
     def recebeValores(self):
+        # Utiliza a transferência em blocos caso tenha sido negociada
+        if self.modoBloco:
+            return self._recebeValoresBloco()
+        
         # Recebe o número de valores
         tamanho = self.recebeValor()        
         
-        valores = []
+        valores = np.empty(tamanho, dtype=np.uint16)
        
         # Recebe cada um dos valores
-        while(len(valores) < tamanho):
-            valores.append(self.recebeValor())
+        for i in range(tamanho):
+            valores[i] = self.recebeValor()
             
         return valores
     
     
     def recebeImpedancias(self):
-        # Recebe as frequencias
-        impFreq = []
+        # Recebe as frequencias (float32 em palavras LSB e MSB)
         impFreqLSB = self.recebeValores()  
         impFreqMSB = self.recebeValores()
-        for MSB, LSB in zip(impFreqMSB, impFreqLSB):
-            iMSB = struct.pack('H', MSB)
-            iLSB = struct.pack('H', LSB)
-            valB = struct.pack('B'*4, iLSB[0], iLSB[1], iMSB[0], iMSB[1])
-            valF = struct.unpack('f', valB)
-            impFreq.append(valF[0])        
+        with self.metricas.etapa('decodificacao'):
+            impFreq = compoeFloats(impFreqLSB, impFreqMSB)
             
         # Recebe as magnitudes
-        impMag = []
         impMagLSB = self.recebeValores()  
         impMagMSB = self.recebeValores()
-        for MSB, LSB in zip(impMagMSB, impMagLSB):
-            iMSB = struct.pack('H', MSB)
-            iLSB = struct.pack('H', LSB)
-            valB = struct.pack('B'*4, iLSB[0], iLSB[1], iMSB[0], iMSB[1])
-            valF = struct.unpack('f', valB)
-            impMag.append(valF[0])        
-        
-    # Recebe as fases
-        impFas = []
+        with self.metricas.etapa('decodificacao'):
+            impMag = compoeFloats(impMagLSB, impMagMSB)
+        
+        # Recebe as fases
         impFasLSB = self.recebeValores()  
         impFasMSB = self.recebeValores()
-        for MSB, LSB in zip(impFasMSB, impFasLSB):
-            iMSB = struct.pack('H', MSB)
-            iLSB = struct.pack('H', LSB)
-            valB = struct.pack('B'*4, iLSB[0], iLSB[1], iMSB[0], iMSB[1])
-            valF = struct.unpack('f', valB)
-            impFas.append(valF[0])
+        with self.metricas.etapa('decodificacao'):
+            impFas = compoeFloats(impFasLSB, impFasMSB)
             
         return impFreq, impMag, impFas
 
         
+    def _aguardaPacote(self, timeout):
+        # Aguarda um pacote (ou um pacote inválido) até o tempo limite
+        pacotes = self.analisador.pacotes
+        limite = perf_counter() + timeout
+        while not pacotes:
+            restante = limite - perf_counter()
+            if restante <= 0 or not self._recebeBytes(restante, 'espera_pacote'):
+                break
+        return len(pacotes) > 0
+    
+    
+    def _pedePonto(self, indice):
+        self.metricas.conta('pontos_reenvio')
+        self._enviaMensagem(self.reenvia_ponto, indice & 0x00FF, (indice & 0xFF00) >> 8)
+    
+    
+    def iterImpedancias(self):
+        '''
+        Recebe as impedâncias ponto a ponto durante o ensaio
+        Gera (frequência, magnitude, fase) assim que cada ponto é calculado
+        '''
+        # Placas sem o modo contínuo enviam todos os pontos no final
+        if not self.modoContinuo:
+            for ponto in zip(*self.recebeImpedancias()):
+                yield ponto
+            return
+        
+        recepcao = RecepcaoPontos()
+        ultimoPacote = perf_counter()
+        while not recepcao.completa:
+            # Sem pontos por um intervalo: pede o fim (ignorado durante o ensaio)
+            if not self._aguardaPacote(self.timeoutPonto):
+                if self.prazoEnsaio is not None and perf_counter() - ultimoPacote > self.prazoEnsaio:
+                    raise TempoEsgotado("Nenhum ponto recebido em %g s" % self.prazoEnsaio)
+                self._pedePonto(REENVIA_FIM)
+                continue
+            ultimoPacote = perf_counter()
+            
+            ponto, pedidos = recepcao.trata(self.analisador.pacotes.popleft())
+            # Pede o reenvio do fim ou dos pontos perdidos
+            for indice in pedidos:
+                self._pedePonto(indice)
+            if ponto is not None:
+                self.metricas.ponto(ponto[0])
+                yield ponto
+        
+        self.modoContinuo = False
+        self.analisador.tamanhosPacotes = {}
+    
+    
+    def iterAmostras(self):
+        '''
+        Recebe as amostras de cada frequência no modo de amostras (modoBruto)
+        Gera (frequência, amostras da tensão, amostras da corrente) durante o
+        ensaio; uma transferência vazia encerra a varredura
+        '''
+        try:
+            while True:
+                palavras = self.recebeValores()
+                if len(palavras) == 0:
+                    break
+                freq = compoeFloats(palavras[0::2], palavras[1::2])[0]
+                saida = self.recebeValores()
+                entrada = self.recebeValores()
+                self.metricas.ponto(freq)
+                yield freq, saida, entrada
+        finally:
+            self.modoBruto = False
+    
+    
+    def recebeAmostras(self):
+        '''
+        Recebe todas as amostras do ensaio no modo de amostras
+        Retorna as frequências (m,) e as amostras (m, N) da tensão e da corrente
+        '''
+        capturas = list(self.iterAmostras())
+        if not capturas:
+            vazio = np.empty((0, 0), dtype=np.uint16)
+            return np.empty(0, dtype=np.float32), vazio, vazio
+        freq, saida, entrada = zip(*capturas)
+        return np.array(freq), np.vstack(saida), np.vstack(entrada)
+    
+    
     def __del__(self):        
-        # Limpa o buffer
-        while(self.ser.in_waiting > 0): self.ser.read(1)
-        while(self.ser.out_waiting > 0): sleep(self.serialDelay)
-        # Fecha a porta serial
-        self.ser.close()
-        
\ No newline at end of file
+        # Limpa o buffer e fecha a porta serial
+        if 'ser' in self.__dict__:
+            self.fecha()
+        
+
+
+from .assincrono import AsyncProto
@@ -0,0 +1,619 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: assincrono.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Protocolo de comunicação serial com asyncio
+A porta é registrada no loop de eventos (add_reader/add_writer), de modo que
+um único processo controla várias placas sem uma thread por porta
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+
+import numpy as np
+import serial
+
+from . import Proto, TempoEsgotado, EnsaioCancelado, contaPontos
+from .quadros import AnalisadorQuadros, RecepcaoBlocos, RecepcaoPontos, REENVIA_FIM, compoeFloats, codificaPacote
+
+
+class AsyncProto(Proto):
+    '''
+    Protocolo de comunicação Serial com asyncio
+
+    Os códigos, prazos e a composição das mensagens são os de Proto. Os
+    métodos que usam a porta são corrotinas:
+
+        async with AsyncProto(porta) as ard:
+            await ard.setaFrequenciaInicial(20)
+            await ard.iniciaEnsaio()
+            freq, mag, fas = await ard.recebeImpedancias()
+    '''
+    def __init__(self, porta=None, modoBloco=True, loop=None):
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        # Porta serial própria (uma instância por placa)
+        self.ser = serial.Serial()
+        self.porta = porta
+        self._modoBlocoPedido = modoBloco
+
+        # Analisador das mensagens recebidas
+        self.analisador = AnalisadorQuadros()
+        self._ultimaTransferencia = None
+        self.modoBloco = False
+        self.modoContinuo = False
+        self._suportaContinuo = False
+        self.modoBruto = False
+        self.modoRegime = False
+        self.identificacao = None
+        self._configuracao = None
+        self._pontosVarredura = None
+        self._pontosLista = None
+        self._fatorRegime = 0.0
+        self._prazoVarredura = self.prazoEnsaio
+        self.bytesRecebidos = 0
+
+        # Bytes recebidos pelo loop de eventos e ainda não analisados
+        self._recebidos = bytearray()
+        self._espera = None
+        self._erro = None
+        self._fd = None
+
+    async def abre(self, serie=None):
+        '''
+        Abre a Porta Serial e Inicia a Sessão com a Placa
+        Com serie, aceita apenas a placa com este número de série
+        '''
+        self.ser.baudrate = 230400
+        self.ser.timeout = 0
+        self.ser.write_timeout = 0
+
+        erro = None
+        for porta, conhecida in self._candidatas(serie):
+            try:
+                self.ser.port = porta
+                self.ser.open()
+                await asyncio.sleep(0.02)
+                # A porta é aberta sem bloqueio: o loop avisa quando há bytes
+                self._erro = None
+                self._fd = self.ser.fileno()
+                self.loop.add_reader(self._fd, self._leitura)
+                await self._iniciaSessao()
+            except serial.SerialException as exc:
+                print("Erro Serial: %s"%(exc))
+                erro = exc
+                self.fecha()
+                continue
+            if self._aceita(conhecida, serie):
+                print("Porta serial %s aberta." %(self.ser.port))
+                return self
+            self.fecha()
+
+        if erro is not None:
+            print("Não foi possível abrir a porta Serial: %s"%(erro))
+            raise erro
+        raise serial.SerialException("Nenhuma placa encontrada")
+
+    async def _iniciaSessao(self):
+        # Limpa o buffer e envia o código de escape
+        self._limpaRecepcao()
+        await self._escreve(bytes([self.esc]))
+
+        # Placas que não se identificam têm o firmware original
+        await self.identificaPlaca()
+        if self._capacidades(self.cap_blocos) and self._modoBlocoPedido:
+            await self.negociaModoBloco(self.tamanhoBloco, self.janelaBloco)
+
+    async def reconecta(self, tentativas=5, intervalo=1.0):
+        '''
+        Reabre a Sessão com a Mesma Placa (ex.: após reiniciar ou desconectar)
+        '''
+        serie = self.identificacao['serie'] if self.identificacao is not None else None
+        self.fecha()
+        self.metricas.conta('reconexoes')
+        for tentativa in range(tentativas):
+            try:
+                await self.abre(serie)
+                return
+            except serial.SerialException:
+                if tentativa == tentativas - 1:
+                    raise
+                await asyncio.sleep(intervalo)
+
+    def fecha(self):
+        '''
+        Remove a Porta do Loop de Eventos e a Fecha
+        '''
+        if self._fd is not None:
+            if not self.loop.is_closed():
+                self.loop.remove_reader(self._fd)
+            self._fd = None
+        if self.ser.is_open:
+            try:
+                self._limpaRecepcao()
+                self.ser.close()
+            except Exception:
+                # Placa já desconectada
+                self.ser.fd = None
+                self.ser.is_open = False
+
+    async def __aenter__(self):
+        return await self.abre()
+
+    async def __aexit__(self, *args):
+        self.fecha()
+
+    def __del__(self):
+        if 'ser' in self.__dict__:
+            self.fecha()
+
+    def _acorda(self):
+        if self._espera is not None and not self._espera.done():
+            self._espera.set_result(None)
+
+    def _leitura(self):
+        # Chamado pelo loop de eventos quando a porta tem bytes
+        try:
+            dados = os.read(self._fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            dados = b''
+            self._erro = serial.SerialException("Falha na leitura da porta %s: %s" % (self.ser.port, exc))
+        if not dados:
+            # Placa desconectada
+            if self._erro is None:
+                self._erro = serial.SerialException("Porta %s desconectada" % self.ser.port)
+            self.loop.remove_reader(self._fd)
+        self._recebidos += dados
+        self._acorda()
+
+    async def _escreve(self, dados):
+        # Escreve sem bloquear o loop, aguardando a porta quando está cheia
+        dados = memoryview(bytes(dados))
+        self.metricas.conta('bytes_enviados', len(dados))
+        limite = self.loop.time() + self.prazoEscrita
+        while dados:
+            try:
+                dados = dados[os.write(self._fd, dados):]
+            except (BlockingIOError, InterruptedError):
+                pass
+            if not dados:
+                break
+            livre = self.loop.create_future()
+            self.loop.add_writer(self._fd, lambda: livre.done() or livre.set_result(None))
+            try:
+                await asyncio.wait_for(livre, max(0, limite - self.loop.time()))
+            except asyncio.TimeoutError:
+                raise TempoEsgotado("Escrita na porta %s não concluída em %g s"
+                                    % (self.ser.port, self.prazoEscrita)) from None
+            finally:
+                self.loop.remove_writer(self._fd)
+
+    async def _leDisponiveis(self, prazo):
+        # Retorna os bytes recebidos ou aguarda até o prazo (None = sem limite)
+        if not self._recebidos and self._erro is None:
+            self._espera = self.loop.create_future()
+            try:
+                await asyncio.wait_for(self._espera, prazo)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._espera = None
+        if self._erro is not None and not self._recebidos:
+            raise self._erro
+        dados = bytes(self._recebidos)
+        del self._recebidos[:]
+        return dados
+
+    async def _recebeBytes(self, prazo, etapa='recepcao'):
+        # Entrega ao analisador os bytes recebidos até o prazo
+        if self._cancelado:
+            await self._interrompe()
+        with self.metricas.etapa(etapa):
+            dados = await self._leDisponiveis(prazo)
+        # cancela() também acorda a espera
+        if self._cancelado:
+            await self._interrompe()
+        if dados:
+            self._alimenta(dados)
+        return len(dados) > 0
+
+    def cancela(self, cancelar=True):
+        '''
+        Pede o Cancelamento da Captura em Andamento (Pode Ser Chamado de Outra Thread)
+        '''
+        self._cancelado = cancelar
+        if cancelar:
+            self.loop.call_soon_threadsafe(self._acorda)
+
+    async def _interrompe(self):
+        # Repete o esc enquanto a placa continuar enviando (ver Proto._interrompe)
+        self._cancelado = False
+        self.metricas.conta('cancelamentos')
+        self._aguardandoEnsaio = False
+        await self._escreve(bytes([self.esc]))
+        limite = self.loop.time() + self.prazoResposta
+        while True:
+            silencio = min(self.timeoutNegociacao, limite - self.loop.time())
+            if silencio <= 0 or not await self._leDisponiveis(silencio):
+                break
+            await self._escreve(bytes([self.esc]))
+        self._limpaRecepcao()
+        raise EnsaioCancelado("Captura cancelada")
+
+    async def _aguardaDados(self):
+        # Os resultados do ensaio só chegam após a varredura (_calculaPrazoEnsaio)
+        prazo = self._prazoVarredura if self._aguardandoEnsaio else self.prazoResposta
+        etapa = 'espera_placa' if self._aguardandoEnsaio else 'recepcao'
+        if not await self._recebeBytes(prazo, etapa):
+            raise TempoEsgotado("A placa não respondeu em %g s" % prazo)
+        self._aguardandoEnsaio = False
+
+    async def _aguardaByte(self, byte_esperado, timeout):
+        # Aguarda um byte específico até o tempo limite
+        limite = self.loop.time() + timeout
+        while True:
+            restante = limite - self.loop.time()
+            if restante <= 0:
+                return False
+            if byte_esperado in await self._leDisponiveis(restante):
+                return True
+
+    async def _aguardaConfirmacao(self, timeout):
+        # Aguarda a confirmação (True) ou a falha (False) até o tempo limite
+        limite = self.loop.time() + timeout
+        while True:
+            restante = limite - self.loop.time()
+            if restante <= 0:
+                return False
+            dados = await self._leDisponiveis(restante)
+            if self.rec_sucesso in dados:
+                return True
+            if self.rec_falha in dados:
+                return False
+
+    def _limpaRecepcao(self):
+        # Descarta os bytes recebidos e as mensagens ainda não lidas
+        del self._recebidos[:]
+        super()._limpaRecepcao()
+
+    async def _enviaComando(self, comando):
+        await self._escreve(self._compoeMensagem(comando, comando, comando))
+
+    async def _setaValor(self, valor, codigoInt, codigoDec=None):
+        self._configuracao = None
+        await self._escreve(self._compoeValor(valor, codigoInt, codigoDec))
+
+    async def setaFrequenciaInicial(self, frequencia):
+        await self._setaValor(frequencia, self.setFreqIniInt, self.setFreqIniDec)
+
+    async def setaFrequenciaFinal(self, frequencia):
+        await self._setaValor(frequencia, self.setFreqFimInt, self.setFreqFimDec)
+
+    async def setaPasso(self, passo):
+        await self._setaValor(passo, self.setPassoInt, self.setPassoDec)
+
+    async def setaFrequenciaRelInicial(self, frequencia):
+        await self._setaValor(frequencia, self.setFreqRelIniInt, self.setFreqRelIniDec)
+
+    async def setaFrequenciaRelFinal(self, frequencia):
+        await self._setaValor(frequencia, self.setFreqRelFimInt, self.setFreqRelFimDec)
+
+    async def setaPassoRel(self, passo):
+        await self._setaValor(passo, self.setPassoRelInt, self.setPassoRelDec)
+
+    async def setaFrequencia(self, frequencia):
+        await self.setaFrequenciaInicial(frequencia)
+        await self.setaFrequenciaFinal(frequencia)
+        await self.setaPasso(0.0)
+        self._pontosVarredura = 1
+
+    async def setaFatorRegime(self, fator):
+        await self._setaValor(fator, self.setFatorRegimeInt, self.setFatorRegimeDec)
+        self._fatorRegime = fator
+
+    async def setaMetodoImpedancia(self, metodo):
+        self._configuracao = None
+        if metodo == 'SWF' or metodo == 0:
+            await self._enviaComando(self.setMetodoSWF)
+        elif metodo == 'ZC' or metodo ==1:
+            await self._enviaComando(self.setMetodoZC)
+
+    async def configuraEnsaio(self, freqInicial, freqFinal, passo, freqRelInicial, freqRelFinal,
+                              passoRel, fatorRegime, metodo):
+        '''
+        Envia a Configuração do Ensaio em um Único Pacote Confirmado pela Placa
+        (ver Proto.configuraEnsaio)
+        '''
+        dados = self._compoeConfiguracao(freqInicial, freqFinal, passo, freqRelInicial, freqRelFinal,
+                                         passoRel, fatorRegime, metodo)
+        self._pontosVarredura = contaPontos(freqInicial, freqFinal, passo, freqRelInicial,
+                                            freqRelFinal, passoRel)
+        self._fatorRegime = fatorRegime
+        if dados == self._configuracao:
+            return
+
+        with self.metricas.etapa('configuracao'):
+            if not self._capacidades(self.cap_configuracao):
+                await self.setaFrequenciaInicial(freqInicial)
+                await self.setaFrequenciaFinal(freqFinal)
+                await self.setaPasso(passo)
+                await self.setaFrequenciaRelInicial(freqRelInicial)
+                await self.setaFrequenciaRelFinal(freqRelFinal)
+                await self.setaPassoRel(passoRel)
+                await self.setaFatorRegime(fatorRegime)
+                await self.setaMetodoImpedancia(metodo)
+                return
+
+            if not await self._enviaPacote(self.configura_ensaio, dados):
+                raise TempoEsgotado("A placa não confirmou a configuração do ensaio")
+            self._configuracao = dados
+
+    async def recebeTemposRegime(self):
+        '''
+        Recebe o Tempo até o Regime Permanente de Cada Ponto do Último Ensaio [s]
+        (ver Proto.recebeTemposRegime)
+        '''
+        if not self._capacidades(self.cap_regime):
+            return None
+        self._limpaRecepcao()
+        await self._enviaComando(self.tempos_regime)
+        return (await self.recebeValores())/1000.0
+
+    async def configuraLista(self, frequencias):
+        '''
+        Envia as Frequências Medidas no Próximo Ensaio, na Ordem Dada
+        (ver Proto.configuraLista)
+        '''
+        dados = self._compoeLista(frequencias)
+        with self.metricas.etapa('configuracao'):
+            if not await self._enviaPacote(self.lista_frequencias, dados):
+                raise TempoEsgotado("A placa não confirmou a lista de frequências")
+        self._pontosLista = len(frequencias)
+
+    async def _enviaPacote(self, codigo, dados):
+        # Reenvia o pacote rejeitado (CRC) ou sem confirmação
+        for tentativa in range(self.tentativasConfiguracao):
+            if tentativa:
+                self.metricas.conta('pacotes_reenviados')
+            self._limpaRecepcao()
+            await self._escreve(codificaPacote(codigo, dados))
+            if await self._aguardaConfirmacao(self.timeoutNegociacao):
+                return True
+        self.metricas.conta('pacotes_recusados')
+        return False
+
+    async def _enviaMensagem(self, codigo, valor1, valor2):
+        await self._escreve(self._compoeMensagem(codigo, valor1, valor2))
+
+    async def _negocia(self, codigo, valor1, valor2):
+        # Envia um comando que a placa confirma (placas antigas não respondem)
+        self._limpaRecepcao()
+        await self._enviaMensagem(codigo, valor1, valor2)
+        if await self._aguardaByte(self.rec_sucesso, self.timeoutNegociacao):
+            return True
+        self.metricas.conta('negociacoes_recusadas')
+        return False
+
+    async def negociaModoBloco(self, tamanhoBloco, janela):
+        '''
+        Pede à placa a transferência em blocos com janela deslizante
+        Retorna False caso a placa não responda (envio valor a valor)
+        '''
+        self.modoBloco = await self._negocia(self.modo_bloco, tamanhoBloco, janela)
+        self.modoBloco = self.modoBloco and tamanhoBloco > 0 and janela > 0
+        if self.modoBloco:
+            self.tamanhoBloco = tamanhoBloco
+            self.janelaBloco = janela
+        self.analisador.modoBloco = self.modoBloco
+        return self.modoBloco
+
+    async def identificaPlaca(self):
+        '''
+        Pede a Versão do Protocolo, as Capacidades e o Número de Série da Placa
+        Retorna None caso a placa não responda (firmware original)
+        '''
+        self._zeraSessao()
+        self.analisador.tamanhosPacotes = {self.identifica: 19}
+        await self._enviaMensagem(self.identifica, 0, 0)
+
+        limite = self.loop.time() + self.timeoutNegociacao
+        while self.identificacao is None and await self._aguardaPacote(limite - self.loop.time()):
+            pacote = self.analisador.pacotes.popleft()
+            if pacote is not None and pacote[0] == self.identifica:
+                self.identificacao = self._interpretaIdentificacao(pacote[1])
+
+        self.analisador.tamanhosPacotes = {}
+        self._suportaContinuo = self._capacidades(self.cap_continuo)
+        return self.identificacao
+
+    async def iniciaEnsaio(self, continuo=False, bruto=False, regime=None):
+        with self.metricas.etapa('inicio'):
+            # Limpa o buffer e envia o código de escape
+            self._limpaRecepcao()
+            await self._escreve(bytes([self.esc]))
+
+            # Regime permanente adaptativo (ver Proto.iniciaEnsaio)
+            self.modoRegime = False
+            if regime and self._capacidades(self.cap_regime):
+                self.modoRegime = await self._negocia(self.modo_regime, *self._compoeTolerancia(regime))
+
+            # Pede as amostras de cada frequência em vez das impedâncias
+            self.modoBruto = False
+            if bruto and self._capacidades(self.cap_bruto):
+                self.modoBruto = await self._negocia(self.modo_bruto, 1, 0)
+
+            # Pede o envio de cada ponto assim que é calculado
+            self.modoContinuo = False
+            if continuo and self._suportaContinuo and not self.modoBruto:
+                self.modoContinuo = await self._negocia(self.modo_continuo, 1, 0)
+            if self.modoContinuo:
+                self.analisador.tamanhosPacotes = {self.ponto_dados: 14, self.fim_pontos: 2}
+            else:
+                self.analisador.tamanhosPacotes = {}
+
+            # Envia comando para iniciar o ensaio
+            self._prazoVarredura = self._calculaPrazoEnsaio()
+            await self._enviaComando(self.inicia_ensaio)
+            self._aguardandoEnsaio = True
+
+    async def _recebeQuadro(self):
+        # Recebe até haver uma mensagem válida
+        quadros = self.analisador.quadros
+        while not quadros:
+            await self._aguardaDados()
+        return quadros.popleft()
+
+    async def recebeMensagem(self):
+        codigo, valor = await self._recebeQuadro()
+        return [bytes([codigo]), bytes([valor])]
+
+    async def recebeValor(self):
+        nmensagem = 0
+        valor_LSB = 0
+
+        # Recebe mensagens até o valor ser válido
+        while nmensagem < 2:
+            codigo, byte_valor = await self._recebeQuadro()
+
+            if (nmensagem == 0) and (codigo == self.byte_LS):
+                valor_LSB = byte_valor
+                nmensagem += 1
+            elif (nmensagem == 1) and (codigo == self.byte_MS):
+                valor = (byte_valor << 8) | valor_LSB
+                await self._escreve(bytes([self.rec_sucesso]))
+                nmensagem += 1
+            else:
+                print("Falha ao receber valor.")
+                self.metricas.conta('valores_rejeitados')
+                await self._escreve(bytes([self.rec_falha]))
+                nmensagem = 0
+
+        return valor
+
+    async def _recebeBloco(self):
+        # Recebe até haver um bloco (ou um bloco inválido, None)
+        blocos = self.analisador.blocos
+        while not blocos:
+            await self._aguardaDados()
+        return blocos.popleft()
+
+    async def _recebeValoresBloco(self):
+        # Confirma cada bloco ou pede o reenvio dos blocos inválidos
+        recepcao = RecepcaoBlocos(self.tamanhoBloco, self._ultimaTransferencia)
+        while not recepcao.completa:
+            codigo, seq = recepcao.trata(await self._recebeBloco())
+            if codigo == self.bloco_reenv:
+                self.metricas.conta('blocos_reenvio')
+            await self._enviaMensagem(codigo, seq & 0x00FF, (seq & 0xFF00) >> 8)
+
+        self._ultimaTransferencia = recepcao.transferencia
+        return recepcao.valores()
+
+    async def recebeValores(self):
+        # Utiliza a transferência em blocos caso tenha sido negociada
+        if self.modoBloco:
+            return await self._recebeValoresBloco()
+
+        # Recebe o número de valores e cada um dos valores
+        tamanho = await self.recebeValor()
+        valores = np.empty(tamanho, dtype=np.uint16)
+        for i in range(tamanho):
+            valores[i] = await self.recebeValor()
+        return valores
+
+    async def recebeImpedancias(self):
+        # Recebe as frequencias, as magnitudes e as fases
+        impedancias = []
+        for _ in range(3):
+            valoresLSB = await self.recebeValores()
+            valoresMSB = await self.recebeValores()
+            with self.metricas.etapa('decodificacao'):
+                impedancias.append(compoeFloats(valoresLSB, valoresMSB))
+        return tuple(impedancias)
+
+    async def _aguardaPacote(self, timeout):
+        # Aguarda um pacote (ou um pacote inválido) até o tempo limite
+        pacotes = self.analisador.pacotes
+        limite = self.loop.time() + timeout
+        while not pacotes:
+            restante = limite - self.loop.time()
+            if restante <= 0 or not await self._recebeBytes(restante, 'espera_pacote'):
+                break
+        return len(pacotes) > 0
+
+    async def _pedePonto(self, indice):
+        self.metricas.conta('pontos_reenvio')
+        await self._enviaMensagem(self.reenvia_ponto, indice & 0x00FF, (indice & 0xFF00) >> 8)
+
+    async def iterImpedancias(self):
+        '''
+        Recebe as impedâncias ponto a ponto durante o ensaio
+        Gera (frequência, magnitude, fase) assim que cada ponto é calculado
+        (async for)
+        '''
+        # Placas sem o modo contínuo enviam todos os pontos no final
+        if not self.modoContinuo:
+            for ponto in zip(*(await self.recebeImpedancias())):
+                yield ponto
+            return
+
+        recepcao = RecepcaoPontos()
+        ultimoPacote = self.loop.time()
+        while not recepcao.completa:
+            # Sem pontos por um intervalo: pede o fim (ignorado durante o ensaio)
+            if not await self._aguardaPacote(self.timeoutPonto):
+                if self.prazoEnsaio is not None and self.loop.time() - ultimoPacote > self.prazoEnsaio:
+                    raise TempoEsgotado("Nenhum ponto recebido em %g s" % self.prazoEnsaio)
+                await self._pedePonto(REENVIA_FIM)
+                continue
+            ultimoPacote = self.loop.time()
+
+            ponto, pedidos = recepcao.trata(self.analisador.pacotes.popleft())
+            # Pede o reenvio do fim ou dos pontos perdidos
+            for indice in pedidos:
+                await self._pedePonto(indice)
+            if ponto is not None:
+                self.metricas.ponto(ponto[0])
+                yield ponto
+
+        self.modoContinuo = False
+        self.analisador.tamanhosPacotes = {}
+
+    async def iterAmostras(self):
+        '''
+        Recebe as amostras de cada frequência no modo de amostras (modoBruto)
+        Gera (frequência, amostras da tensão, amostras da corrente) durante o
+        ensaio (async for)
+        '''
+        try:
+            while True:
+                palavras = await self.recebeValores()
+                if len(palavras) == 0:
+                    break
+                freq = compoeFloats(palavras[0::2], palavras[1::2])[0]
+                saida = await self.recebeValores()
+                entrada = await self.recebeValores()
+                self.metricas.ponto(freq)
+                yield freq, saida, entrada
+        finally:
+            self.modoBruto = False
+
+    async def recebeAmostras(self):
+        # Todas as amostras do ensaio: frequências (m,) e amostras (m, N)
+        capturas = [captura async for captura in self.iterAmostras()]
+        if not capturas:
+            vazio = np.empty((0, 0), dtype=np.uint16)
+            return np.empty(0, dtype=np.float32), vazio, vazio
+        freq, saida, entrada = zip(*capturas)
+        return np.array(freq), np.vstack(saida), np.vstack(entrada)
@@ -0,0 +1,229 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: metricas.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Métricas da comunicação e do ensaio: tempo de cada etapa, bytes e
+mensagens recebidos, pedidos de reenvio, ressincronizações e o tempo de
+cada frequência
+Por padrão Proto e Ensaio usam METRICAS_NULAS, que não registra nada;
+uma instância de Metricas registra o último ensaio e os totais, entrega
+um relatório (dicionário) e grava o formato de texto do Prometheus
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+import os
+from time import perf_counter, time
+
+# Descrição dos contadores exportados (os demais usam o próprio nome)
+DESCRICOES = {
+    'bytes_recebidos': 'Bytes recebidos da placa (sem as confirmações)',
+    'bytes_enviados': 'Bytes enviados à placa',
+    'quadros_recebidos': 'Mensagens, blocos e pacotes válidos recebidos',
+    'ressincronizacoes': 'Mensagens, blocos e pacotes inválidos descartados',
+    'valores_rejeitados': 'Valores rejeitados (n) no envio valor a valor',
+    'blocos_reenvio': 'Pedidos de reenvio de blocos',
+    'pontos_reenvio': 'Pedidos de reenvio de pontos (ou do fim) do ensaio contínuo',
+    'pacotes_reenviados': 'Reenvios de pacotes sem confirmação',
+    'pacotes_recusados': 'Pacotes não confirmados após todas as tentativas',
+    'negociacoes_recusadas': 'Modos pedidos sem resposta da placa',
+    'reconexoes': 'Reconexões da porta serial',
+    'cancelamentos': 'Capturas canceladas',
+    'pontos': 'Pontos (frequências) recebidos',
+    'ensaios': 'Ensaios executados',
+}
+PREFIXO = 'paraf_'
+
+
+class _EtapaNula(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_ETAPA_NULA = _EtapaNula()
+
+
+class MetricasNulas(object):
+    '''
+    Métricas Desligadas: os Registros Não Fazem Nada
+    '''
+    ativo = False
+
+    def conta(self, nome, valor=1):
+        pass
+
+    def etapa(self, nome):
+        return _ETAPA_NULA
+
+    def ponto(self, freq):
+        pass
+
+    def iniciaEnsaio(self):
+        pass
+
+    def finalizaEnsaio(self):
+        pass
+
+    def relatorio(self):
+        return None
+
+
+METRICAS_NULAS = MetricasNulas()
+
+
+class _Etapa(object):
+    # Soma a duração do bloco with na etapa (no ensaio e nos totais)
+    __slots__ = ('metricas', 'nome', 'inicio')
+
+    def __init__(self, metricas, nome):
+        self.metricas = metricas
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        duracao = perf_counter() - self.inicio
+        for etapas in (self.metricas.etapas, self.metricas.etapasTotais):
+            soma = etapas.get(self.nome)
+            if soma is None:
+                etapas[self.nome] = [duracao, 1]
+            else:
+                soma[0] += duracao
+                soma[1] += 1
+        return False
+
+
+class Metricas(MetricasNulas):
+    '''
+    Métricas do Último Ensaio e Totais desde a Criação
+
+    Cada etapa (with metricas.etapa('transferencia'): ...) soma a duração e
+    o número de execuções; etapas aninhadas são contadas nas duas. ponto()
+    marca a chegada de cada frequência e guarda o tempo desde a anterior.
+    '''
+    ativo = True
+
+    def __init__(self):
+        self.totais = {}
+        self.etapasTotais = {}
+        self._zeraEnsaio()
+
+    def _zeraEnsaio(self):
+        self.contadores = {}
+        self.etapas = {}
+        self.pontos = []
+        self.inicio = perf_counter()
+        self.fim = None
+        self._ultimoPonto = self.inicio
+        self.data = time()
+
+    def iniciaEnsaio(self):
+        '''
+        Começa o Registro de um Novo Ensaio (os Totais Continuam)
+        '''
+        self._zeraEnsaio()
+        self.conta('ensaios')
+
+    def finalizaEnsaio(self):
+        '''
+        Marca o Fim do Ensaio (a Duração Deixa de Contar)
+        '''
+        self.fim = perf_counter()
+
+    def conta(self, nome, valor=1):
+        self.contadores[nome] = self.contadores.get(nome, 0) + valor
+        self.totais[nome] = self.totais.get(nome, 0) + valor
+
+    def etapa(self, nome):
+        return _Etapa(self, nome)
+
+    def ponto(self, freq):
+        agora = perf_counter()
+        self.pontos.append((float(freq), agora - self._ultimoPonto))
+        self._ultimoPonto = agora
+        self.conta('pontos')
+
+    def relatorio(self):
+        '''
+        Relatório do Último Ensaio
+
+        Retorna um dicionário com a data, a duração (de iniciaEnsaio() a
+        finalizaEnsaio() ou até agora, se o ensaio não terminou), os
+        contadores, as etapas ({nome: {'segundos', 'execucoes'}}) e os pontos
+        [(frequência, segundos desde o ponto anterior)].
+        '''
+        return {
+            'data': self.data,
+            'duracao': (self.fim or perf_counter()) - self.inicio,
+            'contadores': dict(self.contadores),
+            'etapas': {nome: {'segundos': soma[0], 'execucoes': soma[1]} for nome, soma in self.etapas.items()},
+            'pontos': list(self.pontos),
+        }
+
+    def prometheus(self, **rotulos):
+        '''
+        Texto no Formato do Prometheus: Totais (Contadores) e Último Ensaio
+        rotulos: rótulos acrescentados a todas as séries (ex.: bancada='COM3')
+        '''
+        def serie(nome, valor, **extras):
+            todos = dict(rotulos, **extras)
+            texto = ','.join('%s="%s"' % (chave, str(todos[chave]).replace('\\', '\\\\').replace('"', '\\"'))
+                             for chave in sorted(todos))
+            return '%s%s%s %r' % (PREFIXO, nome, '{%s}' % texto if texto else '', float(valor))
+
+        linhas = []
+        for nome in sorted(self.totais):
+            linhas += ['# HELP %s%s_total %s' % (PREFIXO, nome, DESCRICOES.get(nome, nome)),
+                       '# TYPE %s%s_total counter' % (PREFIXO, nome),
+                       serie(nome + '_total', self.totais[nome])]
+        if self.etapasTotais:
+            linhas += ['# HELP %setapa_segundos_total Tempo em cada etapa' % PREFIXO,
+                       '# TYPE %setapa_segundos_total counter' % PREFIXO]
+            linhas += [serie('etapa_segundos_total', soma[0], etapa=nome)
+                       for nome, soma in sorted(self.etapasTotais.items())]
+            linhas += ['# HELP %setapa_execucoes_total Execuções de cada etapa' % PREFIXO,
+                       '# TYPE %setapa_execucoes_total counter' % PREFIXO]
+            linhas += [serie('etapa_execucoes_total', soma[1], etapa=nome)
+                       for nome, soma in sorted(self.etapasTotais.items())]
+
+        # Último ensaio
+        relatorio = self.relatorio()
+        intervalos = [intervalo for freq, intervalo in self.pontos]
+        for nome, valor, descricao in (
+                ('ultimo_ensaio_data_segundos', relatorio['data'], 'Início do último ensaio (época)'),
+                ('ultimo_ensaio_segundos', relatorio['duracao'], 'Duração do último ensaio'),
+                ('ultimo_ensaio_pontos', len(intervalos), 'Pontos do último ensaio'),
+                ('ultimo_ensaio_ponto_max_segundos', max(intervalos, default=0.0),
+                 'Maior intervalo entre pontos do último ensaio')):
+            linhas += ['# HELP %s%s %s' % (PREFIXO, nome, descricao),
+                       '# TYPE %s%s gauge' % (PREFIXO, nome),
+                       serie(nome, valor)]
+        if relatorio['etapas']:
+            linhas += ['# HELP %sultimo_ensaio_etapa_segundos Tempo em cada etapa no último ensaio' % PREFIXO,
+                       '# TYPE %sultimo_ensaio_etapa_segundos gauge' % PREFIXO]
+            linhas += [serie('ultimo_ensaio_etapa_segundos', etapa['segundos'], etapa=nome)
+                       for nome, etapa in sorted(relatorio['etapas'].items())]
+        return '\n'.join(linhas) + '\n'
+
+    def salvaPrometheus(self, caminho, **rotulos):
+        '''
+        Grava o Arquivo .prom para o Coletor de Arquivos de Texto do node_exporter
+        A gravação é atômica (arquivo temporário renomeado)
+        '''
+        temporario = caminho + '.tmp'
+        with open(temporario, 'w') as arquivo:
+            arquivo.write(self.prometheus(**rotulos))
+        os.replace(temporario, caminho)
@@ -0,0 +1,258 @@
+'''
+MEDIÇÃO DE PARÂMETROS DO ALTO-FALANTE COM O ARDUINO
+
+Arquivo: quadros.py
+
+Linguagem: Python 3.6
+
+Descrição:
+Analisador incremental das mensagens !..# recebidas do Arduino
+Inclui os blocos da transferência em blocos (! b ... #)
+e os pacotes de tamanho fixo com CRC (! código ... crc #)
+Estado da recepção das transferências em blocos e dos ensaios contínuos
+
+Implementado no Computador em Python 3.6
+(Código Fonte)
+
+@author: Filipe Sgarabotto Luza
+'''
+# -*- coding: utf-8 -*-
+
+from binascii import crc_hqx
+from collections import deque
+import struct
+
+import numpy as np
+
+# Bytes de início e fim da mensagem (ver Proto.mens_inicio e Proto.mens_final)
+MENS_INICIO = 0x21 # !
+MENS_FINAL  = 0x23 # #
+# Códigos da transferência em blocos (ver Proto.bloco_dados)
+BLOCO_DADOS = 0x62 # b
+BLOCO_CONF  = 0x6B # k
+BLOCO_REENV = 0x72 # r
+# Códigos do ensaio contínuo (ver Proto.ponto_dados)
+PONTO_DADOS = 0x70 # p
+FIM_PONTOS  = 0x66 # f
+# Índice que pede o reenvio do fim do ensaio contínuo
+REENVIA_FIM = 0xFFFF
+
+# Máximo de valores em um bloco (ver Protocolo::VALORES_BLOCO_MAX)
+VALORES_BLOCO_MAX = 128
+# Bytes do bloco além dos valores: ! b id seq(2) tamanho(2) n ... crc(2) #
+BLOCO_CABECALHO = 8
+BLOCO_EXTRA = 11
+
+
+def crc16(dados, crc=0xFFFF):
+    '''
+    CRC-16/CCITT (polinômio 0x1021), como Protocolo::_crc16
+    '''
+    return crc_hqx(dados, crc)
+
+
+def codificaPacote(codigo, dados):
+    '''
+    Compõe um Pacote de Tamanho Fixo como Protocolo::_enviaPacote
+    '''
+    return bytes([MENS_INICIO, codigo]) + bytes(dados) + struct.pack('<H', crc16(dados)) + bytes([MENS_FINAL])
+
+
+def compoeFloats(valoresLSB, valoresMSB):
+    '''
+    Junta as Palavras de 16 bits (LSB, MSB) e as Interpreta como float32
+    '''
+    palavras = np.empty((len(valoresLSB), 2), dtype='<u2')
+    palavras[:, 0] = valoresLSB
+    palavras[:, 1] = valoresMSB
+    return palavras.view('<f4').ravel()
+
+
+def codificaBloco(transferencia, seq, total, dados):
+    '''
+    Compõe um Bloco de Valores como Protocolo::_enviaBloco
+
+    total é o número de valores da transferência e dados os valores do
+    bloco em little-endian.
+    '''
+    cabecalho = struct.pack('<BHHB', transferencia, seq, total, len(dados) // 2)
+    crc = crc16(dados, crc16(cabecalho))
+    return bytes([MENS_INICIO, BLOCO_DADOS]) + cabecalho + bytes(dados) + struct.pack('<H', crc) + bytes([MENS_FINAL])
+
+
+class AnalisadorQuadros(object):
+    '''
+    Máquina de Estados das Mensagens de 4 bytes: ! código valor #
+
+    Os bytes recebidos são acumulados em um bytearray e as mensagens completas
+    são extraídas por blocos. Uma mensagem sem o byte final é descartada
+    inteira e a busca recomeça no byte seguinte, como em Proto.recebeMensagem.
+
+    No modo de blocos também são extraídos os blocos de valores. Um bloco
+    inválido (CRC ou byte final) gera None em blocos e a busca recomeça no
+    byte seguinte ao seu início. Os pacotes de tamanho fixo registrados em
+    tamanhosPacotes (código: bytes de dados) são tratados da mesma forma.
+    '''
+    def __init__(self):
+        self._buffer = bytearray()
+        # Mensagens completas (código, valor)
+        self.quadros = deque()
+        # Blocos completos (transferência, seq, tamanho, dados) ou None
+        self.blocos = deque()
+        self.modoBloco = False
+        # Pacotes completos (código, dados) ou None
+        self.pacotes = deque()
+        self.tamanhosPacotes = {}
+        # Número de mensagens válidas extraídas e de mensagens descartadas
+        self.extraidos = 0
+        self.ressincronizacoes = 0
+
+    def limpa(self):
+        del self._buffer[:]
+        self.quadros.clear()
+        self.blocos.clear()
+        self.pacotes.clear()
+
+    def alimenta(self, dados):
+        '''
+        Adiciona os Bytes Recebidos e Extrai as Mensagens Completas
+        '''
+        buf = self._buffer
+        buf += dados
+        tamanho = len(buf)
+        quadros = self.quadros
+        i = 0
+        while True:
+            # Procura o byte de início da mensagem
+            i = buf.find(MENS_INICIO, i)
+            if i < 0:
+                i = tamanho
+                break
+            # Mensagem incompleta, aguarda os próximos bytes
+            if i + 3 >= tamanho:
+                break
+            # Bloco de valores
+            if self.modoBloco and buf[i + 1] == BLOCO_DADOS:
+                if i + BLOCO_CABECALHO > tamanho:
+                    break
+                n = buf[i + BLOCO_CABECALHO - 1]
+                fim = i + BLOCO_EXTRA + 2*n
+                if n <= VALORES_BLOCO_MAX and fim > tamanho:
+                    break
+                if (n <= VALORES_BLOCO_MAX and buf[fim - 1] == MENS_FINAL and
+                        crc16(buf[i + 2:fim - 3]) == buf[fim - 3] | (buf[fim - 2] << 8)):
+                    transferencia, seq, total = struct.unpack_from('<BHH', buf, i + 2)
+                    self.blocos.append((transferencia, seq, total, bytes(buf[i + BLOCO_CABECALHO:fim - 3])))
+                    self.extraidos += 1
+                    i = fim
+                else:
+                    self.blocos.append(None)
+                    self.ressincronizacoes += 1
+                    i += 1
+                continue
+            # Pacote de tamanho fixo
+            if buf[i + 1] in self.tamanhosPacotes:
+                fim = i + 5 + self.tamanhosPacotes[buf[i + 1]]
+                if fim > tamanho:
+                    break
+                if buf[fim - 1] == MENS_FINAL and crc16(buf[i + 2:fim - 3]) == buf[fim - 3] | (buf[fim - 2] << 8):
+                    self.pacotes.append((buf[i + 1], bytes(buf[i + 2:fim - 3])))
+                    self.extraidos += 1
+                    i = fim
+                else:
+                    self.pacotes.append(None)
+                    self.ressincronizacoes += 1
+                    i += 1
+                continue
+            # Verifica o byte final da mensagem
+            if buf[i + 3] == MENS_FINAL:
+                quadros.append((buf[i + 1], buf[i + 2]))
+                self.extraidos += 1
+            else:
+                self.ressincronizacoes += 1
+            i += 4
+        del buf[:i]
+        return len(quadros) + len(self.blocos) + len(self.pacotes)
+
+
+class RecepcaoBlocos(object):
+    '''
+    Estado da Recepção de uma Transferência em Blocos
+
+    trata() recebe cada bloco extraído pelo analisador (ou None) e retorna a
+    resposta (código, seq) a enviar à placa. Blocos repetidos da transferência
+    anterior são confirmados novamente, pois a confirmação pode ter sido perdida.
+    Os valores de cada bloco são copiados direto para um vetor uint16
+    alocado no primeiro bloco da transferência.
+    '''
+    def __init__(self, tamanhoBloco, ultimaTransferencia=None):
+        self.tamanhoBloco = tamanhoBloco
+        self.ultimaTransferencia = ultimaTransferencia
+        self.transferencia = None
+        self.nBlocos = None
+        self.recebidos = set()
+        self._valores = None
+
+    @property
+    def completa(self):
+        return self.nBlocos is not None and len(self.recebidos) >= self.nBlocos
+
+    def trata(self, bloco):
+        # Bloco inválido: pede o reenvio do primeiro bloco que falta
+        if bloco is None:
+            seq = 0
+            while seq in self.recebidos:
+                seq += 1
+            return BLOCO_REENV, seq
+
+        transferencia, seq, tamanho, dados = bloco
+        # Bloco repetido da transferência anterior (confirmação perdida)
+        if transferencia == self.ultimaTransferencia and self.transferencia != transferencia:
+            return BLOCO_CONF, seq
+
+        self.transferencia = transferencia
+        self.nBlocos = max(1, -(-tamanho // self.tamanhoBloco))
+        if self._valores is None:
+            self._valores = np.empty(tamanho, dtype=np.uint16)
+        # Copia os valores do bloco (little-endian) para a sua posição
+        inicio = seq*self.tamanhoBloco
+        self._valores[inicio:inicio + len(dados)//2] = np.frombuffer(dados, dtype='<u2')
+        self.recebidos.add(seq)
+        return BLOCO_CONF, seq
+
+    def valores(self):
+        return self._valores
+
+
+class RecepcaoPontos(object):
+    '''
+    Estado da Recepção dos Pontos de um Ensaio Contínuo
+
+    trata() recebe cada pacote extraído pelo analisador (ou None) e retorna o
+    ponto novo (frequência, magnitude, fase) ou None e os índices cujo
+    reenvio deve ser pedido à placa.
+    '''
+    def __init__(self):
+        self.recebidos = set()
+        self.total = None
+
+    @property
+    def completa(self):
+        return self.total is not None and len(self.recebidos) >= self.total
+
+    def trata(self, pacote):
+        # Pacote inválido: o fim pode ter sido perdido
+        if pacote is None:
+            return None, [REENVIA_FIM]
+
+        codigo, dados = pacote
+        if codigo == PONTO_DADOS:
+            indice, freq, mag, fas = struct.unpack('<Hfff', dados)
+            if indice not in self.recebidos:
+                self.recebidos.add(indice)
+                return (freq, mag, fas), []
+        elif codigo == FIM_PONTOS:
+            self.total = struct.unpack('<H', dados)[0]
+            # Pede o reenvio dos pontos perdidos
+            return None, [indice for indice in range(self.total) if indice not in self.recebidos]
+        return None, []